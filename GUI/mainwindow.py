@@ -3,42 +3,152 @@ __author__ = 'Владимир'
 import tkinter as tk
 import tkinter.ttk as ttk
 import tkinter.filedialog as filedialog
+import base64
 import os
 import os.path as FS
-import shlex
-import subprocess as ipc
+import queue
+import threading
 import tkinter.messagebox as msgbox
 
+from egraph.graphviz import DotProcess, ImageCache
+
+
+class RenderTask(threading.Thread):
+    """
+    Построение изображений по dot-файлу в фоновом потоке. Результат (задача, изображения по форматам, ошибка)
+    кладётся в очередь, которую окно опрашивает из главного потока. Изображения, уже построенные по такому же
+    dot-коду, берутся из кэша без запуска dot.
+    """
+
+    def __init__(self, path, formats, path_to_dot, timeout, cache, results, export_dir=None):
+        """
+        :param str path: Путь к dot-файлу.
+        :param list[str] formats: Форматы изображений.
+        :param str path_to_dot: Путь к исполняемому файлу dot.
+        :param float timeout: Сколько секунд ждать dot.
+        :param ImageCache cache: Кэш изображений.
+        :param queue.Queue results: Очередь результатов.
+        :param str|None export_dir: Каталог, в который нужно сохранить все изображения.
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.path = path
+        self.formats = formats
+        self.export_dir = export_dir
+        self.timeout = timeout
+        self.cache = cache
+        self.results = results
+        self.process = DotProcess(path_to_dot)
+
+    def run(self):
+        try:
+            with open(self.path, 'rb') as dotfile:
+                script = dotfile.read()
+            images = {}
+            for fmt in self.formats:
+                image = self.cache.get(script, fmt)
+                if image is not None:
+                    images[fmt] = image
+            missing = [fmt for fmt in self.formats if fmt not in images]
+            if len(missing) != 0:
+                # все недостающие форматы строятся одним запуском dot с одной раскладкой
+                rendered = self.process.render(script, missing, self.timeout)
+                for fmt in missing:
+                    self.cache.put(script, fmt, rendered[fmt])
+                images.update(rendered)
+            self.results.put((self, images, None))
+        except Exception as error:
+            # окно ждёт результата каждой задачи: без него индикатор не остановится, а кнопки не разблокируются
+            self.results.put((self, None, error))
+
+    def cancel(self):
+        self.process.cancel()
+
 
 class MainWindow(tk.Frame):
+    # форматы, которые Tk показывает без сторонних библиотек; остальные в просмотре заменяются на png
+    preview_formats = ('png', 'gif')
+    max_zoom = 4
+
     def __init__(self, master=None):
         tk.Frame.__init__(self, master)
 
         self.result = None
         self.path_to_dot = "C:\\Program Files (x86)\\Graphviz2.38\\bin\\dot.exe"
+        self.timeout = 60.0
+        self.poll_interval = 100
+        self.tasks = []
+        self.results = queue.Queue()
+        self.cache = ImageCache()
+        self.current = None
+        self.images = None
+        self.fmt = None
+        self.preview = None
+        self.photo = None
+        self.zoom = 0
 
-        self.pack()
+        self.pack(fill="both", expand=True)
         self.grid_configure(padx=(10, 10), pady=(10, 10))
         self.create_widgets()
         MainWindow.center(master)
 
     def create_widgets(self):
+        controls = tk.Frame(self)
+        controls.pack(side="left", fill="y")
 
-        self.btn_open = tk.Button(self, text="Открыть файл",
+        self.btn_open = tk.Button(controls, text="Открыть файл",
                                   command=self.choose_file)
         self.btn_open.pack(side="top")
 
-        self.lbl_info = tk.Label(self, text="Выберите файл")
+        self.lbl_info = tk.Label(controls, text="Выберите файл")
         self.lbl_info.pack(side="top")
 
-        self.cmbx_formats = ttk.Combobox(self, state="readonly")
+        self.cmbx_formats = ttk.Combobox(controls, state="readonly")
         self.cmbx_formats["values"] = ["png", "svg", "jpg"]
         self.cmbx_formats.current(0)
+        self.cmbx_formats.bind("<<ComboboxSelected>>", self.change_format)
         self.cmbx_formats.pack(side="top")
 
-        self.btn_create_image = tk.Button(self, text="Создать изображение",
+        self.btn_create_image = tk.Button(controls, text="Создать изображение",
                                           command=self.create_image)
-        self.btn_create_image.pack(side="bottom")
+        self.btn_create_image.pack(side="top")
+
+        self.progress = ttk.Progressbar(controls, mode="indeterminate")
+        self.progress.pack(side="top", fill="x")
+
+        self.btn_cancel = tk.Button(controls, text="Отменить", state="disabled",
+                                    command=self.cancel)
+        self.btn_cancel.pack(side="top")
+
+        self.btn_save = tk.Button(controls, text="Сохранить", state="disabled",
+                                  command=self.save_image)
+        self.btn_save.pack(side="top")
+
+        self.btn_export_all = tk.Button(controls, text="Экспортировать во всех форматах",
+                                        command=self.export_all)
+        self.btn_export_all.pack(side="top")
+
+        zoom = tk.Frame(controls)
+        zoom.pack(side="top")
+        tk.Button(zoom, text="-", command=lambda: self.set_zoom(self.zoom - 1)).pack(side="left")
+        tk.Button(zoom, text="1:1", command=lambda: self.set_zoom(0)).pack(side="left")
+        tk.Button(zoom, text="+", command=lambda: self.set_zoom(self.zoom + 1)).pack(side="left")
+
+        preview = tk.Frame(self)
+        preview.pack(side="right", fill="both", expand=True)
+        self.canvas = tk.Canvas(preview, width=640, height=480, background="white")
+        xscroll = tk.Scrollbar(preview, orient="horizontal", command=self.canvas.xview)
+        yscroll = tk.Scrollbar(preview, orient="vertical", command=self.canvas.yview)
+        self.canvas.configure(xscrollcommand=xscroll.set, yscrollcommand=yscroll.set)
+        xscroll.pack(side="bottom", fill="x")
+        yscroll.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+
+        # перетаскивание мышью сдвигает изображение, колесо мыши меняет масштаб
+        self.canvas.bind("<ButtonPress-1>", lambda event: self.canvas.scan_mark(event.x, event.y))
+        self.canvas.bind("<B1-Motion>", lambda event: self.canvas.scan_dragto(event.x, event.y, gain=1))
+        self.canvas.bind("<MouseWheel>", lambda event: self.set_zoom(self.zoom + (1 if event.delta > 0 else -1)))
+        self.canvas.bind("<Button-4>", lambda event: self.set_zoom(self.zoom + 1))
+        self.canvas.bind("<Button-5>", lambda event: self.set_zoom(self.zoom - 1))
 
     def choose_file(self):
         options = {
@@ -50,42 +160,131 @@ class MainWindow(tk.Frame):
             'initialdir': os.getcwd(),
             'initialfile': 'script.dot',
             'parent': self.master,
-            'title': 'Выберите dot файл'
+            'title': 'Выберите dot файлы'
         }
 
-        self.result = filedialog.askopenfilename(**options)
-        self.lbl_info["text"] = "Файл выбран"
+        self.result = list(filedialog.askopenfilenames(**options)) or None
+        self.lbl_info["text"] = "Файл выбран" if self.result is None or len(self.result) == 1 \
+            else "Выбрано файлов: {0}".format(len(self.result))
 
     def create_image(self):
-        cmd = shlex.quote(self.path_to_dot) + ' -T' + self.cmbx_formats.get()
         if self.result is None:
             return
+        for path in self.result:
+            self.start_task(path)
 
-        dotfile = open(self.result)
-        script = dotfile.read()
-        dotfile.close()
+    def change_format(self, event=None):
+        if self.current is not None:
+            self.start_task(self.current)
 
-        dot = ipc.Popen(shlex.split(cmd), stdin=ipc.PIPE, stdout=ipc.PIPE, stderr=ipc.PIPE)
+    def export_all(self):
+        paths = self.result if self.result is not None else [self.current] if self.current is not None else None
+        if paths is None:
+            return
+        directory = filedialog.askdirectory(parent=self.master, title="Выберите каталог для изображений",
+                                            initialdir=FS.dirname(paths[0]))
+        if not directory:
+            return
+        formats = [self.cmbx_formats.get()] + [fmt for fmt in self.cmbx_formats["values"]
+                                               if fmt != self.cmbx_formats.get()]
+        for path in paths:
+            self.start_task(path, formats, directory)
+
+    def start_task(self, path, formats=None, export_dir=None):
+        if formats is None:
+            formats = [self.cmbx_formats.get()]
+        if not any(fmt in MainWindow.preview_formats for fmt in formats):
+            formats = formats + ['png']
+        task = RenderTask(path, formats, self.path_to_dot, self.timeout, self.cache, self.results, export_dir)
+        self.tasks.append(task)
+        task.start()
+        if len(self.tasks) == 1:
+            self.progress.start()
+            self.btn_cancel["state"] = "normal"
+            self.after(self.poll_interval, self.poll_results)
+        self.show_progress()
+
+    def cancel(self):
+        for task in self.tasks:
+            task.cancel()
 
-        dot.stdin.write(script.encode())
-        dot.stdin.close()
+    def show_progress(self):
+        self.lbl_info["text"] = "Выполняется построение: {0}".format(len(self.tasks))
+
+    def poll_results(self):
+        while True:
+            try:
+                task, images, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.tasks.remove(task)
+            if error is not None:
+                if not task.process.cancelled:
+                    msgbox.showerror("Генерация изображения", "{0}: {1}\n{2}".format(
+                        FS.basename(task.path), error, getattr(error, 'stderr', '')))
+            else:
+                if task.export_dir is not None:
+                    self.export_images(task, images)
+                self.show_image(task, images)
+
+        if len(self.tasks) != 0:
+            self.show_progress()
+            self.after(self.poll_interval, self.poll_results)
+            return
+        self.progress.stop()
+        self.btn_cancel["state"] = "disabled"
+        self.lbl_info["text"] = "Готово"
 
-        image = dot.stdout.read()
-        dot.stdout.close()
-        dot.stderr.close()
+    def show_image(self, task, images):
+        """
+        Показывает построенное изображение в окне.
 
-        dot.terminate()
+        :param RenderTask task: Выполненная задача.
+        :param dict[str, bytes] images: Изображения по форматам.
+        """
+        if task.path != self.current:
+            self.zoom = 0
+        self.current = task.path
+        self.images = images
+        self.fmt = task.formats[0]
+        preview = next(fmt for fmt in task.formats if fmt in MainWindow.preview_formats)
+        self.preview = tk.PhotoImage(data=base64.b64encode(images[preview]), format=preview)
+        self.btn_save["state"] = "normal"
+        self.set_zoom(self.zoom)
 
-        filename = FS.splitext(self.result)[0] + "." + self.cmbx_formats.get()
-        imgpath = FS.join(FS.join(FS.dirname(self.result), os.pardir), FS.basename(filename))
+    def set_zoom(self, zoom):
+        if self.preview is None:
+            return
+        self.zoom = max(-MainWindow.max_zoom, min(MainWindow.max_zoom, zoom))
+        photo = self.preview
+        if self.zoom > 0:
+            photo = photo.zoom(self.zoom + 1)
+        elif self.zoom < 0:
+            photo = photo.subsample(1 - self.zoom)
+
+        # ссылку на изображение нужно хранить: иначе Tk удалит его вместе с объектом Python
+        self.photo = photo
+        self.canvas.delete("all")
+        self.canvas.create_image(0, 0, image=photo, anchor="nw")
+        self.canvas.configure(scrollregion=(0, 0, photo.width(), photo.height()))
+
+    def export_images(self, task, images):
+        name = FS.splitext(FS.basename(task.path))[0]
+        for fmt in task.formats:
+            imgfile = open(FS.join(task.export_dir, name + "." + fmt), "wb")
+            imgfile.write(images[fmt])
+            imgfile.close()
+
+    def save_image(self):
+        imgpath = filedialog.asksaveasfilename(parent=self.master, title="Сохранить изображение",
+                                               defaultextension="." + self.fmt,
+                                               initialfile=FS.splitext(FS.basename(self.current))[0] + "." + self.fmt)
+        if not imgpath:
+            return
         imgfile = open(imgpath, "wb")
-        imgfile.write(image)
+        imgfile.write(self.images[self.fmt])
         imgfile.close()
 
-        msgbox.showinfo("Генерация изображения", "Генерация и сохранение заверешены!")
-        tmp = FS.abspath(imgpath)
-        ipc.call(["start", tmp], shell=True)
-
     @staticmethod
     def center(win):
         win.update_idletasks()
@@ -0,0 +1,78 @@
+__author__ = 'Владимир'
+
+# Замер повторного построения после правки одной части, как в редакторе: модель из size групп, в каждой
+# по нескольку символов, утверждений и квантификатор; на каждом шаге меняется текст одного символа в случайной
+# группе. Сравниваются построение без кэша, с LoweringCache и с IncrementalCache. Результаты должны совпадать.
+#
+# Запуск: python -m benchmarks.incremental [размер ...]
+
+import gc
+import random
+import sys
+import time
+
+from egraph.egraph import ExplainingGraph, Text, Assert, AssertType, Subexpression, Quantifier, Charflag, \
+    CharflagType
+from egraph.cache import LoweringCache, IncrementalCache
+
+steps = 20
+
+
+def editor_model(size):
+    """
+    :param int size: Количество групп.
+    :rtype : (ExplainingGraph, list[Text])
+    :return: Модель и символы, которые можно править.
+    """
+    texts = []
+    branch = []
+    for i in range(size):
+        group = Subexpression(i + 1)
+        quantifier = Quantifier(1, None)
+        quantifier.add_branch([Charflag(CharflagType.slashd)])
+        chars = [Text(chr(ord('a') + (i + j) % 26)) for j in range(3)]
+        group.add_branch([Assert(AssertType.slash_b)] + chars + [quantifier])
+        group.add_branch([Text('x'), Text(str(i % 10))])
+        texts += chars
+        branch += [group, Text('-')]
+    graph = ExplainingGraph()
+    graph.add_branch(branch)
+    return graph, texts
+
+
+def measure(size, cache_type):
+    """
+    :rtype : (float, list[str])
+    :return: Среднее время повторного построения в секундах и полученный dot-код каждого шага.
+    """
+    graph, texts = editor_model(size)
+    graph.lowering_cache = cache_type() if cache_type is not None else None
+    graph.to_graph().to_dot()   # первое построение заполняет кэш
+    edits = random.Random(size)
+
+    results = []
+    elapsed = 0.0
+    for _ in range(steps):
+        edits.choice(texts).text = edits.choice('abcdef')
+        gc.collect()
+        start = time.perf_counter()
+        results.append(graph.to_graph().to_dot())
+        elapsed += time.perf_counter() - start
+    return elapsed / steps, results
+
+
+def run(sizes):
+    print('{0:>7} {1:>12} {2:>12} {3:>12}'.format('size', 'no cache', 'lowering', 'incremental'))
+    for size in sizes:
+        plain, expected = measure(size, None)
+        lowering, by_lowering = measure(size, LoweringCache)
+        incremental, by_incremental = measure(size, IncrementalCache)
+        if by_lowering != expected or by_incremental != expected:
+            raise RuntimeError('Построения с кэшем и без кэша разошлись.')
+
+        print('{0:>7} {1:>12} {2:>12} {3:>12}'.format(
+            size, *['{0:.4f}'.format(t) for t in (plain, lowering, incremental)]))
+
+
+if __name__ == '__main__':
+    run([int(arg) for arg in sys.argv[1:]] or [50, 200, 1000])
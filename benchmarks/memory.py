@@ -0,0 +1,119 @@
+__author__ = 'Владимир'
+
+# Замер памяти на один узел модели и на один элемент dot-графа.
+# Узлы модели и dot-элементы создаются в большом количестве, поэтому важен размер каждого объекта.
+#
+# Для сравнения тот же граф строится классами без __slots__: модули egraph.dot и egraph.egraph загружаются
+# повторно из исходного кода, из которого убраны объявления слотов (столбцы "no slots").
+#
+# Запуск: python -m benchmarks.memory [число веток ...]
+
+import ast
+import gc
+import importlib.util
+import sys
+import tracemalloc
+import types
+
+import egraph.egraph
+
+
+def make_graph(branches, model):
+    """
+    Граф-альтернатива из branches веток вида a.(b)+ - по шесть частей модели на ветку.
+
+    :param int branches: Количество веток.
+    :param module model: Модуль модели (egraph.egraph или его копия без слотов).
+    :rtype : (ExplainingGraph, int)
+    :return: Граф и количество частей в нём.
+    """
+    graph = model.ExplainingGraph()
+    for i in range(branches):
+        subexpression = model.Subexpression(i + 1)
+        subexpression.add_branch([model.Text(chr(ord('a') + i % 26))])
+        quantifier = model.Quantifier(1)
+        quantifier.add_branch([subexpression])
+        graph.add_branch([model.Text('a'), model.Charflag(model.CharflagType.dot), model.Text('b'), quantifier])
+    return graph, branches * 6
+
+
+def count_items(graph):
+    """
+    Количество элементов dot-графа, включая вложенные.
+
+    :param IGroupable graph: Граф.
+    :rtype : int
+    """
+    count = 0
+    stack = [graph]
+    while len(stack) != 0:
+        group = stack.pop()
+        count += len(group.items)
+        stack.extend(group.items.groups())
+    return count
+
+
+def unslotted_model():
+    """
+    Копия модулей egraph.dot и egraph.egraph, классы которой объявлены без __slots__.
+
+    :rtype : module
+    :return: Копия модуля egraph.egraph.
+    """
+    dot = sys.modules['egraph.dot']
+    try:
+        for name in ('egraph.dot', 'egraph.egraph'):
+            path = importlib.util.find_spec(name).origin
+            with open(path, encoding='utf-8') as fp:
+                tree = ast.parse(fp.read(), path)
+            for node in ast.walk(tree):
+                if isinstance(node, ast.ClassDef):
+                    node.body = [statement for statement in node.body if not _is_slots(statement)] or [ast.Pass()]
+            module = types.ModuleType(name)
+            module.__file__ = path
+            exec(compile(ast.fix_missing_locations(tree), path, 'exec'), module.__dict__)
+            # копия egraph.egraph импортирует dot-классы через "from egraph.dot import *"
+            sys.modules['egraph.dot'] = module
+    finally:
+        sys.modules['egraph.dot'] = dot
+    return module
+
+
+def _is_slots(statement):
+    return isinstance(statement, ast.Assign) and \
+        any(isinstance(target, ast.Name) and target.id == '__slots__' for target in statement.targets)
+
+
+def measure(size, model):
+    """
+    :param int size: Количество веток.
+    :param module model: Модуль модели.
+    :rtype : (int, float, int, float)
+    :return: Количество частей, байт на часть, количество dot-элементов и байт на элемент.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    graph, parts = make_graph(size, model)
+    built = tracemalloc.get_traced_memory()[0]
+    dot = graph.to_graph()
+    lowered = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    items = count_items(dot)
+    return parts, (built - start) / parts, items, (lowered - built) / items
+
+
+def run(sizes):
+    plain = unslotted_model()
+    print('{0:>8} {1:>10} {2:>14} {3:>10} {4:>10} {5:>14} {6:>10}'.format(
+        'branches', 'parts', 'bytes/part', 'no slots', 'dot items', 'bytes/item', 'no slots'))
+    for size in sizes:
+        _, plain_part, _, plain_item = measure(size, plain)
+        parts, per_part, items, per_item = measure(size, egraph.egraph)
+        print('{0:>8} {1:>10} {2:>14.1f} {3:>10.1f} {4:>10} {5:>14.1f} {6:>10.1f}'.format(
+            size, parts, per_part, plain_part, items, per_item, plain_item))
+
+
+if __name__ == '__main__':
+    run([int(arg) for arg in sys.argv[1:]] or [1000, 10000])
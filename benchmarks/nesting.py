@@ -0,0 +1,78 @@
+__author__ = 'Владимир'
+
+# Замер построения и сериализации глубоко вложенных выражений.
+# Итеративные обходы сравниваются с рекурсивными, пока тем хватает стека (sys.getrecursionlimit()).
+#
+# Запуск: python -m benchmarks.nesting [глубина ...]
+
+import gc
+import sys
+import time
+
+from egraph.egraph import DotSubgraph
+from benchmarks.workloads import deep_nesting
+
+
+def lower_recursive(part, id_counter=1, is_sensitive=None):
+    """
+    Рекурсивное построение части через те же генераторы _build, что и Part._lower.
+    """
+    builder = part._build(id_counter, is_sensitive)
+    if builder is None:
+        return part.to_graph(id_counter, is_sensitive)
+
+    result = None
+    while True:
+        try:
+            item, id_counter, is_sensitive = builder.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result = lower_recursive(item, id_counter, is_sensitive)
+
+
+def to_dot_recursive(group, level=0):
+    """
+    Рекурсивная сериализация в том виде, в каком она была до перехода на явный стек.
+    """
+    level += 1
+    result = group._initial(level)
+    result += ''.join([
+        ('\t' * level) + (to_dot_recursive(item, level) if isinstance(item, DotSubgraph) else item.to_dot(level + 1)) +
+        '\n' for item in group.items
+    ])
+    return result + ('\t' * (level - 1)) + '}'
+
+
+def measure(func, *args):
+    gc.collect()
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+    except RecursionError:
+        return None, None
+    return time.perf_counter() - start, result
+
+
+def run(depths):
+    print('{0:>7} {1:>12} {2:>12} {3:>12} {4:>12}'.format(
+        'depth', 'lower iter', 'lower rec', 'dot iter', 'dot rec'))
+    for depth in depths:
+        graph = deep_nesting(depth)
+        top = graph[0][0]
+
+        lower_iter, _ = measure(top._lower)
+        lower_rec, _ = measure(lower_recursive, top)
+
+        dot = graph.to_graph()
+        dot_iter, text = measure(dot.to_dot)
+        dot_rec, text_rec = measure(to_dot_recursive, dot)
+        if text_rec is not None and text_rec != text:
+            raise RuntimeError('Итеративная и рекурсивная сериализации разошлись.')
+
+        print('{0:>7} {1:>12} {2:>12} {3:>12} {4:>12}'.format(
+            depth, *['{0:.4f}'.format(t) if t is not None else 'overflow'
+                     for t in (lower_iter, lower_rec, dot_iter, dot_rec)]))
+
+
+if __name__ == '__main__':
+    run([int(arg) for arg in sys.argv[1:]] or [100, 250, 1000, 10000])
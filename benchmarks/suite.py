@@ -0,0 +1,194 @@
+__author__ = 'Владимир'
+
+# Набор замеров построения графа по стадиям на синтетических моделях (см. benchmarks.workloads).
+# Стадии: deepcopy (копирование модели, как это делают клиенты), case_preprocessing (проходы над моделью:
+# опция регистра и точное совпадение), lowering (остальное время to_graph: построение dot-графа), optimize
+# и del_case_options (проходы над dot-графом) и to_dot. Граф строится настоящим IGraph.to_graph, а время
+# проходов берётся из их статистики (PassManager.stats). Для каждой стадии записываются минимальное
+# и медианное время из repeat запусков.
+#
+# Запуск:
+#     python -m benchmarks.suite run [--workloads ИМЯ ...] [--sizes N ...] [--repeat N] [-o результат.json]
+#     python -m benchmarks.suite compare было.json стало.json [--threshold 0.25]
+# compare завершается с кодом 1, если какая-то стадия замедлилась больше чем на threshold.
+
+import argparse
+import copy
+import datetime
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+
+import egraph
+from egraph.passes import PassStage
+from benchmarks.workloads import workloads, count_parts
+
+stages = ('deepcopy', 'case_preprocessing', 'lowering', 'optimize', 'del_case_options', 'to_dot')
+
+# стадии быстрее этого порога не сравниваются: их время - в основном шум таймера
+noise_floor = 50e-6
+
+
+def measure_once(graph):
+    """
+    Один прогон построения графа с замером каждой стадии.
+
+    :param ExplainingGraph graph: Модель графа.
+    :rtype : (dict[str, float|None], DotDigraph)
+    :return: Время стадий в секундах (None - стадия не выполнилась) и построенный граф.
+    """
+    times = {}
+    gc.collect()
+    start = time.perf_counter()
+    try:
+        copy.deepcopy(graph)
+        times['deepcopy'] = time.perf_counter() - start
+    except RecursionError:
+        times['deepcopy'] = None
+
+    start = time.perf_counter()
+    dot = graph.to_graph()
+    total = time.perf_counter() - start
+
+    by_pass = {stats.name: stats.seconds for stats in graph.passes.stats}
+    model_passes = [item.name for item in graph.passes if item.stage is PassStage.model]
+    times['case_preprocessing'] = sum(by_pass.get(name, 0.0) for name in model_passes)
+    times['lowering'] = total - sum(by_pass.values())
+    times['optimize'] = by_pass.get('optimize')
+    times['del_case_options'] = by_pass.get('del_case_options')
+
+    start = time.perf_counter()
+    dot.to_dot()
+    times['to_dot'] = time.perf_counter() - start
+    return times, dot
+
+
+def run(names, sizes, repeat):
+    """
+    :param list[str] names: Имена нагрузок.
+    :param list[int] sizes: Размеры.
+    :param int repeat: Сколько раз повторять каждый замер.
+    :rtype : dict
+    """
+    results = []
+    for name in names:
+        for size in sizes:
+            graph = workloads[name](size)
+            runs = []
+            for _ in range(repeat):
+                times, dot = measure_once(graph)
+                runs.append(times)
+
+            summary = {}
+            for stage in stages:
+                values = [times[stage] for times in runs if times[stage] is not None]
+                summary[stage] = {'min': min(values), 'median': statistics.median(values)} \
+                    if len(values) != 0 else None
+            results.append({
+                'workload': name,
+                'size': size,
+                'parts': count_parts(graph),
+                'nodes': dot.node_count(),
+                'links': dot.link_count(),
+                'stages': summary,
+            })
+            print_row(results[-1])
+
+    return {
+        'meta': {
+            'egraph': egraph.__version__,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def print_header():
+    print('{0:<18} {1:>6} {2:>7} {3:>7} '.format('workload', 'size', 'parts', 'nodes') +
+          ' '.join(['{0:>12}'.format(stage[:12]) for stage in stages]), file=sys.stderr)
+
+
+def print_row(result):
+    cells = ['{0:>12}'.format('{0:.3f}ms'.format(result['stages'][stage]['min'] * 1000)
+                              if result['stages'][stage] is not None else '-') for stage in stages]
+    print('{0:<18} {1:>6} {2:>7} {3:>7} '.format(result['workload'], result['size'], result['parts'], result['nodes']) +
+          ' '.join(cells), file=sys.stderr)
+
+
+def compare(old, new, threshold):
+    """
+    Сравнивает минимальное время стадий двух прогонов.
+
+    :param dict old: Прежний прогон.
+    :param dict new: Новый прогон.
+    :param float threshold: Допустимое относительное замедление.
+    :rtype : list[(str, int, str, float, float)]
+    :return: Замедлившиеся стадии: нагрузка, размер, стадия, прежнее и новое время.
+    """
+    previous = {(result['workload'], result['size']): result for result in old['results']}
+    regressions = []
+    print('{0:<18} {1:>6} {2:<18} {3:>12} {4:>12} {5:>8}'.format('workload', 'size', 'stage', 'old', 'new', 'ratio'))
+    for result in new['results']:
+        before = previous.get((result['workload'], result['size']))
+        if before is None:
+            continue
+        for stage in stages:
+            a, b = before['stages'].get(stage), result['stages'].get(stage)
+            if a is None or b is None:
+                continue
+            a, b = a['min'], b['min']
+            ratio = b / a if a > 0 else float('inf')
+            regressed = max(a, b) >= noise_floor and ratio > 1 + threshold
+            if regressed:
+                regressions.append((result['workload'], result['size'], stage, a, b))
+            print('{0:<18} {1:>6} {2:<18} {3:>10.3f}ms {4:>10.3f}ms {5:>7.2f}x{6}'.format(
+                result['workload'], result['size'], stage, a * 1000, b * 1000, ratio, ' !' if regressed else ''))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description='Замеры построения графа по стадиям.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='выполнить замеры')
+    run_parser.add_argument('--workloads', nargs='+', choices=sorted(workloads), default=list(workloads))
+    run_parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000])
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('-o', '--output', help='файл для результатов в JSON (по умолчанию stdout)')
+
+    compare_parser = commands.add_parser('compare', help='сравнить два прогона')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.25, help='допустимое замедление (0.25 - 25%%)')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        if args.repeat <= 0:
+            parser.error('--repeat должен быть положительным')
+        print_header()
+        report = json.dumps(run(args.workloads, args.sizes, args.repeat), indent=2)
+        if args.output is None:
+            print(report)
+        else:
+            with open(args.output, 'w', encoding='utf-8') as fp:
+                fp.write(report + '\n')
+        return 0
+
+    with open(args.old, encoding='utf-8') as fp:
+        old = json.load(fp)
+    with open(args.new, encoding='utf-8') as fp:
+        new = json.load(fp)
+    regressions = compare(old, new, args.threshold)
+    print('{0} regression(s)'.format(len(regressions)))
+    return 1 if len(regressions) != 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
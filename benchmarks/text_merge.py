@@ -0,0 +1,31 @@
+__author__ = 'Владимир'
+
+# Замер слияния соседних текстовых узлов на длинных литералах.
+# Время на один символ должно оставаться примерно постоянным (линейный рост).
+#
+# Запуск: python -m benchmarks.text_merge [размер ...]
+
+import gc
+import sys
+import time
+
+from egraph.egraph import DotNode
+from benchmarks.workloads import long_literal
+
+
+def run(sizes):
+    print('{0:>8} {1:>10} {2:>12}'.format('chars', 'seconds', 'us/char'))
+    for size in sizes:
+        graph = long_literal(size)
+        gc.collect()
+        start = time.perf_counter()
+        dot = graph.to_graph()
+        elapsed = time.perf_counter() - start
+        nodes = [i for i in dot.items if isinstance(i, DotNode)]
+        if len(nodes) != 3:  # begin, end и весь литерал одним узлом
+            raise RuntimeError('Литерал не был свёрнут в один узел.')
+        print('{0:>8} {1:>10.3f} {2:>12.2f}'.format(size, elapsed, elapsed / size * 1e6))
+
+
+if __name__ == '__main__':
+    run([int(arg) for arg in sys.argv[1:]] or [10000, 20000, 40000, 80000])
@@ -0,0 +1,153 @@
+__author__ = 'Владимир'
+
+# Генераторы синтетических моделей объясняющих графов для замеров. Каждый генератор принимает размер n
+# и строит граф, в котором число частей растёт линейно с n.
+
+from egraph.egraph import ExplainingGraph, Text, Assert, AssertType, Subexpression, Quantifier, Charflag, \
+    CharflagType, CharacterClass, Range, AssertComplex, AssertComplexType, ConditionalSubexpression, \
+    SubexpressionCall, OptionCaseSensitivity, IStructural
+
+
+def long_literal(size):
+    """
+    Литерал из size символов, каждый символ - отдельный Text.
+
+    :param int size: Длина литерала.
+    :rtype : ExplainingGraph
+    """
+    graph = ExplainingGraph()
+    graph.add_branch([Text(chr(ord('a') + i % 26)) for i in range(size)])
+    return graph
+
+
+def wide_alternation(size):
+    """
+    Альтернатива из size веток по два-три символа.
+
+    :param int size: Количество веток.
+    :rtype : ExplainingGraph
+    """
+    graph = ExplainingGraph()
+    for i in range(size):
+        graph.add_branch([Text(chr(ord('a') + i % 26)), Text(str(i % 10))] + ([Text('z')] if i % 2 else []))
+    return graph
+
+
+def deep_nesting(depth):
+    """
+    depth вложенных друг в друга подвыражений и квантификаторов.
+
+    :param int depth: Глубина вложенности.
+    :rtype : ExplainingGraph
+    """
+    inner = [Text('x')]
+    for i in range(depth):
+        container = Subexpression(i) if i % 2 else Quantifier(0, 2)
+        container.add_branch(inner + [Text('y')])
+        inner = [container]
+
+    graph = ExplainingGraph()
+    graph.add_branch(inner)
+    return graph
+
+
+_assert_types = [AssertType.slash_b, AssertType.slash_B, AssertType.circumflex, AssertType.dollar]
+
+
+def assert_runs(size):
+    """
+    Цепочка из size символов, между которыми стоят подряд по два простых утверждения.
+
+    :param int size: Количество символов.
+    :rtype : ExplainingGraph
+    """
+    branch = []
+    for i in range(size):
+        branch += [Text(chr(ord('a') + i % 26)), Assert(_assert_types[i % 4]), Assert(_assert_types[(i + 1) % 4])]
+    graph = ExplainingGraph()
+    graph.add_branch(branch)
+    return graph
+
+
+_charflag_types = [CharflagType.slashd, CharflagType.slashw, CharflagType.slashs, CharflagType.alpha,
+                   CharflagType.punct, CharflagType.xdigit]
+
+
+def big_class(size):
+    """
+    Символьный класс из size элементов: символов, диапазонов и символьных флагов, окружённый текстом.
+
+    :param int size: Количество элементов класса.
+    :rtype : ExplainingGraph
+    """
+    character_class = CharacterClass(is_inverted=True)
+    for i in range(size):
+        if i % 3 == 0:
+            character_class.add_part(Text(chr(0x410 + i % 64)))
+        elif i % 3 == 1:
+            start = 0x4E00 + i
+            character_class.add_part(Range(chr(start), chr(start + 1)))
+        else:
+            character_class.add_part(Charflag(_charflag_types[i % len(_charflag_types)]))
+    graph = ExplainingGraph()
+    graph.add_branch([Text('a'), character_class, Text('b')])
+    return graph
+
+
+def conditional_mix(size):
+    """
+    size условных подвыражений и сложных утверждений вперемешку, с опциями регистра и вызовами подмасок.
+
+    :param int size: Количество условных подвыражений.
+    :rtype : ExplainingGraph
+    """
+    branch = []
+    for i in range(size):
+        if i % 2 == 0:
+            condition = AssertComplex(AssertComplexType(i % 4 + 1))
+            condition.add_branch([Text('c'), Text(str(i % 10))])
+        else:
+            condition = SubexpressionCall(i % 9 + 1)
+        conditional = ConditionalSubexpression(condition)
+        conditional.branch_true = [Text('t'), Charflag(CharflagType.slashd)]
+        if i % 3 != 0:
+            conditional.branch_false = [Text('f')]
+
+        lookahead = AssertComplex(AssertComplexType.nla if i % 2 else AssertComplexType.pla)
+        lookahead.add_branch([Text('q')])
+        lookahead.add_branch([Text('r'), Text('s')])
+        branch += [conditional, OptionCaseSensitivity(i % 2 == 0), lookahead, Text('x')]
+
+    graph = ExplainingGraph(is_exact=True)
+    graph.add_branch(branch)
+    return graph
+
+
+workloads = {
+    'long_literal': long_literal,
+    'wide_alternation': wide_alternation,
+    'deep_nesting': deep_nesting,
+    'assert_runs': assert_runs,
+    'big_class': big_class,
+    'conditional_mix': conditional_mix,
+}
+""":type : dict[str, (int) -> ExplainingGraph]"""
+
+
+def count_parts(graph):
+    """
+    Количество частей модели, включая вложенные (каждая часть считается один раз).
+
+    :param ExplainingGraph graph: Модель графа.
+    :rtype : int
+    """
+    seen = set()
+    stack = [graph]
+    while len(stack) != 0:
+        value = stack.pop()
+        if type(value) is list or type(value) is tuple:
+            stack.extend(value)
+        elif isinstance(value, IStructural) and id(value) not in seen:
+            seen.add(id(value))
+            stack.extend(value._structure())
+    return len(seen) - 1
@@ -0,0 +1,4 @@
+__author__ = 'Владимир'
+
+# версия влияет на ключи постоянного кэша: её нужно менять при любом изменении выводимого dot-кода
+__version__ = '0.2.0'
@@ -0,0 +1,121 @@
+__author__ = 'Владимир'
+
+import asyncio
+import os
+
+from egraph.graphviz import GraphvizError
+
+
+class AsyncRenderer:
+    """
+    Построение изображений для asyncio: dot запускается через asyncio.create_subprocess_exec, поэтому цикл
+    событий не блокируется. Число одновременно работающих процессов dot ограничено семафором.
+    При таймауте или отмене вызывающей задачи процесс dot завершается.
+    """
+
+    def __init__(self, path_to_dot='dot', max_concurrency=None, timeout=None):
+        """
+        :param str path_to_dot: Путь к исполняемому файлу dot.
+        :param int|None max_concurrency: Сколько процессов dot может работать одновременно (None - по числу ядер).
+        :param float|None timeout: Сколько секунд ждать одного построения по умолчанию.
+        """
+        if max_concurrency is None:
+            max_concurrency = os.cpu_count() or 1
+        if max_concurrency <= 0:
+            raise ValueError('Число одновременных построений должно быть положительным.')
+        self.path_to_dot = path_to_dot
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # семафор создаётся внутри работающего цикла событий
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def render(self, script, fmt='svg', timeout=None):
+        """
+        Строит изображение по dot-коду.
+
+        :param str|bytes script: dot-код.
+        :param str fmt: Формат изображения (значение ключа -T).
+        :param float|None timeout: Сколько секунд ждать построения (None - значение по умолчанию).
+        :rtype : bytes
+        """
+        if isinstance(script, str):
+            script = script.encode('utf-8')
+        if timeout is None:
+            timeout = self.timeout
+
+        async with self.semaphore:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    self.path_to_dot, '-T' + fmt, stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            except OSError as error:
+                raise GraphvizError('Не удалось запустить dot: {0}'.format(error)) from error
+
+            try:
+                # communicate пишет stdin и читает stdout и stderr одновременно
+                out, err = await asyncio.wait_for(process.communicate(script), timeout)
+            except asyncio.TimeoutError:
+                await _kill(process)
+                raise GraphvizError('dot не завершился за {0} с.'.format(timeout))
+            except BaseException:
+                await asyncio.shield(_kill(process))
+                raise
+
+        if process.returncode != 0:
+            raise GraphvizError('dot завершился с кодом {0}.'.format(process.returncode),
+                                err.decode('utf-8', 'replace'))
+        return out
+
+    async def render_graph(self, graph, fmt='svg', timeout=None):
+        """
+        Строит изображение по модели графа. Модель переводится в dot-код в пуле потоков цикла событий.
+
+        :param IGraph graph: Модель графа.
+        :param str fmt: Формат изображения.
+        :param float|None timeout: Сколько секунд ждать построения (None - значение по умолчанию).
+        :rtype : bytes
+        """
+        loop = asyncio.get_running_loop()
+        script = await loop.run_in_executor(None, lambda: graph.to_graph().to_dot())
+        return await self.render(script, fmt, timeout)
+
+
+async def _kill(process):
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+    await process.wait()
+
+
+async def render(script, fmt='svg', path_to_dot='dot', timeout=None):
+    """
+    Строит изображение по dot-коду без ограничения числа одновременных построений.
+
+    :param str|bytes script: dot-код.
+    :param str fmt: Формат изображения.
+    :param str path_to_dot: Путь к исполняемому файлу dot.
+    :param float|None timeout: Сколько секунд ждать построения.
+    :rtype : bytes
+    """
+    return await AsyncRenderer(path_to_dot, 1, timeout).render(script, fmt)
+
+
+async def render_graph(graph, fmt='svg', path_to_dot='dot', timeout=None):
+    """
+    Строит изображение по модели графа без ограничения числа одновременных построений.
+
+    :param IGraph graph: Модель графа.
+    :param str fmt: Формат изображения.
+    :param str path_to_dot: Путь к исполняемому файлу dot.
+    :param float|None timeout: Сколько секунд ждать построения.
+    :rtype : bytes
+    """
+    return await AsyncRenderer(path_to_dot, 1, timeout).render_graph(graph, fmt)
@@ -0,0 +1,129 @@
+__author__ = 'Владимир'
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import os
+import pickle
+import traceback
+
+from egraph.egraph import IGraph
+
+
+class BatchResult:
+    """
+    Результат построения одного графа из пакета.
+    """
+
+    __slots__ = ('index', 'dot', 'path', 'error')
+
+    def __init__(self, index, dot=None, path=None, error=None):
+        self.index = index
+        """:type : int"""
+        self.dot = dot
+        """:type : str|None"""
+        self.path = path
+        """:type : str|None"""
+        self.error = error
+        """:type : str|None"""
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return 'BatchResult({0}, path={1!r}, ok={2})'.format(self.index, self.path, self.ok)
+
+
+def serialize(graph):
+    """
+    Сериализует модель графа для передачи в render_batch (например, из другого процесса или из базы).
+
+    :param IGraph graph: Модель графа.
+    :rtype : bytes
+    """
+    return pickle.dumps(graph, pickle.HIGHEST_PROTOCOL)
+
+
+def render_batch(graphs, workers=None, chunk_size=16, output_dir=None, name_format='{0}.dot', encoding='utf-8'):
+    """
+    Строит dot-код для пакета графов в пуле процессов.
+    Порядок результатов совпадает с порядком входных графов. Ошибка в одном графе не прерывает пакет:
+    она записывается в результат этого графа вместе с трассировкой.
+    На Windows вызывать только из-под if __name__ == '__main__', как и любой ProcessPoolExecutor.
+
+    :param graphs: Модели графов (IGraph) или их сериализованные копии (bytes из serialize).
+    :param int|None workers: Число процессов (None - по числу ядер, 1 - без пула, в текущем процессе).
+    :param int chunk_size: Сколько графов отправляется процессу за раз.
+    :param str|None output_dir: Каталог для dot-файлов; если не задан, dot-код возвращается в результатах.
+    :param str name_format: Имя файла; {0} - номер графа в пакете.
+    :param str encoding: Кодировка dot-файлов.
+    :rtype : list[BatchResult]
+    """
+    if chunk_size <= 0:
+        raise ValueError('Размер порции должен быть положительным.')
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    in_process = workers == 1
+    chunks = _chunks(graphs, chunk_size, output_dir, name_format, in_process)
+    if in_process:
+        done = [_render_chunk(chunk, encoding) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            done = list(executor.map(_render_chunk, chunks, repeat(encoding)))
+
+    return [result for chunk in done for result in chunk]
+
+
+def _chunks(graphs, chunk_size, output_dir, name_format, in_process):
+    """
+    Делит пакет на порции из (номер, модель, путь к файлу).
+    Модели сериализуются здесь, чтобы ошибка сериализации относилась к своему графу, а не ко всей порции.
+    """
+    chunk = []
+    for index, graph in enumerate(graphs):
+        path = os.path.join(output_dir, name_format.format(index)) if output_dir is not None else None
+        if not in_process and not isinstance(graph, bytes):
+            try:
+                graph = serialize(graph)
+            except Exception:
+                graph = BatchResult(index, path=path, error=traceback.format_exc())
+        chunk.append((index, graph, path))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) != 0:
+        yield chunk
+
+
+def _render_chunk(chunk, encoding):
+    """
+    Строит порцию графов (выполняется в процессе пула).
+
+    :rtype : list[BatchResult]
+    """
+    results = []
+    for index, graph, path in chunk:
+        if isinstance(graph, BatchResult):
+            results.append(graph)
+            continue
+        try:
+            results.append(_render_one(index, graph, path, encoding))
+        except Exception:
+            results.append(BatchResult(index, path=path, error=traceback.format_exc()))
+    return results
+
+
+def _render_one(index, graph, path, encoding):
+    if isinstance(graph, bytes):
+        graph = pickle.loads(graph)
+    if not isinstance(graph, IGraph):
+        raise TypeError('Ожидалась модель графа, получено {0}.'.format(type(graph).__name__))
+
+    dot = graph.to_graph()
+    if path is None:
+        return BatchResult(index, dot=dot.to_dot())
+
+    with open(path, 'w', encoding=encoding) as fp:
+        dot.to_dot_stream(fp)
+    return BatchResult(index, path=path)
@@ -0,0 +1,253 @@
+__author__ = 'Владимир'
+
+from collections import OrderedDict
+
+from egraph.dot import DotLink, IGroupable, DotItems, DotSubgraph, SubgraphText
+
+
+class LoweringCache:
+    """
+    LRU-кэш построенных dot-фрагментов составных частей регулярного выражения.
+    Ключ - структурный отпечаток поддерева частей и действующая для него чувствительность к регистру.
+    При попадании фрагмент копируется, а id его элементов сдвигаются к текущему значению счётчика.
+    """
+
+    _slot_names = {}
+    """:type : dict[type, list[str]]"""
+
+    def __init__(self, max_size=1024):
+        if max_size <= 0:
+            raise ValueError('Размер кэша должен быть положительным.')
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._fragments = OrderedDict()
+
+    def __len__(self):
+        return len(self._fragments)
+
+    def clear(self):
+        self._fragments.clear()
+        self.hits = self.misses = 0
+
+    def commit(self, graph):
+        """
+        Вызывается после проходов над построенным графом. Этому кэшу ничего делать не нужно.
+
+        :param DotDigraph graph: Построенный граф.
+        """
+        pass
+
+    @staticmethod
+    def key_for(item):
+        """
+        Ключ поддерева - его структурный отпечаток.
+        Поддеревья с явно заданными id получают ключ None: их id нельзя сдвигать, поэтому они не кэшируются.
+
+        :param Part item: Корень поддерева.
+        :rtype : bytes|None
+        """
+        return None if item.has_explicit_ids else item.fingerprint
+
+    def fetch(self, key, is_sensitive, id_counter):
+        """
+        Возвращает копию фрагмента с id, начинающимися с id_counter, или None, если фрагмента нет в кэше.
+
+        :rtype : (IDotable, int, DotNode, DotNode)|None
+        """
+        entry = self._fragments.get((key, is_sensitive))
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._fragments.move_to_end((key, is_sensitive))
+        self.hits += 1
+        fragment, start, end, enter, exit = entry
+        part, enter, exit = self._clone(fragment, enter, exit, start, id_counter - start)
+        return part, end + id_counter - start, enter, exit
+
+    def store(self, key, is_sensitive, id_counter, result):
+        """
+        Сохраняет копию только что построенного фрагмента (оптимизатор потом изменит сам фрагмент).
+
+        :param int id_counter: Значение счётчика, с которым строился фрагмент.
+        :param result: Результат to_graph: (часть, новый счётчик, вход, выход).
+        """
+        part, end, enter, exit = result
+        part, enter, exit = self._clone(part, enter, exit, id_counter, 0)
+        self._fragments[(key, is_sensitive)] = (part, id_counter, end, enter, exit)
+        self._fragments.move_to_end((key, is_sensitive))
+        while len(self._fragments) > self.max_size:
+            self._fragments.popitem(last=False)
+
+    @classmethod
+    def _slots(cls, item_type):
+        """
+        Имена всех слотов типа с учётом базовых классов. Результат запоминается для каждого типа.
+
+        :rtype : list[str]
+        """
+        names = cls._slot_names.get(item_type)
+        if names is None:
+            names = cls._slot_names[item_type] = [
+                name for base in item_type.__mro__ for name in base.__dict__.get('__slots__', ())
+            ]
+        return names
+
+    @staticmethod
+    def _clone(fragment, enter, exit, start, offset):
+        """
+        Копирует фрагмент, сдвигая на offset все id, выданные счётчиком (не меньше start).
+        """
+        def shift(value):
+            return value + offset if type(value) is int and value >= start else value
+
+        copies = {}
+        links = []
+        groups = []
+
+        def clone(item):
+            result = copies.get(item)
+            if result is not None:
+                return result
+            cls = type(item)
+            result = copies[item] = object.__new__(cls)
+            for name in LoweringCache._slots(cls):
+                setattr(result, name, getattr(item, name))
+            result._id = shift(item._id)
+            if cls is DotLink:
+                result._index = None
+                links.append(result)
+            elif issubclass(cls, IGroupable):
+                result._index = None
+                result.edge_attrs = dict(item.edge_attrs)
+                result.node_attrs = dict(item.node_attrs)
+                groups.append((item, result))
+            return result
+
+        root = clone(fragment)
+        while len(groups) != 0:
+            old, new = groups.pop()
+            # индекса у копии нет, поэтому элементы можно добавить без оповещений
+            new._items = DotItems(new, [clone(child) for child in old.items])
+
+        # связи перевешиваются, когда скопированы все узлы фрагмента
+        for link in links:
+            link._source = copies.get(link._source, link._source)
+            link._destination = copies.get(link._destination, link._destination)
+
+        return root, copies.get(enter, enter), copies.get(exit, exit)
+
+
+
+class IncrementalCache:
+    """
+    Кэш последнего построения каждой составной части, хранящийся в самой части модели.
+    Часть, которую не меняли после прошлого построения (её отпечаток прежний), не строится заново: её фрагмент
+    копируется, как в LoweringCache. Поэтому после изменения одной части заново строятся только она и путь от неё
+    до корня, а неизменённые соседи на этом пути вставляются готовыми.
+
+    Проходы над dot-графом (optimize, del_case_options) меняют узлы и связи по обе стороны границы подграфа
+    только через его вход и выход. Поэтому, если ни вход, ни выход фрагмента не удаляются оптимизатором,
+    фрагмент сохраняется уже после проходов и при вставке помечается как готовый: встроенные проходы его
+    не обходят. Если не удаляется хотя бы выход, то подграфу подключается сохранённый dot-код (SubgraphText),
+    и на прежнем месте (с тем же начальным id и уровнем вложенности) его dot-код тоже не строится заново.
+    Это рассчитано на то, что проходы над dot-графом меняют подграф в зависимости только от его содержимого;
+    собственные проходы с другим поведением с этим кэшем использовать нельзя. Из-за готовых подграфов
+    изменения числа узлов в PassStats меньше, чем при построении без кэша.
+
+        graph.lowering_cache = IncrementalCache()
+        graph.to_graph().to_dot()
+        text.text = 'b'             # изменение сбрасывает отпечатки части и её предков
+        graph.to_graph().to_dot()   # заново строятся только они
+    """
+
+    # Узлы, которые оптимизатор удаляет или сливает с соседями (IGraph._optimize, IGraph._del_case_options).
+    _removable = frozenset(['Text', 'Assert', 'OptionCaseSensitivity'])
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # фрагменты, которые сохраняются после проходов над dot-графом (commit)
+        self._pending = []
+        """:type : list[tuple]"""
+
+    @staticmethod
+    def key_for(item):
+        """
+        Ключ - сама часть. Части с явно заданными id и части, не подключённые к модели (например, временная
+        обёртка флага точного совпадения), не кэшируются.
+
+        :param Part item: Корень поддерева.
+        :rtype : Part|None
+        """
+        return None if item.has_explicit_ids or len(item._parents) == 0 else item
+
+    def fetch(self, key, is_sensitive, id_counter):
+        """
+        Возвращает копию прошлого фрагмента части с id, начинающимися с id_counter, или None,
+        если часть изменилась или строилась с другой чувствительностью к регистру.
+
+        :param Part key: Часть.
+        :rtype : (IDotable, int, DotNode, DotNode)|None
+        """
+        entry = key._lowered
+        if entry is None or entry[0] != key.fingerprint or entry[1] != is_sensitive:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        _, _, fragment, start, end, enter, exit = entry
+        part, enter, exit = LoweringCache._clone(fragment, enter, exit, start, id_counter - start)
+        return part, end + id_counter - start, enter, exit
+
+    def store(self, key, is_sensitive, id_counter, result):
+        """
+        Сохраняет в части копию только что построенного фрагмента или откладывает сохранение до commit.
+
+        :param Part key: Часть.
+        :param int id_counter: Значение счётчика, с которым строился фрагмент.
+        :param result: Результат to_graph: (часть, новый счётчик, вход, выход).
+        """
+        part, end, enter, exit = result
+        if isinstance(part, DotSubgraph) and exit._comment not in IncrementalCache._removable:
+            # текст общий у построенного подграфа и всех его копий
+            part._text = SubgraphText()
+            if enter._comment not in IncrementalCache._removable:
+                self._pending.append((key, key.fingerprint, is_sensitive, id_counter, result))
+                return
+
+        part, enter, exit = LoweringCache._clone(part, enter, exit, id_counter, 0)
+        key._lowered = (key.fingerprint, is_sensitive, part, id_counter, end, enter, exit)
+
+    def commit(self, graph):
+        """
+        Сохраняет отложенные фрагменты в том виде, в каком они стали после проходов над dot-графом.
+
+        :param DotDigraph graph: Построенный граф.
+        """
+        pending, self._pending = self._pending, []
+        for key, fingerprint, is_sensitive, start, (part, end, enter, exit) in pending:
+            # фрагменты построения, прерванного исключением, в граф не попали
+            if part._index is not graph._index:
+                continue
+            fragment, enter, exit = LoweringCache._clone(part, enter, exit, start, 0)
+            fragment._settled = True
+            key._lowered = (fingerprint, is_sensitive, fragment, start, end, enter, exit)
+
+    @staticmethod
+    def release(model):
+        """
+        Удаляет сохранённые фрагменты из всех частей модели, чтобы освободить память.
+
+        :param IStructural model: Модель или её часть.
+        """
+        stack = [model]
+        while len(stack) != 0:
+            value = stack.pop()
+            if type(value) is list or type(value) is tuple:
+                stack.extend(value)
+            elif hasattr(value, '_structure'):
+                if hasattr(value, '_lowered'):
+                    value._lowered = None
+                stack.extend(value._structure())
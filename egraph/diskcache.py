@@ -0,0 +1,207 @@
+__author__ = 'Владимир'
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import egraph
+
+
+class DiskRenderCache:
+    """
+    Постоянный кэш результатов построения в файле SQLite, адресуемый содержимым.
+    Ключ - структурный отпечаток модели графа, версия egraph и набор включённых проходов, поэтому кэш
+    переживает перезапуски и сам устаревает при обновлении библиотеки. Кроме dot-кода в нём можно хранить
+    изображения, построенные Graphviz (вид записи - 'dot' или формат изображения).
+    Размер ограничен: при превышении max_bytes удаляются давно не использованные записи. Суммарный размер
+    записей хранится в однострочной таблице meta и поддерживается триггерами, поэтому запись не пересчитывает
+    размеры всех записей. Время использования при попадании обновляется не чаще раза в touch_interval секунд,
+    поэтому большинство чтений ничего не пишет в базу, а порядок вытеснения точен до touch_interval.
+    Файл можно одновременно использовать из нескольких процессов и потоков: у каждого потока своё соединение,
+    журнал в режиме WAL, запись с удалением старых записей идёт одной транзакцией.
+    """
+
+    _schema = '''
+        CREATE TABLE IF NOT EXISTS renders (
+            key BLOB NOT NULL,
+            kind TEXT NOT NULL,
+            data BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            used REAL NOT NULL,
+            PRIMARY KEY (key, kind)
+        );
+        CREATE INDEX IF NOT EXISTS renders_used ON renders (used);
+        CREATE TABLE IF NOT EXISTS meta (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            total INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO meta (id, total) SELECT 0, COALESCE(SUM(size), 0) FROM renders;
+        CREATE TRIGGER IF NOT EXISTS renders_insert AFTER INSERT ON renders BEGIN
+            UPDATE meta SET total = total + NEW.size WHERE id = 0;
+        END;
+        CREATE TRIGGER IF NOT EXISTS renders_delete AFTER DELETE ON renders BEGIN
+            UPDATE meta SET total = total - OLD.size WHERE id = 0;
+        END;
+        CREATE TRIGGER IF NOT EXISTS renders_resize AFTER UPDATE OF size ON renders BEGIN
+            UPDATE meta SET total = total + NEW.size - OLD.size WHERE id = 0;
+        END;
+    '''
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, timeout=30.0, touch_interval=60.0):
+        """
+        :param str path: Путь к файлу базы.
+        :param int max_bytes: Предельный суммарный размер записей.
+        :param float timeout: Сколько секунд ждать, пока база занята другим процессом.
+        :param float touch_interval: Как часто (в секундах) обновлять время использования записи при попадании.
+        """
+        if max_bytes <= 0:
+            raise ValueError('Размер кэша должен быть положительным.')
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        # схема создаётся одной транзакцией: итог в meta считается по записям до того, как появятся триггеры,
+        # и другой процесс не может вставить запись между этими шагами
+        connection = self._connection()
+        try:
+            connection.executescript('BEGIN IMMEDIATE;' + DiskRenderCache._schema + 'COMMIT;')
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+
+    def _connection(self):
+        """
+        Соединение текущего потока. После fork соединение родителя не используется.
+
+        :rtype : sqlite3.Connection
+        """
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # isolation_level=None: транзакции открываются явно, чтение не держит блокировок
+            local.connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            local.connection.execute('PRAGMA journal_mode=WAL')
+            local.connection.execute('PRAGMA synchronous=NORMAL')
+            local.pid = os.getpid()
+        return local.connection
+
+    def close(self):
+        """
+        Закрывает соединение текущего потока.
+        """
+        if getattr(self._local, 'pid', None) == os.getpid():
+            self._local.connection.close()
+        self._local = threading.local()
+
+    @staticmethod
+    def key_for(graph):
+        """
+        Ключ графа. В ключ входят имена и версии включённых проходов (egraph.passes.Pass.version).
+        Графы, в которых у частей явно заданы id, не кэшируются (id не входят в отпечаток,
+        но попадают в dot-код), для них возвращается None.
+
+        :param IGraph graph: Модель графа.
+        :rtype : bytes|None
+        """
+        if any(item.has_explicit_ids for branch in graph for item in branch):
+            return None
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(egraph.__version__.encode())
+        digest.update(b'\0' + graph.fingerprint)
+        for item in graph.passes:
+            if item.enabled:
+                digest.update(b'\0' + item.name.encode() + b'\0' + str(item.version).encode())
+        return digest.digest()
+
+    def get(self, key, kind='dot'):
+        """
+        :param bytes key: Ключ (см. key_for).
+        :param str kind: Вид записи: 'dot' или формат изображения.
+        :rtype : bytes|None
+        """
+        connection = self._connection()
+        row = connection.execute('SELECT data, used FROM renders WHERE key = ? AND kind = ?', (key, kind)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        now = time.time()
+        if now - row[1] >= self.touch_interval:
+            connection.execute('UPDATE renders SET used = ? WHERE key = ? AND kind = ?', (now, key, kind))
+        return bytes(row[0])
+
+    def put(self, key, kind, data):
+        """
+        Сохраняет запись и, если кэш переполнен, удаляет давно не использованные записи
+        (до 90% предельного размера, чтобы не чистить кэш при каждой записи).
+
+        :param bytes key: Ключ (см. key_for).
+        :param str kind: Вид записи: 'dot' или формат изображения.
+        :param bytes data: Содержимое.
+        """
+        if len(data) > self.max_bytes:
+            return
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # не INSERT OR REPLACE: замена при конфликте удаляет строку без вызова триггера удаления
+            connection.execute('INSERT INTO renders (key, kind, data, size, used) VALUES (?, ?, ?, ?, ?) '
+                               'ON CONFLICT (key, kind) DO UPDATE SET '
+                               'data = excluded.data, size = excluded.size, used = excluded.used',
+                               (key, kind, sqlite3.Binary(data), len(data), time.time()))
+            total = connection.execute('SELECT total FROM meta WHERE id = 0').fetchone()[0]
+            if total > self.max_bytes:
+                self._evict(connection, total - self.max_bytes * 9 // 10)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def _evict(connection, excess):
+        freed = 0
+        victims = []
+        for key, kind, size in connection.execute('SELECT key, kind, size FROM renders ORDER BY used'):
+            if freed >= excess:
+                break
+            victims.append((key, kind))
+            freed += size
+        connection.executemany('DELETE FROM renders WHERE key = ? AND kind = ?', victims)
+
+    def render(self, graph):
+        """
+        dot-код графа: из кэша или построенный и сохранённый в кэш.
+
+        :param IGraph graph: Модель графа.
+        :rtype : str
+        """
+        key = self.key_for(graph)
+        if key is not None:
+            data = self.get(key)
+            if data is not None:
+                return data.decode('utf-8')
+
+        dot = graph.to_graph().to_dot()
+        if key is not None:
+            self.put(key, 'dot', dot.encode('utf-8'))
+        return dot
+
+    def size(self):
+        """
+        Суммарный размер записей в байтах.
+
+        :rtype : int
+        """
+        return self._connection().execute('SELECT total FROM meta WHERE id = 0').fetchone()[0]
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM renders').fetchone()[0]
+
+    def clear(self):
+        self._connection().execute('DELETE FROM renders')
+        self.hits = self.misses = 0
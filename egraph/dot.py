@@ -2,6 +2,8 @@ __author__ = 'Владимир'
 
 import abc
 
+from egraph import tracing
+
 
 class IDotable(metaclass=abc.ABCMeta):
     """
@@ -9,6 +11,8 @@ class IDotable(metaclass=abc.ABCMeta):
     Объединяет атрибуты общие для всех объектов в dot-коде.
     """
 
+    __slots__ = ('_id', '_label', 'style')
+
     def __init__(self, id=-1, label='', style=''):
         self._id = id
         self._label = label
@@ -24,88 +28,454 @@ class IDotable(metaclass=abc.ABCMeta):
 
     @property
     def label(self):
-        return '"{0}"'.format(self._label)
+        return IDotable._quote(self._label)
 
     @label.setter
     def label(self, value):
         self._label = value
 
+    @staticmethod
+    def _quote(value):
+        """
+        Строка в кавычках для dot-кода. Кавычки и обратные косые черты внутри экранируются.
+
+        :rtype : str
+        """
+        return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
     @abc.abstractmethod
     def to_dot(self, level=0):
         pass
 
 
+class DotItems:
+    """
+    Элементы контейнера. Элементы хранятся в одном упорядоченном словаре (элемент -> вид элемента),
+    поэтому удаление и проверка наличия элемента выполняются за O(1), а dot-код выводится в том же
+    детерминированном порядке, что и из списка. Узлы, связи и подграфы перебираются фильтрацией
+    по виду; счётчики связей и подграфов позволяют не просматривать контейнер, в котором элементов
+    нужного вида нет или есть только они.
+    Оповещает владельца о своих изменениях, чтобы индекс главного графа всегда оставался актуальным.
+    """
+
+    __slots__ = ('_owner', '_items', '_link_count', '_group_count')
+
+    def __init__(self, owner, iterable=()):
+        self._owner = owner
+        """:type : IGroupable"""
+        self._items = {}
+        """:type : dict[IDotable, type]"""
+        self._link_count = 0
+        self._group_count = 0
+        for item in iterable:
+            self._store(item)
+
+    def _store(self, item):
+        if item in self._items:
+            raise ValueError('Элемент уже добавлен в контейнер.')
+        if isinstance(item, DotLink):
+            kind = DotLink
+            self._link_count += 1
+        elif isinstance(item, IGroupable):
+            kind = IGroupable
+            self._group_count += 1
+        else:
+            kind = DotNode
+        self._items[item] = kind
+
+    def append(self, item):
+        self._store(item)
+        self._owner._on_added(item)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def remove(self, item):
+        """
+        Удаляет элемент за O(1).
+
+        :param IDotable item: Удаляемый элемент.
+        """
+        kind = self._items.pop(item, None)
+        if kind is None:
+            raise ValueError('Элемента нет в контейнере.')
+        if kind is DotLink:
+            self._link_count -= 1
+        elif kind is IGroupable:
+            self._group_count -= 1
+        self._owner._on_removed(item)
+
+    def discard(self, item):
+        """
+        Удаляет элемент, если он есть в контейнере.
+
+        :param IDotable item: Удаляемый элемент.
+        """
+        if item in self._items:
+            self.remove(item)
+
+    def pop(self):
+        """
+        Удаляет и возвращает последний добавленный элемент.
+        """
+        if len(self._items) == 0:
+            raise IndexError('Контейнер пуст.')
+        item = next(reversed(self._items))
+        self.remove(item)
+        return item
+
+    def clear(self):
+        old = list(self._items)
+        self._items.clear()
+        self._link_count = self._group_count = 0
+        for item in old:
+            self._owner._on_removed(item)
+
+    def _of_kind(self, kind, count):
+        if count == 0:
+            return ()
+        if count == len(self._items):
+            return self._items.keys()
+        return [item for item, item_kind in self._items.items() if item_kind is kind]
+
+    def nodes(self):
+        """
+        Узлы контейнера в порядке добавления.
+        """
+        return self._of_kind(DotNode, len(self._items) - self._link_count - self._group_count)
+
+    def links(self):
+        """
+        Связи контейнера в порядке добавления.
+        """
+        return self._of_kind(DotLink, self._link_count)
+
+    def groups(self):
+        """
+        Вложенные подграфы в порядке добавления.
+        """
+        return self._of_kind(IGroupable, self._group_count)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __reversed__(self):
+        return reversed(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item):
+        return item in self._items
+
+
+class DotIndex:
+    """
+    Индекс смежности главного графа: исходящие и входящие связи каждого узла,
+    а также контейнеры, которым принадлежат узлы и связи.
+    Позволяет находить соседей, связи и владельцев за O(1).
+    """
+
+    __slots__ = ('_links_from', '_links_to', '_node_owners', '_link_owners')
+
+    def __init__(self):
+        self._links_from = {}
+        """:type : dict[DotNode, list[DotLink]]"""
+        self._links_to = {}
+        """:type : dict[DotNode, list[DotLink]]"""
+        self._node_owners = {}
+        """:type : dict[DotNode, IGroupable]"""
+        self._link_owners = {}
+        """:type : dict[DotLink, IGroupable]"""
+
+    def register(self, item, owner):
+        """
+        Добавляет в индекс элемент (и всё его содержимое, если это контейнер).
+
+        :param IDotable item: Добавляемый элемент.
+        :param IGroupable owner: Контейнер, в который добавлен элемент.
+        """
+        stack = [(item, owner)]
+        while len(stack) != 0:
+            item, owner = stack.pop()
+            if isinstance(item, DotLink):
+                item._index = self
+                self._link_owners[item] = owner
+                self._attach(self._links_from, item.source, item)
+                self._attach(self._links_to, item.destination, item)
+            elif isinstance(item, DotNode):
+                self._node_owners[item] = owner
+            elif isinstance(item, IGroupable):
+                item._index = self
+                stack.extend([(child, item) for child in reversed(item.items)])
+
+    def unregister(self, item, owner):
+        """
+        Удаляет из индекса элемент (и всё его содержимое, если это контейнер).
+
+        :param IDotable item: Удаляемый элемент.
+        :param IGroupable owner: Контейнер, из которого удалён элемент.
+        """
+        stack = [(item, owner)]
+        while len(stack) != 0:
+            item, owner = stack.pop()
+            if isinstance(item, DotLink):
+                if self._link_owners.get(item) is owner:
+                    item._index = None
+                    del self._link_owners[item]
+                    self._detach(self._links_from, item.source, item)
+                    self._detach(self._links_to, item.destination, item)
+            elif isinstance(item, DotNode):
+                if self._node_owners.get(item) is owner:
+                    del self._node_owners[item]
+            elif isinstance(item, IGroupable):
+                item._index = None
+                stack.extend([(child, item) for child in reversed(item.items)])
+
+    def relink(self, link, old, new, outgoing):
+        """
+        Перевешивает связь с одного узла на другой.
+
+        :param DotLink link: Изменяемая связь.
+        :param DotNode old: Прежний узел.
+        :param DotNode new: Новый узел.
+        :param bool outgoing: True - меняется источник связи, False - приёмник.
+        """
+        table = self._links_from if outgoing else self._links_to
+        self._detach(table, old, link)
+        self._attach(table, new, link)
+
+    def links_from(self, node):
+        return self._links_from.get(node, ())
+
+    def links_to(self, node):
+        return self._links_to.get(node, ())
+
+    def node_owner(self, node):
+        return self._node_owners.get(node)
+
+    def link_owner(self, link):
+        return self._link_owners.get(link)
+
+    def node_count(self):
+        return len(self._node_owners)
+
+    def link_count(self):
+        return len(self._link_owners)
+
+    @staticmethod
+    def _attach(table, node, link):
+        if node is not None:
+            table.setdefault(node, []).append(link)
+
+    @staticmethod
+    def _detach(table, node, link):
+        links = table.get(node)
+        if links is not None:
+            for i, other in enumerate(links):
+                if other is link:
+                    del links[i]
+                    break
+            if len(links) == 0:
+                del table[node]
+
+
+class CountingIndex(DotIndex):
+    """
+    Индекс смежности, который дополнительно считает поиски (find_*) и удаления элементов из списков.
+    Используется вместо DotIndex, когда включена трассировка (egraph.tracing).
+    """
+
+    __slots__ = ('lookups', 'removals')
+
+    def __init__(self):
+        DotIndex.__init__(self)
+        self.lookups = 0
+        self.removals = 0
+
+    def unregister(self, item, owner):
+        self.removals += 1
+        DotIndex.unregister(self, item, owner)
+
+    def links_from(self, node):
+        self.lookups += 1
+        return DotIndex.links_from(self, node)
+
+    def links_to(self, node):
+        self.lookups += 1
+        return DotIndex.links_to(self, node)
+
+    def node_owner(self, node):
+        self.lookups += 1
+        return DotIndex.node_owner(self, node)
+
+
 class IGroupable(IDotable, metaclass=abc.ABCMeta):
     """
     Абстрактный контейнер dot-сущностей.
     """
 
+    __slots__ = ('_index', '_items', 'bgcolor')
+
     def __init__(self, id=-1, label='', style='', bgcolor=''):
         IDotable.__init__(self, id, label, style)
-        self.items = []
+        self._index = None
+        """:type : DotIndex|None"""
+        self._items = DotItems(self)
         self.bgcolor = bgcolor
 
+    @property
+    def items(self):
+        """
+        :rtype : DotItems
+        """
+        return self._items
+
+    @items.setter
+    def items(self, value):
+        if value is self._items:    # items += [...]
+            return
+        for item in self._items:
+            self._on_removed(item)
+        self._items = DotItems(self, value)
+        for item in self._items:
+            self._on_added(item)
+
+    def _on_added(self, item):
+        if self._index is not None:
+            self._index.register(item, self)
+
+    def _on_removed(self, item):
+        if self._index is not None:
+            self._index.unregister(item, self)
+
     def to_dot(self, level=0):
-        level += 1
-        result = self._initial(level)
+        return ''.join(self.iter_dot(level))
 
-        result += ''.join([
-            ('\t' * level) + (item.to_dot(level) if isinstance(item, DotSubgraph) else item.to_dot(level + 1)) + '\n'
-            for item in self.items
-        ])
+    def iter_dot(self, level=0):
+        """
+        Выдаёт dot-код контейнера по частям, не собирая его целиком в памяти.
 
-        level -= 1
-        return result + ('\t' * level) + '}'
+        :param int level: Уровень вложенности.
+        """
+        level += 1
+        yield self._initial(level)
+
+        # Вложенные подграфы обходятся через явный стек, а не рекурсивно. Подграф с действительным сохранённым
+        # текстом (SubgraphText) не обходится, а вставляется целиком. Текст подграфа, который нужно сохранить,
+        # собирается в список частей и выдаётся, когда подграф закончен; сохранённый текст вложенного подграфа
+        # входит в список объемлющего по ссылке, а не копией.
+        pieces = None   # части ближайшего сохраняемого подграфа или None
+        stack = [(level, iter(self.items), None, pieces)]
+        while len(stack) != 0:
+            level, items, _, pieces = stack[-1]
+            indent = '\t' * level
+            for item in items:
+                if isinstance(item, DotSubgraph):
+                    text = item._text
+                    if text is not None and text.is_valid(item, level):
+                        if pieces is None:
+                            yield from SubgraphText.expand(text.pieces)
+                        else:
+                            pieces.append(text.pieces)
+                        continue
+
+                    chunk = indent + item._initial(level + 1)
+                    if text is not None:
+                        pieces = [chunk]
+                    elif pieces is None:
+                        yield chunk
+                    else:
+                        pieces.append(chunk)
+                    stack.append((level + 1, iter(item.items), item if text is not None else None, pieces))
+                    break
+                else:
+                    chunk = indent + item.to_dot(level + 1) + '\n'
+                    if pieces is None:
+                        yield chunk
+                    else:
+                        pieces.append(chunk)
+            else:
+                _, _, captured, _ = stack.pop()
+                chunk = ('\t' * (level - 1)) + ('}\n' if len(stack) != 0 else '}')
+                if pieces is not None:
+                    pieces.append(chunk)
+                else:
+                    yield chunk
+
+                if captured is not None:
+                    # подграф закончен: сохраняем его текст и передаём объемлющему
+                    text = captured._text
+                    text.store(captured, level - 1, pieces)
+                    outer = stack[-1][3]
+                    if outer is None:
+                        yield from SubgraphText.expand(text.pieces)
+                    else:
+                        outer.append(text.pieces)
+
+    def to_dot_stream(self, fp, encoding=None):
+        """
+        Записывает dot-код контейнера в файловый объект по частям:
+        в открытый файл, канал или stdin процесса Graphviz.
+
+        :param fp: Файловый объект с методом write.
+        :param str|None encoding: Кодировка, если fp - двоичный поток (например, stdin процесса).
+        """
+        write = fp.write
+        if encoding is None:
+            for chunk in self.iter_dot():
+                write(chunk)
+        else:
+            for chunk in self.iter_dot():
+                write(chunk.encode(encoding))
 
     @abc.abstractmethod
     def _initial(self, level):
         pass
 
+    def _walk_groups(self):
+        """
+        Обходит контейнер и все вложенные подграфы в прямом порядке без рекурсии.
+        """
+        stack = [self]
+        while len(stack) != 0:
+            group = stack.pop()
+            yield group
+            stack.extend(reversed(list(group.items.groups())))
+
     def find_neighbor_right(self, item):
-        for link in filter(lambda i: isinstance(i, DotLink), self.items):
-            if link.source is item:
-                return link.destination
-
-        for subgraph in filter(lambda i: isinstance(i, DotSubgraph), self.items):
-            result = subgraph.find_neighbor_right(item)
-            if result is not None:
-                return result
+        for group in self._walk_groups():
+            for link in group.items.links():
+                if link.source is item:
+                    return link.destination
         else:
             return None
 
     def find_neighbor_left(self, item):
-        for link in filter(lambda i: isinstance(i, DotLink), self.items):
-            if link.destination is item:
-                return link.source
-
-        for subgraph in filter(lambda i: isinstance(i, DotSubgraph), self.items):
-            result = subgraph.find_neighbor_right(item)
-            if result is not None:
-                return result
+        for group in self._walk_groups():
+            for link in group.items.links():
+                if link.destination is item:
+                    return link.source
         else:
             return None
 
     def find_link(self, source, destination):
-        for link in filter(lambda i: isinstance(i, DotLink), self.items):
-            if link.destination is destination and link.source is source:
-                return link, self
-
-        for subgraph in filter(lambda i: isinstance(i, DotSubgraph), self.items):
-            result, owner = subgraph.find_link(source, destination)
-            if result is not None:
-                return result, owner
+        for group in self._walk_groups():
+            for link in group.items.links():
+                if link.destination is destination and link.source is source:
+                    return link, group
         else:
             return None, None
 
     def find_node_owner(self, node):
-        for item in filter(lambda i: isinstance(i, DotNode), self.items):
-            if node is item:
-                return self
-
-        for subgraph in filter(lambda i: isinstance(i, DotSubgraph), self.items):
-            result = subgraph.find_node_owner(node)
-            if result is not None:
-                return result
+        for group in self._walk_groups():
+            if node in group.items:
+                return group
         else:
             return None
 
@@ -115,6 +485,8 @@ class DotNode(IDotable):
     Узел в dot-коде.
     """
 
+    __slots__ = ('shape', 'fillcolor', 'color', '_tooltip', '_comment')
+
     def __init__(self, id=-1, label='', style='', color='', tooltip='', shape='', fillcolor='',
                  comment=''):
         IDotable.__init__(self, id, label, style)
@@ -126,11 +498,11 @@ class DotNode(IDotable):
 
     @property
     def label(self):
-        return ('{0}' if self.shape == 'record' else '"{0}"').format(self._label)
+        return str(self._label) if self.shape == 'record' else IDotable._quote(self._label)
 
     @property
     def comment(self):
-        return '"{0}"'.format(self._comment)
+        return IDotable._quote(self._comment)
 
     @comment.setter
     def comment(self, value):
@@ -138,7 +510,7 @@ class DotNode(IDotable):
 
     @property
     def tooltip(self):
-        return '"{0}"'.format(self._tooltip)
+        return IDotable._quote(self._tooltip)
 
     @tooltip.setter
     def tooltip(self, value):
@@ -146,19 +518,19 @@ class DotNode(IDotable):
 
     def to_dot(self, level=0):
         #TODO label и tooltip эскейпить на html
-        attrs = filter(lambda i: i[1] != '', {
-            'id': self.id,
-            'label': self.label,
-            'style': self.style,
-            'shape': self.shape,
-            'fillcolor': self.fillcolor,
-            'color': self.color,
-            'tooltip': self.tooltip,
-            'comment': self.comment
-        }.items())
+        attrs = (
+            ('id', self.id),
+            ('label', self.label),
+            ('style', self.style),
+            ('shape', self.shape),
+            ('fillcolor', self.fillcolor),
+            ('color', self.color),
+            ('tooltip', self.tooltip),
+            ('comment', self.comment)
+        )
 
         return '"nd_{0}" ['.format(self._id) + \
-               ', '.join([k + '=' + v for k, v in attrs]) + ']'
+               ', '.join([k + '=' + v for k, v in attrs if v != '']) + ']'
 
 
 class DotLink(IDotable):
@@ -166,19 +538,49 @@ class DotLink(IDotable):
     Связь в dot-коде.
     """
 
+    __slots__ = ('_index', '_source', '_destination', 'arrowhead', 'color', '_tooltip', '_comment')
+
     def __init__(self, source: DotNode, destination: DotNode, id=-1, label='', style='', color='', tooltip='',
                  arrowhead='', comment=''):
         IDotable.__init__(self, id, label, style)
-        self.source = source
-        self.destination = destination
+        self._index = None
+        """:type : DotIndex|None"""
+        self._source = source
+        self._destination = destination
         self.arrowhead = arrowhead
         self.color = color
         self._tooltip = tooltip
         self._comment = comment
 
+    @property
+    def source(self):
+        """
+        :rtype : DotNode
+        """
+        return self._source
+
+    @source.setter
+    def source(self, value):
+        if self._index is not None:
+            self._index.relink(self, self._source, value, True)
+        self._source = value
+
+    @property
+    def destination(self):
+        """
+        :rtype : DotNode
+        """
+        return self._destination
+
+    @destination.setter
+    def destination(self, value):
+        if self._index is not None:
+            self._index.relink(self, self._destination, value, False)
+        self._destination = value
+
     @property
     def comment(self):
-        return '"{0}"'.format(self._comment)
+        return IDotable._quote(self._comment)
 
     @comment.setter
     def comment(self, value):
@@ -186,7 +588,7 @@ class DotLink(IDotable):
 
     @property
     def tooltip(self):
-        return '"{0}"'.format(self._tooltip)
+        return IDotable._quote(self._tooltip)
 
     @tooltip.setter
     def tooltip(self, value):
@@ -194,18 +596,72 @@ class DotLink(IDotable):
 
     def to_dot(self, level=0):
         #TODO label и tooltip эскейпить на html
-        attrs = filter(lambda i: i[1] != '', {
-            'id': self.id,
-            'label': self.label,
-            'style': self.style,
-            'color': self.color,
-            'tooltip': self.tooltip,
-            'comment': self.comment,
-            'arrowhead': self.arrowhead
-        }.items())
+        attrs = (
+            ('id', self.id),
+            ('label', self.label),
+            ('style', self.style),
+            ('color', self.color),
+            ('tooltip', self.tooltip),
+            ('comment', self.comment),
+            ('arrowhead', self.arrowhead)
+        )
 
         return '"nd_{0}" -> "nd_{1}" ['.format(self.source._id, self.destination._id) + \
-               ', '.join([k + '=' + v for k, v in attrs]) + ']'
+               ', '.join([k + '=' + v for k, v in attrs if v != '']) + ']'
+
+
+class SubgraphText:
+    """
+    Сохранённый dot-код подграфа. Подграф, у которого он есть, выводится в iter_dot готовым текстом,
+    если его id и уровень вложенности совпадают с сохранёнными; иначе текст строится заново и сохраняется.
+    Текст хранится кортежем частей: строк и таких же кортежей вложенных подграфов. Кортеж не изменяется,
+    поэтому объемлющие подграфы ссылаются на него, а не копируют.
+    Кто подключает сохранённый текст, тот отвечает за то, что при тех же id и уровне текст подграфа тот же
+    (см. egraph.cache.IncrementalCache).
+    """
+
+    __slots__ = ('id', 'level', 'pieces')
+
+    def __init__(self):
+        self.id = None
+        self.level = None
+        self.pieces = None
+        """:type : tuple|None"""
+
+    def is_valid(self, subgraph, level):
+        """
+        :param DotSubgraph subgraph: Выводимый подграф.
+        :param int level: Уровень вложенности, на котором он выводится.
+        :rtype : bool
+        """
+        return self.pieces is not None and self.id == subgraph._id and self.level == level
+
+    def store(self, subgraph, level, pieces):
+        """
+        :param DotSubgraph subgraph: Выведенный подграф.
+        :param int level: Уровень вложенности, на котором он выведен.
+        :param list pieces: Части его dot-кода.
+        """
+        self.id = subgraph._id
+        self.level = level
+        self.pieces = tuple(pieces)
+
+    @staticmethod
+    def expand(pieces):
+        """
+        Выдаёт строки сохранённого текста по порядку, раскрывая вложенные кортежи без рекурсии.
+
+        :param tuple pieces: Части текста.
+        """
+        stack = [iter(pieces)]
+        while len(stack) != 0:
+            for piece in stack[-1]:
+                if type(piece) is tuple:
+                    stack.append(iter(piece))
+                    break
+                yield piece
+            else:
+                stack.pop()
 
 
 class DotSubgraph(IGroupable):
@@ -213,15 +669,21 @@ class DotSubgraph(IGroupable):
     Подграф в dot-коде.
     """
 
+    __slots__ = ('color', '_tooltip', 'edge_attrs', 'node_attrs', '_text', '_settled')
+
     def __init__(self, id=-1, label='', style='', bgcolor='', color='', tooltip=''):
         IGroupable.__init__(self, id, label, style, bgcolor)
         self.color = color
         self._tooltip = tooltip
         self.edge_attrs = {}
+        self.node_attrs = {}
+        self._text = None
+        """:type : SubgraphText|None"""
+        self._settled = False   # подграф уже прошёл проходы над dot-графом (см. egraph.cache.IncrementalCache)
 
     @property
     def tooltip(self):
-        return '"{0}"'.format(self._tooltip)
+        return IDotable._quote(self._tooltip)
 
     @tooltip.setter
     def tooltip(self, value):
@@ -259,15 +721,61 @@ class DotSubgraph(IGroupable):
 class DotDigraph(IGroupable):
     """
     Главный граф в dot-коде.
+    Поддерживает индекс смежности, поэтому поиск соседей, связей и владельцев узлов выполняется за O(1).
     """
 
+    __slots__ = ('compound', 'rankdir')
+
     def __init__(self, id=-1, label='', style='', bgcolor=''):
         # noinspection PyTypeChecker
         IGroupable.__init__(self, 'explaining_graph', label, style, bgcolor)
+        self._index = CountingIndex() if tracing.current() is not None else DotIndex()
         self.items = []
         self.compound = 'true'
         self.rankdir = 'LR'
 
+    def to_dot(self, level=0):
+        with tracing.span('to_dot', self):
+            return IGroupable.to_dot(self, level)
+
+    def to_dot_stream(self, fp, encoding=None):
+        with tracing.span('to_dot', self):
+            IGroupable.to_dot_stream(self, fp, encoding)
+
+    def find_neighbor_right(self, item):
+        links = self._index.links_from(item)
+        return links[0].destination if len(links) != 0 else None
+
+    def find_neighbor_left(self, item):
+        links = self._index.links_to(item)
+        return links[0].source if len(links) != 0 else None
+
+    def find_link(self, source, destination):
+        for link in self._index.links_from(source):
+            if link.destination is destination:
+                return link, self._index.link_owner(link)
+        else:
+            return None, None
+
+    def find_node_owner(self, node):
+        return self._index.node_owner(node)
+
+    def node_count(self):
+        """
+        Число узлов во всём графе, включая подграфы.
+
+        :rtype : int
+        """
+        return self._index.node_count()
+
+    def link_count(self):
+        """
+        Число связей во всём графе, включая подграфы.
+
+        :rtype : int
+        """
+        return self._index.link_count()
+
     def _initial(self, level=1):
         level = 1
 
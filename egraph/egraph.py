@@ -1,21 +1,199 @@
 __author__ = 'Владимир'
 
 from egraph.dot import *
+from egraph.passes import PassManager, PassStage
+from egraph import tracing
 from enum import Enum
-from copy import deepcopy
+import hashlib
+import html
 
 
-class Part(metaclass=abc.ABCMeta):
+class IStructural(metaclass=abc.ABCMeta):
+    """
+    Интерфейс узла модели со структурным отпечатком.
+    Отпечаток - хэш типа узла, его полей и отпечатков дочерних узлов (дерево Меркла). Он вычисляется снизу вверх
+    и хранится до изменения узла, а изменение сбрасывает отпечатки узла и всех его предков. Поэтому равенство
+    поддеревьев определяется за константное время. id в отпечаток не входят.
+    Хэш узла - по тождеству, так как узлы изменяемы и отпечаток меняется при каждой правке; ключом кэшей,
+    сравнивающих структуру, служит сам fingerprint.
+    Если список веток изменён в обход методов модели, нужно вызвать invalidate() у его владельца.
+    """
+
+    __slots__ = ('_fingerprint', '_has_explicit_ids', '_parents')
+
+    def __init__(self):
+        self._fingerprint = None
+        """:type : bytes|None"""
+        self._has_explicit_ids = False
+        self._parents = ()
+        """:type : tuple[IStructural]"""
+
+    def _structure(self):
+        """
+        Поля, определяющие структуру узла: простые значения, дочерние узлы и списки из них.
+
+        :rtype : tuple
+        """
+        return ()
+
+    @property
+    def fingerprint(self) -> bytes:
+        if self._fingerprint is None:
+            IStructural._compute_fingerprints(self)
+        return self._fingerprint
+
+    @property
+    def has_explicit_ids(self) -> bool:
+        """
+        Есть ли в поддереве части с явно заданными id.
+        """
+        if self._fingerprint is None:
+            IStructural._compute_fingerprints(self)
+        return self._has_explicit_ids
+
+    @property
+    def is_dirty(self) -> bool:
+        """
+        Изменялся ли узел или его потомки с тех пор, как отпечаток был вычислен в последний раз
+        (обычно - с последнего построения графа).
+        """
+        return self._fingerprint is None
+
+    def invalidate(self):
+        """
+        Сбрасывает отпечатки узла и его предков.
+        """
+        stack = [self]
+        while len(stack) != 0:
+            item = stack.pop()
+            # если отпечаток уже сброшен, то у предков он тоже сброшен
+            if item._fingerprint is not None:
+                item._fingerprint = None
+                stack.extend(item._parents)
+
+    def _adopt(self, children):
+        """
+        Запоминает узел как родителя дочерних узлов и сбрасывает отпечаток.
+
+        :param list children: Новые дочерние узлы.
+        """
+        for child in children:
+            if isinstance(child, IStructural) and not any(parent is self for parent in child._parents):
+                child._parents += (self,)
+        self.invalidate()
+
+    def _disown(self, children):
+        """
+        Забывает узел как родителя прежних дочерних узлов, чтобы их изменения больше не сбрасывали его отпечаток.
+
+        :param list children: Прежние дочерние узлы.
+        """
+        for child in children:
+            if isinstance(child, IStructural):
+                child._parents = tuple(parent for parent in child._parents if parent is not self)
+
+    @staticmethod
+    def _compute_fingerprints(root):
+        stack = [(root, False)]
+        while len(stack) != 0:
+            item, ready = stack.pop()
+            if item._fingerprint is not None:
+                continue
+            structure = item._structure()
+            if ready:
+                digest = hashlib.blake2b(type(item).__qualname__.encode(), digest_size=16)
+                has_ids = IStructural._update(digest, structure)
+                item._has_explicit_ids = has_ids or getattr(item, '_id', None) is not None
+                item._fingerprint = digest.digest()
+            else:
+                stack.append((item, True))
+                stack.extend([(child, False) for child in IStructural._children(structure)
+                              if child._fingerprint is None])
+
+    @staticmethod
+    def _children(structure):
+        stack = [structure]
+        while len(stack) != 0:
+            value = stack.pop()
+            if type(value) is list or type(value) is tuple:
+                stack.extend(value)
+            elif isinstance(value, IStructural):
+                yield value
+
+    # поля, которые не попадают в копии (copy.deepcopy, pickle), и их значения в копии
+    _transient = {'_parents': ()}
+
+    def __getstate__(self):
+        # ссылки на родителей не копируются: иначе копия поддерева тянула бы за собой всех предков
+        state = {}
+        for base in type(self).__mro__:
+            for name in base.__dict__.get('__slots__', ()):
+                if name not in self._transient and hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in self._transient.items():
+            setattr(self, name, value)
+        for name, value in state.items():
+            setattr(self, name, value)
+        # дочерние узлы уже восстановлены; копия становится их родителем
+        for child in IStructural._children(self._structure()):
+            if not any(parent is self for parent in child._parents):
+                child._parents += (self,)
+
+    @staticmethod
+    def _update(digest, value):
+        """
+        Добавляет значение в хэш.
+
+        :rtype : bool
+        :return: Есть ли явные id во вложенных узлах.
+        """
+        if type(value) is list or type(value) is tuple:
+            has_ids = False
+            digest.update(b'[')
+            for item in value:
+                has_ids = IStructural._update(digest, item) or has_ids
+            digest.update(b']')
+            return has_ids
+        if isinstance(value, IStructural):
+            digest.update(b'#' + value._fingerprint)
+            return value._has_explicit_ids
+        digest.update(repr(value).encode() + b'\0')
+        return False
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, IStructural):
+            return NotImplemented
+        return self.fingerprint == other.fingerprint
+
+    def __hash__(self):
+        # не по отпечатку: иначе узел терялся бы в словаре или множестве после первой же правки
+        return object.__hash__(self)
+
+
+class Part(IStructural, metaclass=abc.ABCMeta):
     """
     Абстрактная часть регулярного выражения.
     """
 
+    __slots__ = ('_id', '_enter', '_exit', '_lowered')
+
+    _transient = {'_parents': (), '_lowered': None}
+
     def __init__(self, id=None):
+        IStructural.__init__(self)
         self._id = id
         self._enter = self
         """:type : Part|None"""
         self._exit = self
         """:type : Part|None"""
+        # последнее построение части (egraph.cache.IncrementalCache)
+        self._lowered = None
+        """:type : tuple|None"""
 
     @property
     def enter(self):
@@ -32,31 +210,91 @@ class Part(metaclass=abc.ABCMeta):
     @id.setter
     def id(self, value):
         self._id = value
+        self.invalidate()
 
     @abc.abstractmethod
-    def to_graph(self, id_counter=1):
+    def to_graph(self, id_counter=1, is_sensitive=None):
         """
-        Возвращает часть регулярного выражения в Dot-представлении.
+        Возвращает часть регулярного выражения в Dot-представлении. Саму часть не изменяет.
 
         :param id_counter: Счётчик id.
+        :param bool|None is_sensitive: Действующая чувствительность к регистру (None - брать из самой части).
         """
         pass
 
-    def _set_id_if_not_exist(self, id_counter):
+    def _take_id(self, id_counter):
         """
-        Устанавливает id, если тот не установлен. В случае установки возвращает id+1.
+        Возвращает id части: собственный, если он задан, иначе значение счётчика (тогда счётчик увеличивается).
 
-        :param int id_counter: Значение устанавливаемое id.
-        :rtype : int
+        :param int id_counter: Счётчик id.
+        :rtype : (int, int)
         """
         if self._id is None:
-            self._id = id_counter
-            id_counter += 1
-        return id_counter
+            return id_counter, id_counter + 1
+        return self._id, id_counter
 
-    @abc.abstractmethod
-    def __eq__(self, other):
-        pass
+    def _build(self, id_counter, is_sensitive):
+        """
+        Генератор построения составной части. Вместо вызова to_graph у вложенных частей выдаёт запросы
+        (часть, id_counter, is_sensitive) и получает обратно их результат, поэтому глубина вложенности
+        не ограничена стеком вызовов Python. У простых частей возвращает None.
+
+        :param int id_counter: Счётчик id.
+        :param bool|None is_sensitive: Действующая чувствительность к регистру.
+        """
+        return None
+
+    def _lower(self, id_counter=1, is_sensitive=None, cache=None):
+        """
+        Строит часть без рекурсии: генераторы _build вложенных частей хранятся в явном стеке.
+        Если передан кэш, то одинаковые по структуре составные части строятся один раз, а затем копируются.
+
+        :param int id_counter: Счётчик id.
+        :param bool|None is_sensitive: Действующая чувствительность к регистру.
+        :param egraph.cache.LoweringCache|egraph.cache.IncrementalCache|None cache: Кэш построенных фрагментов.
+        """
+        stack = []      # (генератор, ключ в кэше, чувствительность к регистру, начальное значение счётчика)
+        result = None
+        request = self, id_counter, is_sensitive
+        while True:
+            if request is not None:
+                item, id_counter, is_sensitive = request
+                builder = item._build(id_counter, is_sensitive)
+                if builder is None:
+                    result = item.to_graph(id_counter, is_sensitive)
+                else:
+                    key = cache.key_for(item) if cache is not None else None
+                    result = cache.fetch(key, is_sensitive, id_counter) if key is not None else None
+                    if result is None:
+                        stack.append((builder, key, is_sensitive, id_counter))
+                    else:
+                        builder.close()
+
+            if len(stack) == 0:
+                return result
+
+            builder, key, sensitive, start = stack[-1]
+            try:
+                request = builder.send(result)
+            except StopIteration as stop:
+                stack.pop()
+                result = stop.value
+                request = None
+                if key is not None:
+                    cache.store(key, sensitive, start, result)
+
+    @staticmethod
+    def _with_case(branch, is_sensitive):
+        """
+        Перебирает элементы ветки вместе с чувствительностью к регистру, действующей для каждого из них.
+
+        :param list[Part] branch: Ветка.
+        :param bool|None is_sensitive: Чувствительность к регистру в начале ветки.
+        """
+        for item in branch:
+            if isinstance(item, OptionCaseSensitivity):
+                is_sensitive = not item.is_positive
+            yield item, is_sensitive
 
 
 class OptionCaseSensitivity(Part):
@@ -64,6 +302,8 @@ class OptionCaseSensitivity(Part):
     Представляет опцию чувствительности к регистру.
     """
 
+    __slots__ = ('_is_positive',)
+
     def __init__(self, is_positive=True, id=None):
         Part.__init__(self, id=id)
         self._is_positive = is_positive
@@ -75,13 +315,14 @@ class OptionCaseSensitivity(Part):
     @is_positive.setter
     def is_positive(self, value: bool):
         self._is_positive = value
+        self.invalidate()
 
-    def __eq__(self, other):
-        return self.is_positive == other.is_positive
+    def _structure(self):
+        return self._is_positive,
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)
-        node = DotNode(self._id, 'i-option', comment=OptionCaseSensitivity.__name__)
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        part_id, id_counter = self._take_id(id_counter)
+        node = DotNode(part_id, 'i-option', comment=OptionCaseSensitivity.__name__)
         return node, id_counter, node, node
 
 
@@ -91,6 +332,8 @@ class PartContainer(Part, metaclass=abc.ABCMeta):
     (по сути альтернатива конкатенаций)
     """
 
+    __slots__ = ('_branches',)
+
     def __init__(self, id=None):
         Part.__init__(self, id)
         self._branches = []
@@ -101,6 +344,7 @@ class PartContainer(Part, metaclass=abc.ABCMeta):
         :param list[Part] branch: Новая ветка для альтернативы.
         """
         self._branches.append(branch)
+        self._adopt(branch)
 
     def __getitem__(self, item):
         return self._branches[item]
@@ -110,29 +354,19 @@ class PartContainer(Part, metaclass=abc.ABCMeta):
             yield branch
 
     @abc.abstractmethod
-    def to_graph(self, id_counter=1):
+    def to_graph(self, id_counter=1, is_sensitive=None):
         pass
 
-    def _perform_case_option(self, initial=OptionCaseSensitivity(False)):
-        for branch in self._branches:
-            option = initial
-            for item in branch:
-                if isinstance(item, OptionCaseSensitivity):
-                    option = item
-                elif isinstance(item, ICaseSensitive):
-                    item.is_sensitive = not option.is_positive
-                elif isinstance(item, PartContainer) or isinstance(item, ConditionalSubexpression):
-                    item._perform_case_option(option)
+    def _branches_to_build(self):
+        """
+        Ветки для построения графа: пустой контейнер строится как контейнер с одной пустой веткой.
 
-    def __eq__(self, other):
-        if len(self) != len(other):
-            return False
-        for i, j in zip(self, other):
-            if len(i) != len(j):
-                return False
-            else:
-                for x, y in zip(i, j):
-                    return x == y
+        :rtype : list[list[Part]]
+        """
+        return self._branches if len(self._branches) != 0 else [[]]
+
+    def _structure(self):
+        return self._branches,
 
 
 class ICaseSensitive(metaclass=abc.ABCMeta):
@@ -140,6 +374,9 @@ class ICaseSensitive(metaclass=abc.ABCMeta):
     Интерфейс чувствительного к регсистру объекта.
     """
 
+    # слот _is_sensitive объявляют наследники: непустые __slots__ у примеси конфликтуют со слотами Part
+    __slots__ = ()
+
     def __init__(self):
         self._is_sensitive = True
 
@@ -150,9 +387,38 @@ class ICaseSensitive(metaclass=abc.ABCMeta):
     @is_sensitive.setter
     def is_sensitive(self, value: bool):
         self._is_sensitive = value
+        self.invalidate()
 
-    def __eq__(self, other):
-        return self.is_sensitive == other.is_sensitive
+    def _sensitivity(self, is_sensitive):
+        """
+        Чувствительность к регистру при построении графа: из контекста, если она там задана, иначе собственная.
+
+        :param bool|None is_sensitive: Чувствительность из контекста.
+        :rtype : bool
+        """
+        return self._is_sensitive if is_sensitive is None else is_sensitive
+
+
+class RenderContext:
+    """
+    Контекст построения dot-графа по модели.
+    Всё, что раньше записывалось в копию модели при построении, хранится здесь, поэтому сама модель не изменяется.
+    """
+
+    def __init__(self, branches, id_counter=1, is_sensitive=None, cache=None):
+        self.branches = branches
+        """:type : list[list[Part]]"""
+        self.id_counter = id_counter
+        self.is_sensitive = is_sensitive
+        """:type : bool|None"""
+        self.graph = None
+        """:type : DotDigraph|None"""
+        self.begin = None
+        """:type : DotNode|None"""
+        self.end = None
+        """:type : DotNode|None"""
+        self.cache = cache
+        """:type : egraph.cache.LoweringCache|None"""
 
 
 class IGraph(PartContainer, metaclass=abc.ABCMeta):
@@ -160,133 +426,176 @@ class IGraph(PartContainer, metaclass=abc.ABCMeta):
     Абстрактный граф.
     """
 
+    __slots__ = ('_id_counter', 'lowering_cache', 'passes')
+
     def __init__(self, id="graph"):
         PartContainer.__init__(self, id)
         self._id_counter = 1
-        self._to_graph_funcs = []
-        self._extra_preprocessing = []
-
-    def to_graph(self, id_counter=1):
+        self.lowering_cache = None
+        """:type : egraph.cache.LoweringCache|egraph.cache.IncrementalCache|None"""
+        self.passes = PassManager()
+        """:type : PassManager"""
+        self.passes.register('optimize', IGraph._optimize_pass, PassStage.dot)
+        self.passes.register('del_case_options', IGraph._del_case_options_pass, PassStage.dot)
+
+    def to_graph(self, id_counter=1, is_sensitive=None):
         """
+        Строит dot-граф: проходы над моделью, построение, проходы над dot-графом.
+        Результаты проходов сохраняются в self.passes.stats.
+
         :rtype : DotDigraph
         """
-        rabbit = deepcopy(self)             # сохраним копию, чтобы потом восстановить
-        """:type : ExplainingGraph"""
-        for func in self._to_graph_funcs:
-            eval(func)
-        graph = rabbit._to_real_graph()
-        ExplainingGraph._del_case_options(graph, graph)
-        return graph
+        with tracing.span('to_graph'):
+            context = RenderContext(self._branches_to_build(), self._id_counter, is_sensitive, self.lowering_cache)
+            self._begin_graph(context)
+
+            self.passes.stats = []
+            self.passes.run(PassStage.model, self, context)
+            with tracing.span('lowering', context.graph):
+                self._to_real_graph(context)
+            self.passes.run(PassStage.dot, self, context)
+            if context.cache is not None:
+                context.cache.commit(context.graph)
 
-    def _to_real_graph(self):
+        return context.graph
+
+    def _begin_graph(self, context):
+        """
+        Создаёт результирующий граф с узлами начала и конца.
+
+        :param RenderContext context: Контекст построения.
+        """
         graph = DotDigraph(self._id)        # собственно результирующий граф
+        context.graph = graph
 
         # добавим в него начало и конец
-        begin = DotNode(self._id_counter, "begin", 'filled', "purple", "begin", "rect", "purple")
-        self._id_counter += 1
-        graph.items.append(begin)
-        end = DotNode(self._id_counter, "end", 'filled', "purple", "end", "rect", "purple")
-        self._id_counter += 1
-        graph.items.append(end)
-
-        if len(self._branches) == 0:  # если ветвей нет, то добавим пустую
-            self._branches.append([])
+        context.begin = DotNode(context.id_counter, "begin", 'filled', "purple", "begin", "rect", "purple")
+        context.id_counter += 1
+        graph.items.append(context.begin)
+        context.end = DotNode(context.id_counter, "end", 'filled', "purple", "end", "rect", "purple")
+        context.id_counter += 1
+        graph.items.append(context.end)
+
+    def _to_real_graph(self, context):
+        """
+        Строит части модели между узлами начала и конца графа из контекста.
 
-        for func in self._extra_preprocessing:
-            eval(func)
+        :param RenderContext context: Контекст построения.
+        :rtype : DotDigraph
+        """
+        graph = context.graph
+        begin = context.begin
+        end = context.end
 
+        id_counter = context.id_counter
         current = begin
-        if len(self._branches) == 1:
-            branch = self._branches[0]
-            """:type : list"""
-            for item in branch:
-                part, new_id, enter, exit = item.to_graph(self._id_counter)
-                self._id_counter = new_id
+        if len(context.branches) == 1:
+            for item, sensitive in self._with_case(context.branches[0], context.is_sensitive):
+                part, id_counter, enter, exit = item._lower(id_counter, sensitive, context.cache)
                 graph.items.append(part)
                 # не забываем соединить две части
-                graph.items.append(DotLink(current, enter, self._id_counter))
-                self._id_counter += 1
+                graph.items.append(DotLink(current, enter, id_counter))
+                id_counter += 1
                 current = exit  # теперь конец нового элемента является зацепкой для следующего
         else:
-            start = DotNode(self._id_counter, tooltip="alternative", shape="point", fillcolor="white")
-            self._id_counter += 1
-            finish = DotNode(self._id_counter, tooltip="alternative", shape="point", fillcolor="white")
-            self._id_counter += 1
+            start = DotNode(id_counter, tooltip="alternative", shape="point", fillcolor="white")
+            id_counter += 1
+            finish = DotNode(id_counter, tooltip="alternative", shape="point", fillcolor="white")
+            id_counter += 1
 
-            graph.items += [start, finish, DotLink(begin, start, self._id_counter)]
-            self._id_counter += 1
+            graph.items += [start, finish, DotLink(begin, start, id_counter)]
+            id_counter += 1
 
-            for branch in self._branches:
+            for branch in context.branches:
                 current = start
-                for item in branch:
-                    part, new_id, enter, exit = item.to_graph(id_counter=self._id_counter)
-                    self._id_counter = new_id
+                for item, sensitive in self._with_case(branch, context.is_sensitive):
+                    part, id_counter, enter, exit = item._lower(id_counter, sensitive, context.cache)
                     graph.items.append(part)
                     # не забываем соединить две части
-                    graph.items.append(DotLink(current, enter, self._id_counter))
-                    self._id_counter += 1
+                    graph.items.append(DotLink(current, enter, id_counter))
+                    id_counter += 1
                     current = exit  # теперь конец нового элемента является зацепкой для следующего
 
-                graph.items.append(DotLink(current, finish, self._id_counter))
-                self._id_counter += 1
+                graph.items.append(DotLink(current, finish, id_counter))
+                id_counter += 1
 
             current = finish
 
-        graph.items.append(DotLink(current, end, self._id_counter))
-        self._id_counter += 1
-
-        ExplainingGraph._optimize(graph, graph)
+        graph.items.append(DotLink(current, end, id_counter))
+        id_counter += 1
+        context.id_counter = id_counter
 
         return graph
 
     @staticmethod
-    def _optimize(graph: IGroupable, main: DotDigraph):
-        ExplainingGraph._optimize_simple_characters(graph, main)
-        ExplainingGraph._optimize_asserts(graph, main)
+    def _optimize_pass(model, context):
+        IGraph._optimize(context.graph, context.graph)
 
-        for item in graph.items:
-            if isinstance(item, IGroupable):
-                ExplainingGraph._optimize(item, main)
+    @staticmethod
+    def _del_case_options_pass(model, context):
+        IGraph._del_case_options(context.graph, context.graph)
 
     @staticmethod
-    def _optimize_simple_characters(graph: IGroupable, main: DotDigraph):
-        while True:
-            for item in filter(lambda i: isinstance(i, DotNode), graph.items):
-                if item._comment != Text.__name__:
-                    continue
-
-                neighbor = main.find_neighbor_right(item)
-                owner = main.find_node_owner(neighbor)
-                # If neighbor is simple node with text too and it's a child of the same subgraph,
-                # then we need to join this two nodes.
-                if neighbor is not None and neighbor._comment == Text.__name__ and owner == graph:
-                    if type(item._id) is str and type(neighbor._id) is str:
-                        ids_this = item._id.split('_')
-                        ids_neighbor = neighbor._id.split('_')
-                        ids_new = ids_this[0] + '_' + ids_this[1] + '_' + ids_neighbor[2]
-                    else:
-                        ids_new = item._id
+    def _optimize(graph: IGroupable, main: DotDigraph):
+        # подграфы обходятся в прямом порядке через явный стек, а не рекурсивно
+        # трассировщик берётся один раз: без трассировки стадии подграфов не оборачиваются ничем
+        tracer = tracing.current()
+        stack = [graph]
+        while len(stack) != 0:
+            graph = stack.pop()
+            if tracer is None:
+                ExplainingGraph._optimize_simple_characters(graph, main)
+                ExplainingGraph._optimize_asserts(graph, main)
+            else:
+                with tracer.span('optimize_simple_characters', main):
+                    ExplainingGraph._optimize_simple_characters(graph, main)
+                with tracer.span('optimize_asserts', main):
+                    ExplainingGraph._optimize_asserts(graph, main)
 
-                    item._label += neighbor._label
-                    item._tooltip += neighbor._label
-                    item.id = ids_new
+            stack.extend(reversed([group for group in graph.items.groups() if not group._settled]))
 
-                    # Find a link between current node and neighbor, then change destination to node after neighbor.
-                    link, _ = main.find_link(item, neighbor)
-                    after = main.find_neighbor_right(neighbor)
+    @staticmethod
+    def _optimize_simple_characters(graph: IGroupable, main: DotDigraph):
+        absorbed = set()    # узлы, уже поглощённые соседями слева
+
+        for item in [i for i in graph.items.nodes() if i._comment == Text.__name__]:
+            if item in absorbed:
+                continue
+
+            labels = [item._label]
+            tooltips = [item._tooltip]
+
+            # Walk the chain to the right and absorb every simple node with text which is a child of the same
+            # subgraph, so each run of text nodes is collapsed in one go.
+            neighbor = main.find_neighbor_right(item)
+            while neighbor is not None and neighbor is not item and neighbor._comment == Text.__name__ \
+                    and main.find_node_owner(neighbor) is graph:
+                if type(item._id) is str and type(neighbor._id) is str:
+                    ids_this = item._id.split('_')
+                    ids_neighbor = neighbor._id.split('_')
+                    item.id = ids_this[0] + '_' + ids_this[1] + '_' + ids_neighbor[2]
+
+                labels.append(neighbor._label)
+                tooltips.append(neighbor._label)
+
+                # Find a link between current node and neighbor, then change destination to node after neighbor.
+                link, link_owner = main.find_link(item, neighbor)
+                after = main.find_neighbor_right(neighbor)
+                if after is not None:
                     link.destination = after
-
                     # Destroy old link.
-                    link, owner = main.find_link(neighbor, after)
-                    if owner is not None:
-                        owner.items.remove(link)
+                    link, link_owner = main.find_link(neighbor, after)
+                # If neighbor was the last node, the link to it is not needed anymore.
+                link_owner.items.remove(link)
 
-                    # Destroy old node.
-                    owner.items.remove(neighbor)
+                # Destroy old node.
+                graph.items.remove(neighbor)
+                absorbed.add(neighbor)
 
-                    break
-            else:
-                break
+                neighbor = after
+
+            item._label = ''.join(labels)
+            item._tooltip = ''.join(tooltips)
 
     @staticmethod
     def _compute_label(label1, label2):
@@ -302,82 +611,64 @@ class IGraph(PartContainer, metaclass=abc.ABCMeta):
 
     @staticmethod
     def _optimize_asserts(graph: IGroupable, main: DotDigraph):
-        while True:
-            # Lets find an assert.
-            for _assert in filter(
-                    lambda i: isinstance(i, DotNode) and i._comment == Assert.__name__,
-                    graph.items
-            ):
-                need_to_break = False
-                # Find its neighbors (left and right).
-                right_neighbor = main.find_neighbor_right(_assert)
-                right_owner = main.find_node_owner(right_neighbor)
-                left_neighbor = main.find_neighbor_left(_assert)
-                left_owner = main.find_node_owner(left_neighbor)
-
-                # First case - both neighbors are in same subgraph.
-                if right_neighbor is not None and left_owner is right_owner and right_owner is graph:
-                    # Find links between neighbors and assert.
-                    left_link, _ = main.find_link(left_neighbor, _assert)
-                    right_link, owner = main.find_link(_assert, right_neighbor)
-
-                    left_link.destination = right_link.destination
-                    left_link._label = ExplainingGraph._compute_label(left_link._label, _assert._label)
-                    left_link.tooltip = left_link._label
-
-                    owner.items.remove(right_link)
-                    graph.items.remove(_assert)
-                    need_to_break = True
-                # Second case - neighbors are not in the same subgraphs, but right neighbor is in same as assert.
-                elif right_neighbor is not None and right_owner is not left_owner \
-                        and left_owner is not graph and right_owner is graph:
-                    right_link, _ = main.find_link(_assert, right_neighbor)
-                    right_link._label = ExplainingGraph._compute_label(_assert._label, right_link._label)
-                    right_link.tooltip = right_link._label
-                    _assert.shape = 'point'
-                    _assert._label = ''
-                # Third case - neighbors are not in the same subgraphs, but left neighbor is in same as assert.
-                elif right_neighbor is not None and right_owner is not left_owner \
-                        and left_owner is graph and right_owner is not graph:
-                    left_link, _ = main.find_link(left_neighbor, _assert)
-                    left_link._label = ExplainingGraph._compute_label(left_link._label, _assert._label)
-                    left_link.tooltip = left_link._label
-                    _assert.shape = 'point'
-                    _assert._label = ''
-                else:  # Fourth case - neighbors are not in the same subgraphs and no one in current subgraph.
-                    # If right neighbor is existing...
-                    if right_neighbor is not None:
-                        # Find links between neighbors and assert.
-                        left_link, _ = main.find_link(left_neighbor, _assert)
-                        right_link, owner = main.find_link(_assert, right_neighbor)
-
-                        left_link.destination = right_link.destination
-                        left_link._label = _assert._label
-                        left_link.tooltip = left_link._label
-
-                        owner.items.remove(right_link)
-                        graph.items.remove(_assert)
-                    else:  # Right neighbor is not existing, so we just replace it with point-node.
-                        point = DotNode(shape="point", comment="Point")
-                        new_link = DotLink(_assert, point, _assert._label, tooltip=_assert._label)
-                        _assert.shape = 'point'
-                        _assert._label = ''
-
-                        graph.items.extend([point, new_link])
-
-                    need_to_break = True
-
-                if need_to_break:
-                    break
-            else:
-                break
+        # Every assert is folded exactly once, in order of the chain.
+        for _assert in [i for i in graph.items.nodes() if i._comment == Assert.__name__]:
+            # Find its neighbors (left and right).
+            right_neighbor = main.find_neighbor_right(_assert)
+            if right_neighbor is None:
+                # Right neighbor is not existing, so we add a point-node to be the one.
+                right_neighbor = DotNode(shape="point", comment="Point")
+                graph.items.extend([right_neighbor, DotLink(_assert, right_neighbor)])
+            right_owner = main.find_node_owner(right_neighbor)
+            left_neighbor = main.find_neighbor_left(_assert)
+            left_owner = main.find_node_owner(left_neighbor)
+
+            # First case - both neighbors are in same subgraph.
+            if left_owner is right_owner and right_owner is graph:
+                # Find links between neighbors and assert.
+                left_link, _ = main.find_link(left_neighbor, _assert)
+                right_link, owner = main.find_link(_assert, right_neighbor)
+
+                left_link.destination = right_link.destination
+                left_link._label = ExplainingGraph._compute_label(left_link._label, _assert._label)
+                left_link.tooltip = left_link._label
+
+                owner.items.remove(right_link)
+                graph.items.remove(_assert)
+            # Second case - neighbors are not in the same subgraphs, but right neighbor is in same as assert.
+            elif right_owner is not left_owner and left_owner is not graph and right_owner is graph:
+                right_link, _ = main.find_link(_assert, right_neighbor)
+                right_link._label = ExplainingGraph._compute_label(_assert._label, right_link._label)
+                right_link.tooltip = right_link._label
+                _assert.shape = 'point'
+                _assert._label = ''
+            # Third case - neighbors are not in the same subgraphs, but left neighbor is in same as assert.
+            elif right_owner is not left_owner and left_owner is graph and right_owner is not graph:
+                left_link, _ = main.find_link(left_neighbor, _assert)
+                left_link._label = ExplainingGraph._compute_label(left_link._label, _assert._label)
+                left_link.tooltip = left_link._label
+                _assert.shape = 'point'
+                _assert._label = ''
+            else:  # Fourth case - neighbors are not in the same subgraphs and no one in current subgraph.
+                # Find links between neighbors and assert.
+                left_link, _ = main.find_link(left_neighbor, _assert)
+                right_link, owner = main.find_link(_assert, right_neighbor)
+
+                left_link.destination = right_link.destination
+                left_link._label = _assert._label
+                left_link.tooltip = left_link._label
+
+                owner.items.remove(right_link)
+                graph.items.remove(_assert)
 
     @staticmethod
     def _del_case_options(graph: IGroupable, main: DotDigraph):
-        while True:
-            for item in filter(lambda i: isinstance(i, DotNode) and i._comment == OptionCaseSensitivity.__name__,
-                               graph.items):
+        # подграфы обходятся в прямом порядке через явный стек, а не рекурсивно
+        stack = [graph]
+        while len(stack) != 0:
+            graph = stack.pop()
 
+            for item in [i for i in graph.items.nodes() if i._comment == OptionCaseSensitivity.__name__]:
                 neighbor_r = main.find_neighbor_right(item)
                 neighbor_l = main.find_neighbor_left(item)
                 link, _ = main.find_link(neighbor_l, item)
@@ -385,15 +676,9 @@ class IGraph(PartContainer, metaclass=abc.ABCMeta):
 
                 link, owner = main.find_link(item, neighbor_r)
                 owner.items.remove(link)
-
                 graph.items.remove(item)
 
-                break
-            else:
-                break
-
-        for subgraph in filter(lambda i: isinstance(i, IGroupable), graph.items):
-            ExplainingGraph._del_case_options(subgraph, main)
+            stack.extend(reversed([group for group in graph.items.groups() if not group._settled]))
 
 
 class ExplainingGraph(IGraph, ICaseSensitive):
@@ -401,34 +686,54 @@ class ExplainingGraph(IGraph, ICaseSensitive):
     Модель объясняющего графа.
     """
 
+    __slots__ = ('_is_sensitive', '_is_exact')
+
     def __init__(self, is_exact=False, is_case_sensitive=True):
         IGraph.__init__(self, "explaining_graph")
         ICaseSensitive.__init__(self)
-        self.is_sensitive = is_case_sensitive
-        self.is_exact = is_exact
-        # реализуем опцию чувствительности к регистру
-        self._to_graph_funcs.append(
-            "rabbit._perform_case_option(OptionCaseSensitivity(not self.is_sensitive))"
-        )
-        self._extra_preprocessing.append(
-            "self._perform_is_exact(graph)"
-        )
+        self._is_sensitive = is_case_sensitive
+        self._is_exact = is_exact
+        # реализуем опцию чувствительности к регистру и флаг точного совпадения
+        self.passes.register('case_option', ExplainingGraph._perform_case_option, PassStage.model)
+        self.passes.register('is_exact', ExplainingGraph._perform_is_exact, PassStage.model)
 
-    def _perform_is_exact(self, graph):
-        # если уставновлен флаг точного совпадения, то проводим соотвествующие преобразования
+    @property
+    def is_exact(self) -> bool:
+        return self._is_exact
+
+    @is_exact.setter
+    def is_exact(self, value: bool):
+        self._is_exact = value
+        self.invalidate()
+
+    def _structure(self):
+        return self._is_sensitive, self._is_exact, self._branches
+
+    def _perform_case_option(self, context):
+        """
+        :param RenderContext context: Контекст построения.
+        """
+        # чувствительность к регистру передаётся частям через контекст, а не записывается в них
+        context.is_sensitive = self.is_sensitive
+
+    def _perform_is_exact(self, context):
+        """
+        :param RenderContext context: Контекст построения.
+        """
+        # если уставновлен флаг точного совпадения, то оборачиваем ветки в контексте (но не в модели)
         if self.is_exact:
-            sol = Assert(AssertType.circumflex, self._id_counter)
-            self._id_counter += 1
-            eol = Assert(AssertType.dollar, self._id_counter)
-            self._id_counter += 1
+            sol = Assert(AssertType.circumflex, context.id_counter)
+            context.id_counter += 1
+            eol = Assert(AssertType.dollar, context.id_counter)
+            context.id_counter += 1
 
-            graph.bgcolor = 'grey'
+            context.graph.bgcolor = 'grey'
 
+            # ветки не передаются через add_branch, чтобы временная обёртка не стала родителем частей модели
             container = Subexpression(is_wrapper=True)
-            for branch in self._branches:
-                container.add_branch(branch)
+            container._branches = list(context.branches)
 
-            self._branches = [[sol, container, eol]]
+            context.branches = [[sol, container, eol]]
 
 
 class Text(Part, ICaseSensitive):
@@ -436,6 +741,8 @@ class Text(Part, ICaseSensitive):
     Простой текст в регулярном выражении.
     """
 
+    __slots__ = ('_txt', '_is_sensitive')
+
     def __init__(self, txt="", id=None):
         Part.__init__(self, id=id)
         ICaseSensitive.__init__(self)
@@ -448,24 +755,26 @@ class Text(Part, ICaseSensitive):
     @text.setter
     def text(self, value: str) -> None:
         self._txt = value
+        self.invalidate()
 
     def __str__(self):
         return self.text
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        part_id, id_counter = self._take_id(id_counter)
+        sensitive = self._sensitivity(is_sensitive)
         node = DotNode(
-            self._id,
+            part_id,
             self.text,
             tooltip=self.text,
             comment=Text.__name__,
-            fillcolor=('' if self.is_sensitive else 'lightgrey'),
-            style=('' if self.is_sensitive else 'filled')
+            fillcolor=('' if sensitive else 'lightgrey'),
+            style=('' if sensitive else 'filled')
         )
         return node, id_counter, node, node
 
-    def __eq__(self, other):
-        return self.text == other.text and ICaseSensitive.__eq__(self, other)
+    def _structure(self):
+        return self._txt, self._is_sensitive
 
 
 class AssertType(Enum):
@@ -480,6 +789,8 @@ class Assert(Part):
     Представляет простое утверждение в регулярном выражении.
     """
 
+    __slots__ = ('_type',)
+
     def __init__(self, type: AssertType, id=None):
         Part.__init__(self, id=id)
         self._type = type
@@ -491,6 +802,7 @@ class Assert(Part):
     @type.setter
     def type(self, value: str):
         self._type = value
+        self.invalidate()
 
     _assert_strings = {
         AssertType.slash_b: "a word boundary",
@@ -499,14 +811,14 @@ class Assert(Part):
         AssertType.dollar: "end of the string"
     }
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        part_id, id_counter = self._take_id(id_counter)
         text = self._assert_strings[self.type]
-        node = DotNode(self._id, text, comment=Assert.__name__)
+        node = DotNode(part_id, text, comment=Assert.__name__)
         return node, id_counter, node, node
 
-    def __eq__(self, other):
-        return self.type == other.type
+    def _structure(self):
+        return self._type,
 
 
 class Subexpression(PartContainer):
@@ -514,6 +826,8 @@ class Subexpression(PartContainer):
     Представляет подвыражение в регулярном выражении.
     """
 
+    __slots__ = ('_number', '_is_wrapper')
+
     def __init__(self, number=None, id=None, is_wrapper=False):
         PartContainer.__init__(self, id=id)
         self._number = number
@@ -526,6 +840,7 @@ class Subexpression(PartContainer):
     @number.setter
     def number(self, value: int):
         self._number = value
+        self.invalidate()
 
     @property
     def is_wrapper(self) -> bool:
@@ -534,9 +849,13 @@ class Subexpression(PartContainer):
     @is_wrapper.setter
     def is_wrapper(self, value: bool):
         self._is_wrapper = value
+        self.invalidate()
+
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        return self._lower(id_counter, is_sensitive)
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)  # устанавливаем id, если он не задан
+    def _build(self, id_counter, is_sensitive):
+        part_id, id_counter = self._take_id(id_counter)  # берём собственный id или следующий из счётчика
 
         if self.number is not None:  # если это не группировка, то надпись нужна
             text = "subexpression #{0}".format(self.number)
@@ -547,19 +866,18 @@ class Subexpression(PartContainer):
 
         # подграф представляющий подвыражение (группировку)
         subgraph = DotSubgraph(
-            id=self._id,
+            id=part_id,
             label=text,
             tooltip=tooltip,
             bgcolor='white',
             color=('white' if self.is_wrapper else 'black')
         )
 
-        if len(self._branches) == 0:  # если ветвей нет, то добавим пустую
-            self._branches.append([])
+        branches = self._branches_to_build()  # если ветвей нет, то строим одну пустую
 
         global_enter = global_exit = None
-        if len(self._branches) == 1:  # если всего 1 ветвь, то это неальтернатива
-            branch = self._branches[0]
+        if len(branches) == 1:  # если всего 1 ветвь, то это неальтернатива
+            branch = branches[0]
 
             # если совсем пустое подвыражение, то внутри надобно сделать точку
             if len(branch) == 0:
@@ -572,8 +890,8 @@ class Subexpression(PartContainer):
             # иначе проходимся по содержимому ветки и генерирем части графа соотвествующие ему (содержимому)
             else:
                 current = None  # первый элемент ни с чем соединять не будем
-                for item in branch:
-                    part, new_id, enter, exit = item.to_graph(id_counter=id_counter)
+                for item, sensitive in self._with_case(branch, is_sensitive):
+                    part, new_id, enter, exit = yield item, id_counter, sensitive
                     if global_enter is None:
                         global_enter = enter
                     id_counter = new_id
@@ -599,10 +917,10 @@ class Subexpression(PartContainer):
             global_exit = finish  # вторая точка это глобальный выход подграфа
 
             # проходимся по веткам и создаём из них части подграфа
-            for branch in self._branches:
+            for branch in branches:
                 current = start  # грядущий первый элемент соединим с начальной точкой
-                for item in branch:
-                    part, new_id, enter, exit = item.to_graph(id_counter=id_counter)
+                for item, sensitive in self._with_case(branch, is_sensitive):
+                    part, new_id, enter, exit = yield item, id_counter, sensitive
                     id_counter = new_id
                     subgraph.items.append(part)
                     # не забываем соединить две части
@@ -616,8 +934,8 @@ class Subexpression(PartContainer):
 
         return subgraph, id_counter, global_enter, global_exit
 
-    def __eq__(self, other):
-        return self.number == other.number and PartContainer.__eq__(self, other)
+    def _structure(self):
+        return self._number, self._is_wrapper, self._branches
 
 
 class CharflagType(Enum):
@@ -769,139 +1087,140 @@ class CharflagType(Enum):
     Vai = 144
     Yi = 145
 
-    Cc_neg = 112
-    Cf_neg = 113
-    Cn_neg = 114
-    Co_neg = 115
-    Cs_neg = 116
-    C_neg = 117
-    Ll_neg = 118
-    Lm_neg = 119
-    Lo_neg = 120
-    Lt_neg = 121
-    Lu_neg = 122
-    L_neg = 123
-    Mc_neg = 124
-    Me_neg = 125
-    Mn_neg = 126
-    M_neg = 127
-    Nd_neg = 128
-    Nl_neg = 129
-    No_neg = 130
-    N_neg = 131
-    Pc_neg = 132
-    Pd_neg = 133
-    Pe_neg = 134
-    Pf_neg = 135
-    Pi_neg = 136
-    Po_neg = 137
-    Ps_neg = 138
-    P_neg = 139
-    Sc_neg = 140
-    Sk_neg = 141
-    Sm_neg = 142
-    So_neg = 143
-    S_neg = 144
-    Zl_neg = 145
-    Zp_neg = 146
-    Zs_neg = 147
-    Z_neg = 148
-    Xan_neg = 149
-    Xps_neg = 151
-    Xsp_neg = 152
-    Xwd_neg = 153
-    Arabic_neg = 154
-    Armenian_neg = 155
-    Avestan_neg = 156
-    Balinese_neg = 157
-    Bamum_neg = 158
-    Bengali_neg = 159
-    Bopomofo_neg = 160
-    Braille_neg = 161
-    Buginese_neg = 162
-    Buhid_neg = 163
-    Canadian_Aboriginal_neg = 164
-    Carian_neg = 165
-    Cham_neg = 166
-    Cherokee_neg = 167
-    Common_neg = 168
-    Coptic_neg = 169
-    Cuneiform_neg = 170
-    Cypriot_neg = 171
-    Cyrillic_neg = 172
-    Deseret_neg = 173
-    Devanagari_neg = 174
-    Egyptian_Hieroglyphs_neg = 175
-    Ethiopic_neg = 176
-    Georgian_neg = 177
-    Glagolitic_neg = 178
-    Gothic_neg = 179
-    Greek_neg = 180
-    Gujarati_neg = 181
-    Gurmukhi_neg = 182
-    Han_neg = 183
-    Hangul_neg = 184
-    Hanunoo_neg = 185
-    Hebrew_neg = 186
-    Hiragana_neg = 187
-    Imperial_Aramaic_neg = 188
-    Inherited_neg = 189
-    Inscriptional_Pahlavi_neg = 190
-    Inscriptional_Parthian_neg = 191
-    Javanese_neg = 192
-    Kaithi_neg = 193
-    Kannada_neg = 194
-    Katakana_neg = 195
-    Kayah_Li_neg = 196
-    Kharoshthi_neg = 197
-    Khmer_neg = 198
-    Lao_neg = 199
-    Latin_neg = 200
-    Lepcha_neg = 201
-    Limbu_neg = 202
-    Linear_B_neg = 203
-    Lisu_neg = 204
-    Lycian_neg = 205
-    Lydian_neg = 206
-    Malayalam_neg = 207
-    Meetei_Mayek_neg = 208
-    Mongolian_neg = 209
-    Myanmar_neg = 210
-    New_Tai_Lue_neg = 211
-    Nko_neg = 212
-    Ogham_neg = 213
-    Old_Italic_neg = 214
-    Old_Persian_neg = 215
-    Old_South_Arabian_neg = 216
-    Old_Turkic_neg = 217
-    Ol_Chiki_neg = 218
-    Oriya_neg = 219
-    Osmanya_neg = 220
-    Phags_Pa_neg = 221
-    Phoenician_neg = 222
-    Rejang_neg = 223
-    Runic_neg = 224
-    Samaritan_neg = 225
-    Saurashtra_neg = 226
-    Shavian_neg = 227
-    Sinhala_neg = 228
-    Sundanese_neg = 229
-    Syloti_Nagri_neg = 230
-    Syriac_neg = 231
-    Tagalog_neg = 232
-    Tagbanwa_neg = 233
-    Tai_Le_neg = 234
-    Tai_Tham_neg = 235
-    Tai_Viet_neg = 236
-    Tamil_neg = 237
-    Telugu_neg = 238
-    Thaana_neg = 239
-    Thai_neg = 240
-    Tibetan_neg = 241
-    Tifinagh_neg = 242
-    Ugaritic_neg = 243
-    Vai_neg = 244
-    Yi_neg = 245
+    # отрицания юникод-флагов не должны совпадать по значению с флагами выше, иначе Enum делает их псевдонимами
+    Cc_neg = 312
+    Cf_neg = 313
+    Cn_neg = 314
+    Co_neg = 315
+    Cs_neg = 316
+    C_neg = 317
+    Ll_neg = 318
+    Lm_neg = 319
+    Lo_neg = 320
+    Lt_neg = 321
+    Lu_neg = 322
+    L_neg = 323
+    Mc_neg = 324
+    Me_neg = 325
+    Mn_neg = 326
+    M_neg = 327
+    Nd_neg = 328
+    Nl_neg = 329
+    No_neg = 330
+    N_neg = 331
+    Pc_neg = 332
+    Pd_neg = 333
+    Pe_neg = 334
+    Pf_neg = 335
+    Pi_neg = 336
+    Po_neg = 337
+    Ps_neg = 338
+    P_neg = 339
+    Sc_neg = 340
+    Sk_neg = 341
+    Sm_neg = 342
+    So_neg = 343
+    S_neg = 344
+    Zl_neg = 345
+    Zp_neg = 346
+    Zs_neg = 347
+    Z_neg = 348
+    Xan_neg = 349
+    Xps_neg = 351
+    Xsp_neg = 352
+    Xwd_neg = 353
+    Arabic_neg = 354
+    Armenian_neg = 355
+    Avestan_neg = 356
+    Balinese_neg = 357
+    Bamum_neg = 358
+    Bengali_neg = 359
+    Bopomofo_neg = 360
+    Braille_neg = 361
+    Buginese_neg = 362
+    Buhid_neg = 363
+    Canadian_Aboriginal_neg = 364
+    Carian_neg = 365
+    Cham_neg = 366
+    Cherokee_neg = 367
+    Common_neg = 368
+    Coptic_neg = 369
+    Cuneiform_neg = 370
+    Cypriot_neg = 371
+    Cyrillic_neg = 372
+    Deseret_neg = 373
+    Devanagari_neg = 374
+    Egyptian_Hieroglyphs_neg = 375
+    Ethiopic_neg = 376
+    Georgian_neg = 377
+    Glagolitic_neg = 378
+    Gothic_neg = 379
+    Greek_neg = 380
+    Gujarati_neg = 381
+    Gurmukhi_neg = 382
+    Han_neg = 383
+    Hangul_neg = 384
+    Hanunoo_neg = 385
+    Hebrew_neg = 386
+    Hiragana_neg = 387
+    Imperial_Aramaic_neg = 388
+    Inherited_neg = 389
+    Inscriptional_Pahlavi_neg = 390
+    Inscriptional_Parthian_neg = 391
+    Javanese_neg = 392
+    Kaithi_neg = 393
+    Kannada_neg = 394
+    Katakana_neg = 395
+    Kayah_Li_neg = 396
+    Kharoshthi_neg = 397
+    Khmer_neg = 398
+    Lao_neg = 399
+    Latin_neg = 400
+    Lepcha_neg = 401
+    Limbu_neg = 402
+    Linear_B_neg = 403
+    Lisu_neg = 404
+    Lycian_neg = 405
+    Lydian_neg = 406
+    Malayalam_neg = 407
+    Meetei_Mayek_neg = 408
+    Mongolian_neg = 409
+    Myanmar_neg = 410
+    New_Tai_Lue_neg = 411
+    Nko_neg = 412
+    Ogham_neg = 413
+    Old_Italic_neg = 414
+    Old_Persian_neg = 415
+    Old_South_Arabian_neg = 416
+    Old_Turkic_neg = 417
+    Ol_Chiki_neg = 418
+    Oriya_neg = 419
+    Osmanya_neg = 420
+    Phags_Pa_neg = 421
+    Phoenician_neg = 422
+    Rejang_neg = 423
+    Runic_neg = 424
+    Samaritan_neg = 425
+    Saurashtra_neg = 426
+    Shavian_neg = 427
+    Sinhala_neg = 428
+    Sundanese_neg = 429
+    Syloti_Nagri_neg = 430
+    Syriac_neg = 431
+    Tagalog_neg = 432
+    Tagbanwa_neg = 433
+    Tai_Le_neg = 434
+    Tai_Tham_neg = 435
+    Tai_Viet_neg = 436
+    Tamil_neg = 437
+    Telugu_neg = 438
+    Thaana_neg = 439
+    Thai_neg = 440
+    Tibetan_neg = 441
+    Tifinagh_neg = 442
+    Ugaritic_neg = 443
+    Vai_neg = 444
+    Yi_neg = 445
 
     # POSIX классы
 
@@ -940,6 +1259,8 @@ class Charflag(Part, ICaseSensitive):
     Представляет символьный флаг в регулярном выражении.
     """
 
+    __slots__ = ('_type', '_is_sensitive')
+
     def __init__(self, type: CharflagType, id=None):
         Part.__init__(self, id=id)
         ICaseSensitive.__init__(self)
@@ -952,6 +1273,7 @@ class Charflag(Part, ICaseSensitive):
     @type.setter
     def type(self, value: CharflagType):
         self._type = value
+        self.invalidate()
 
     _charflag_strings = {
         CharflagType.dot: "any character",
@@ -1267,20 +1589,21 @@ class Charflag(Part, ICaseSensitive):
     def __str__(self):
         return self._charflag_strings[self.type]
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        part_id, id_counter = self._take_id(id_counter)
+        sensitive = self._sensitivity(is_sensitive)
         text = self._charflag_strings[self.type]
         node = DotNode(
-            self._id,
+            part_id,
             text,
             comment=Charflag.__name__, color='hotpink',
-            fillcolor=('' if self.is_sensitive else 'lightgrey'),
-            style=('' if self.is_sensitive else 'filled')
+            fillcolor=('' if sensitive else 'lightgrey'),
+            style=('' if sensitive else 'filled')
         )
         return node, id_counter, node, node
 
-    def __eq__(self, other):
-        return self.type == other.type and ICaseSensitive.__eq__(self, other)
+    def _structure(self):
+        return self._type, self._is_sensitive
 
 
 class Backreference(Part, ICaseSensitive):
@@ -1288,6 +1611,8 @@ class Backreference(Part, ICaseSensitive):
     Представляет обратную ссылку в регулярном выражении.
     """
 
+    __slots__ = ('_number', '_is_sensitive')
+
     def __init__(self, number, id=None):
         Part.__init__(self, id=id)
         ICaseSensitive.__init__(self)
@@ -1300,22 +1625,24 @@ class Backreference(Part, ICaseSensitive):
     @number.setter
     def number(self, value: int):
         self._number = value
+        self.invalidate()
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        part_id, id_counter = self._take_id(id_counter)
+        sensitive = self._sensitivity(is_sensitive)
         node = DotNode(
-            self._id,
+            part_id,
             "backreference #" + str(self.number),
             tooltip="backreference",
             comment=Backreference.__name__,
             color="blue",
-            fillcolor=('' if self.is_sensitive else 'lightgrey'),
-            style=('' if self.is_sensitive else 'filled')
+            fillcolor=('' if sensitive else 'lightgrey'),
+            style=('' if sensitive else 'filled')
         )
         return node, id_counter, node, node
 
-    def __eq__(self, other):
-        return self.number == other.number and ICaseSensitive.__eq__(self, other)
+    def _structure(self):
+        return self._number, self._is_sensitive
 
 
 class SubexpressionCall(Part, ICaseSensitive):
@@ -1323,6 +1650,8 @@ class SubexpressionCall(Part, ICaseSensitive):
     Представляет вызов подмаски в регулярном выражении.
     """
 
+    __slots__ = ('_subexpr_ref', '_is_recursive', '_is_sensitive')
+
     def __init__(self, subexpr_ref=None, is_recursive=False, id=None):
         Part.__init__(self, id=id)
         ICaseSensitive.__init__(self)
@@ -1336,6 +1665,7 @@ class SubexpressionCall(Part, ICaseSensitive):
     @is_recursive.setter
     def is_recursive(self, value: bool):
         self._is_recursive = value
+        self.invalidate()
 
     @property
     def subexpr_ref(self):
@@ -1344,9 +1674,11 @@ class SubexpressionCall(Part, ICaseSensitive):
     @subexpr_ref.setter
     def subexpr_ref(self, value):
         self._subexpr_ref = value
+        self.invalidate()
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        part_id, id_counter = self._take_id(id_counter)
+        sensitive = self._sensitivity(is_sensitive)
 
         if self.subexpr_ref is not None:
             text = "call of the subpattern " + ("#{0}" if type(self.subexpr_ref) is int else '"{0}"')
@@ -1358,20 +1690,18 @@ class SubexpressionCall(Part, ICaseSensitive):
             text = "recursive " + text
 
         node = DotNode(
-            self._id,
+            part_id,
             text,
             tooltip="subexpression call",
             comment=SubexpressionCall.__name__,
             color="blue",
-            fillcolor=('' if self.is_sensitive else 'lightgrey'),
-            style=('' if self.is_sensitive else 'filled')
+            fillcolor=('' if sensitive else 'lightgrey'),
+            style=('' if sensitive else 'filled')
         )
         return node, id_counter, node, node
 
-    def __eq__(self, other):
-        return self.is_recursive == other.is_recursive \
-            and ICaseSensitive.__eq__(self, other) \
-            and self.subexpr_ref == other.subexpr_ref
+    def _structure(self):
+        return self._subexpr_ref, self._is_recursive, self._is_sensitive
 
 
 class Quantifier(PartContainer):
@@ -1379,6 +1709,8 @@ class Quantifier(PartContainer):
     Представляет квантификатор в регулярном выражении.
     """
 
+    __slots__ = ('_min', '_max', '_is_greedy')
+
     def __init__(self, min, max=None, is_greedy=True, id=None):
         PartContainer.__init__(self, id=id)
 
@@ -1399,6 +1731,7 @@ class Quantifier(PartContainer):
     @min.setter
     def min(self, value: int):
         self._min = value
+        self.invalidate()
 
     @property
     def max(self) -> int:
@@ -1407,6 +1740,7 @@ class Quantifier(PartContainer):
     @max.setter
     def max(self, value: int):
         self._max = value
+        self.invalidate()
 
     @property
     def is_greedy(self) -> bool:
@@ -1415,19 +1749,22 @@ class Quantifier(PartContainer):
     @is_greedy.setter
     def is_greedy(self, value: bool):
         self._is_greedy = value
+        self.invalidate()
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        return self._lower(id_counter, is_sensitive)
+
+    def _build(self, id_counter, is_sensitive):
+        part_id, id_counter = self._take_id(id_counter)
         text = "from {0} to {1}".format(self.min, 'infinity' if self.max is None else self.max)
         tooltip = "quantifier"
-        subgraph = DotSubgraph(id=self._id, label=text, tooltip=tooltip, style='dotted')
+        subgraph = DotSubgraph(id=part_id, label=text, tooltip=tooltip, style='dotted')
 
-        if len(self._branches) == 0:
-            self._branches.append([])
+        branches = self._branches_to_build()
 
         global_enter = global_exit = None
-        if len(self._branches) == 1:  # если всего 1 ветвь, то это неальтернатива
-            branch = self._branches[0]
+        if len(branches) == 1:  # если всего 1 ветвь, то это неальтернатива
+            branch = branches[0]
 
             # если совсем пустое подвыражение, то внутри надобно сделать точку
             if len(branch) == 0:
@@ -1440,8 +1777,8 @@ class Quantifier(PartContainer):
             # иначе проходимся по содержимому ветки и генерирем части графа соотвествующие ему (содержимому)
             else:
                 current = None  # первый элемент ни с чем соединять не будем
-                for item in branch:
-                    part, new_id, enter, exit = item.to_graph(id_counter=id_counter)
+                for item, sensitive in self._with_case(branch, is_sensitive):
+                    part, new_id, enter, exit = yield item, id_counter, sensitive
                     if global_enter is None:
                         global_enter = enter
                     id_counter = new_id
@@ -1467,10 +1804,10 @@ class Quantifier(PartContainer):
             global_exit = finish  # вторая точка это глобальный выход подграфа
 
             # проходимся по веткам и создаём из них части подграфа
-            for branch in self._branches:
+            for branch in branches:
                 current = start  # грядущий первый элемент соединим с начальной точкой
-                for item in branch:
-                    part, new_id, enter, exit = item.to_graph(id_counter=id_counter)
+                for item, sensitive in self._with_case(branch, is_sensitive):
+                    part, new_id, enter, exit = yield item, id_counter, sensitive
                     id_counter = new_id
                     subgraph.items.append(part)
                     # не забываем соединить две части
@@ -1484,11 +1821,8 @@ class Quantifier(PartContainer):
 
         return subgraph, id_counter, global_enter, global_exit
 
-    def __eq__(self, other):
-        return self.min == other.min \
-            and PartContainer.__eq__(self, other) \
-            and self.max == other.max \
-            and self.is_greedy == other.is_greedy
+    def _structure(self):
+        return self._min, self._max, self._is_greedy, self._branches
 
 
 class AssertComplexType(Enum):
@@ -1503,6 +1837,8 @@ class AssertComplex(PartContainer):
     Представляет сложный ассерт в регулярном выражении.
     """
 
+    __slots__ = ('_type',)
+
     def __init__(self, type: AssertComplexType, id=None):
         PartContainer.__init__(self, id=id)
         self._type = type
@@ -1514,11 +1850,15 @@ class AssertComplex(PartContainer):
     @type.setter
     def type(self, value: AssertComplexType):
         self._type = value
+        self.invalidate()
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        return self._lower(id_counter, is_sensitive)
+
+    def _build(self, id_counter, is_sensitive):
+        part_id, id_counter = self._take_id(id_counter)
         tooltip = "assert"
-        subgraph = DotSubgraph(id=self._id, tooltip=tooltip, color='grey')
+        subgraph = DotSubgraph(id=part_id, tooltip=tooltip, color='grey')
         color = 'green' if self.type == AssertComplexType.pla or self.type == AssertComplexType.plb else 'red'
         subgraph.edge_attrs = {'style': 'dashed'}
         subgraph.node_attrs = {'style': 'dotted'}
@@ -1531,12 +1871,15 @@ class AssertComplex(PartContainer):
         # result = [enter, link, subgraph]
         # """:type : list[IDotable|DotLink]"""
 
-        if len(self._branches) == 0:
-            self._branches.append([])
+        branches = self._branches_to_build()
 
         global_enter = global_exit = enter
-        if len(self._branches) == 1:  # если всего 1 ветвь, то это неальтернатива
-            branch = self._branches[0]
+        if len(branches) == 1:  # если всего 1 ветвь, то это неальтернатива
+            branch = branches[0]
+            # у тела утверждения нет выхода, поэтому опции в конце ветки не к чему присоединить;
+            # на части ветки они всё равно не влияют
+            while len(branch) != 0 and isinstance(branch[-1], OptionCaseSensitivity):
+                branch = branch[:-1]
 
             # если совсем пустое подвыражение, то внутри надобно сделать точку
             if len(branch) == 0:
@@ -1544,13 +1887,14 @@ class AssertComplex(PartContainer):
                                 comment="Point")
                 id_counter += 1
 
+                # утверждение ведёт к точке внутри подграфа, как и к первому элементу непустой ветки
                 subgraph.items.append(point)
-                global_enter = global_exit = point
+                link.destination = point
             # иначе проходимся по содержимому ветки и генерирем части графа соотвествующие ему (содержимому)
             else:
                 current = None  # первый элемент ни с чем соединять не будем
-                for item in branch:
-                    part, new_id, enter, exit = item.to_graph(id_counter=id_counter)
+                for item, sensitive in self._with_case(branch, is_sensitive):
+                    part, new_id, enter, exit = yield item, id_counter, sensitive
                     if current is None:
                         link.destination = enter
                     id_counter = new_id
@@ -1573,10 +1917,10 @@ class AssertComplex(PartContainer):
             subgraph.items += [start, finish]  # добавляем точки к частям подграфа
 
             # проходимся по веткам и создаём из них части подграфа
-            for branch in self._branches:
+            for branch in branches:
                 current = start  # грядущий первый элемент соединим с начальной точкой
-                for item in branch:
-                    part, new_id, enter, exit = item.to_graph(id_counter=id_counter)
+                for item, sensitive in self._with_case(branch, is_sensitive):
+                    part, new_id, enter, exit = yield item, id_counter, sensitive
                     id_counter = new_id
                     subgraph.items.append(part)
                     # не забываем соединить две части
@@ -1595,17 +1939,19 @@ class AssertComplex(PartContainer):
 
         return wrapper, id_counter, global_enter, global_exit
 
-    def __eq__(self, other):
-        return self.type == other.type \
-            and PartContainer.__eq__(self, other)
+    def _structure(self):
+        return self._type, self._branches
 
 
-class Range:
+class Range(IStructural):
     """
     Представляет диапазон в символьном классе.
     """
 
+    __slots__ = ('_start', '_end')
+
     def __init__(self, start: str, end: str):
+        IStructural.__init__(self)
         self._check_range(start, end)
         self._start = start[0]
         self._end = end[0]
@@ -1618,6 +1964,7 @@ class Range:
     def start(self, value: str):
         self._check_range(value, self.end)
         self._start = value[0]
+        self.invalidate()
 
     @property
     def end(self) -> str:
@@ -1627,12 +1974,13 @@ class Range:
     def end(self, value: str):
         self._check_range(self.start, value)
         self._end = value[0]
+        self.invalidate()
 
     def __str__(self):
         return "from {0} to {1}".format(self.start, self.end)
 
-    def __eq__(self, other):
-        return self.start == other.start and self.end == other.end
+    def _structure(self):
+        return self._start, self._end
 
     @staticmethod
     def _check_range(start: str, end: str):
@@ -1645,11 +1993,14 @@ class CharacterClass(Part, ICaseSensitive):
     Символьный класс в регулярном выражении.
     """
 
+    __slots__ = ('_is_inverted', '_parts', '_is_sensitive')
+
     def __init__(self, is_inverted=False, id=None):
         Part.__init__(self, id=id)
         ICaseSensitive.__init__(self)
         self._is_inverted = is_inverted
         self._parts = [Text('')]
+        self._adopt(self._parts)
 
     @property
     def is_inverted(self) -> bool:
@@ -1658,6 +2009,7 @@ class CharacterClass(Part, ICaseSensitive):
     @is_inverted.setter
     def is_inverted(self, value: bool):
         self._is_inverted = value
+        self.invalidate()
 
     def __getitem__(self, item):
         return self._parts[item]
@@ -1671,46 +2023,38 @@ class CharacterClass(Part, ICaseSensitive):
         if allowed_types.count(type(value)) == 0:
             raise ValueError('Недопустимый тип части символьного класса.')
         if isinstance(value, Text):
-            self._parts[0] += value
+            # символы текста дописываются в общий текст класса (его отпечаток сбросит и отпечаток класса)
+            self._parts[0].text += value.text
         elif self._parts.count(value) == 0:
             self._parts.append(value)
+            self._adopt([value])
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        part_id, id_counter = self._take_id(id_counter)
+        sensitive = self._sensitivity(is_sensitive)
         node = DotNode(
-            self._id,
+            part_id,
             self.generate_html(),
             tooltip='character class',
             comment=CharacterClass.__name__,
             shape='record',
-            fillcolor=('' if self.is_sensitive else 'lightgrey'),
-            style=('' if self.is_sensitive else 'filled')
+            fillcolor=('' if sensitive else 'lightgrey'),
+            style=('' if sensitive else 'filled')
         )
         return node, id_counter, node, node
 
     def generate_html(self):
-        header = 'Any character from' if self.is_inverted else 'Any character except'
+        header = 'Any character except' if self.is_inverted else 'Any character from'
         filtered = list(filter(lambda i: str(i) != '', self._parts))
         result = '<<TABLE BORDER="0" CELLBORDER="1" CELLSPACING="0" CELLPADDING="4"><TR><TD COLSPAN="{0}">' \
                  '<font face="Arial">{1}</font></TD></TR><TR>'.format(len(filtered), header)
 
-        result += ''.join(['<TD>' + str(elem) + '</TD>' for elem in filtered])
+        result += ''.join(['<TD>' + html.escape(str(elem)) + '</TD>' for elem in filtered])
 
         return result + '</TR></TABLE>>'
 
-    def __eq__(self, other):
-        if len(self) != len(other):
-            return False
-
-        result = True
-        for i, j in zip(self, other):
-            if i != j:
-                result = False
-                break
-
-        return ICaseSensitive.__eq__(self, other) \
-            and self.is_inverted == other.is_inverted \
-            and result
+    def _structure(self):
+        return self._is_inverted, self._is_sensitive, self._parts
 
 
 class ConditionalSubexpression(Part):
@@ -1718,6 +2062,8 @@ class ConditionalSubexpression(Part):
     Представляет условное подвыражеине в регулярном выражении.
     """
 
+    __slots__ = ('_condition', '_branch_true', '_branch_false')
+
     def __init__(self, condition, id=None):
         Part.__init__(self, id)
         if ConditionalSubexpression._allowed_types.count(type(condition)) == 0:
@@ -1726,6 +2072,7 @@ class ConditionalSubexpression(Part):
         """:type : SubexpressionCall|AssertComplex"""
         self._branch_true = []
         self._branch_false = []
+        self._adopt([condition])
 
     _allowed_types = [SubexpressionCall, AssertComplex]
 
@@ -1737,7 +2084,9 @@ class ConditionalSubexpression(Part):
     def condition(self, value):
         if ConditionalSubexpression._allowed_types.count(type(value)) == 0:
             raise ValueError('Недопустимый тип условия.')
+        self._disown([self._condition])
         self._condition = value
+        self._adopt([value])
 
     @property
     def branch_true(self):
@@ -1745,7 +2094,9 @@ class ConditionalSubexpression(Part):
 
     @branch_true.setter
     def branch_true(self, value):
+        self._disown(self._branch_true)
         self._branch_true = value if isinstance(value, list) else []
+        self._adopt(self._branch_true)
 
     @property
     def branch_false(self):
@@ -1753,21 +2104,25 @@ class ConditionalSubexpression(Part):
 
     @branch_false.setter
     def branch_false(self, value):
+        self._disown(self._branch_false)
         self._branch_false = value if isinstance(value, list) else []
+        self._adopt(self._branch_false)
 
-    def _build_condition(self, id_counter):
+    def _build_condition(self, id_counter, is_sensitive=None):
         condition = DotSubgraph(color='purple', tooltip='condition')
-        part, id_counter, enter, exit = self.condition.to_graph(id_counter)
+        # как и в PCRE, действующая чувствительность к регистру распространяется и на утверждение-условие:
+        # в (?i)(?(?=a)b|c) символ a показывается нечувствительным к регистру
+        part, id_counter, enter, exit = yield self.condition, id_counter, is_sensitive
         condition.items.append(part)
         return condition, id_counter, enter, exit
 
-    def _buld_branch(self, branch, id_counter):
+    def _buld_branch(self, branch, id_counter, is_sensitive=None):
         block = DotSubgraph(id_counter, style='dashed', color='purple')
         id_counter += 1
 
         global_enter = current = None
-        for item in branch:
-            part, id_counter, enter, exit = item.to_graph(id_counter)
+        for item, sensitive in self._with_case(branch, is_sensitive):
+            part, id_counter, enter, exit = yield item, id_counter, sensitive
             if global_enter is None:
                 global_enter = enter
             block.items.append(part)
@@ -1777,12 +2132,15 @@ class ConditionalSubexpression(Part):
 
         return block, id_counter, global_enter, current
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)
-        subgraph = DotSubgraph(id=self._id, tooltip='conditional subexpression')
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        return self._lower(id_counter, is_sensitive)
+
+    def _build(self, id_counter, is_sensitive):
+        part_id, id_counter = self._take_id(id_counter)
+        subgraph = DotSubgraph(id=part_id, tooltip='conditional subexpression')
 
         # формируем условие
-        condition, id_counter, global_enter, current = self._build_condition(id_counter)
+        condition, id_counter, global_enter, current = yield from self._build_condition(id_counter, is_sensitive)
         subgraph.items.append(condition)
 
         # формируем начальную и конечную точки
@@ -1797,7 +2155,7 @@ class ConditionalSubexpression(Part):
         # формируем истинную ветку
         current = start_point
         if len(self._branch_true) != 0:
-            part, new_id, enter, exit = self._buld_branch(self._branch_true, id_counter)
+            part, new_id, enter, exit = yield from self._buld_branch(self._branch_true, id_counter, is_sensitive)
             subgraph.items += [part, DotLink(current, enter, id_counter, 'true')]
             id_counter += 1
             current = exit
@@ -1812,7 +2170,7 @@ class ConditionalSubexpression(Part):
         # формируем ложную ветку
         current = start_point
         if len(self._branch_false) != 0:
-            part, new_id, enter, exit = self._buld_branch(self._branch_false, id_counter)
+            part, new_id, enter, exit = yield from self._buld_branch(self._branch_false, id_counter, is_sensitive)
             subgraph.items += [part, DotLink(current, enter, id_counter, 'false')]
             id_counter += 1
             current = exit
@@ -1827,20 +2185,5 @@ class ConditionalSubexpression(Part):
 
         return subgraph, id_counter, global_enter, global_end
 
-    @staticmethod
-    def _perform_case_for_branch(branch, option=OptionCaseSensitivity(False)):
-        for item in branch:
-            if isinstance(item, OptionCaseSensitivity):
-                option = item
-            elif isinstance(item, ICaseSensitive):
-                item.is_sensitive = not option.is_positive
-            elif isinstance(item, PartContainer) or isinstance(item, ConditionalSubexpression):
-                item._perform_case_option(option)
-
-    def _perform_case_option(self, initial=OptionCaseSensitivity(False)):
-        self._perform_case_for_branch(self.branch_true, initial)
-        self._perform_case_for_branch(self.branch_false, initial)
-        self._perform_case_for_branch(self.condition, initial)
-
-    def __eq__(self, other):
-        raise NotImplementedError("Not yet!")
\ No newline at end of file
+    def _structure(self):
+        return self._condition, self._branch_true, self._branch_false
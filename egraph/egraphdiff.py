@@ -47,6 +47,8 @@ def compare_items(item1: Part, item2: Part):
 
 class DiffExplainingGraph(IGraph):
 
+    __slots__ = ()
+
     def __init__(self):
         IGraph.__init__(self, "diffegraph")
 
@@ -56,13 +58,15 @@ class DiffAlt(Part):
     Разница в виде альтернативы.
     """
 
+    __slots__ = ()
+
     def __init__(self, id=None):
         Part.__init__(self, id)
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        part_id, id_counter = self._take_id(id_counter)
         node = DotNode(
-            self._id,
+            part_id,
             "diff",
             tooltip="diff",
             comment=DiffAlt.__name__,
@@ -76,13 +80,15 @@ class DiffSubexpresion(PartContainer):
     Разница в виде подвыражения.
     """
 
+    __slots__ = ()
+
     def __init__(self, id=None):
         PartContainer.__init__(self, id)
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        part_id, id_counter = self._take_id(id_counter)
         node = DotNode(
-            self._id,
+            part_id,
             "diff",
             tooltip="diff",
             comment=DiffAlt.__name__,
@@ -96,13 +102,15 @@ class DiffConditionalSubexpression(Part):
     Разница в виде условного подвыражения.
     """
 
+    __slots__ = ()
+
     def __init__(self, id=None):
         Part.__init__(self, id)
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        part_id, id_counter = self._take_id(id_counter)
         node = DotNode(
-            self._id,
+            part_id,
             "diff",
             tooltip="diff",
             comment=DiffAlt.__name__,
@@ -116,13 +124,15 @@ class DiffAssert(Part):
     Разница в виде простого ассерта.
     """
 
+    __slots__ = ()
+
     def __init__(self, id=None):
         Part.__init__(self, id)
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        part_id, id_counter = self._take_id(id_counter)
         node = DotNode(
-            self._id,
+            part_id,
             "diff",
             tooltip="diff",
             comment=DiffAlt.__name__,
@@ -136,13 +146,15 @@ class DiffAssertComplex(PartContainer):
     Разница в виде сложного ассерта.
     """
 
+    __slots__ = ()
+
     def __init__(self, id=None):
         PartContainer.__init__(self, id)
 
-    def to_graph(self, id_counter=1):
-        id_counter = self._set_id_if_not_exist(id_counter)
+    def to_graph(self, id_counter=1, is_sensitive=None):
+        part_id, id_counter = self._take_id(id_counter)
         node = DotNode(
-            self._id,
+            part_id,
             "diff",
             tooltip="diff",
             comment=DiffAlt.__name__,
@@ -0,0 +1,397 @@
+__author__ = 'Владимир'
+
+from collections import OrderedDict
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+
+
+class GraphvizError(RuntimeError):
+    """
+    Graphviz завершился с ошибкой, был прерван по таймауту или отменён.
+    """
+
+    def __init__(self, message, stderr=''):
+        RuntimeError.__init__(self, message)
+        self.stderr = stderr
+        """:type : str"""
+
+
+class DotProcess:
+    """
+    Один запуск dot. Данные передаются через communicate, поэтому переполнение канала stderr
+    не приводит к взаимной блокировке. Запуск можно отменить из другого потока.
+    """
+
+    __slots__ = ('path_to_dot', 'args', '_process', '_cancelled', '_lock')
+
+    def __init__(self, path_to_dot='dot', args=()):
+        """
+        :param str path_to_dot: Путь к исполняемому файлу dot.
+        :param args: Аргументы командной строки (например, ['-Tpng']).
+        """
+        self.path_to_dot = path_to_dot
+        self.args = list(args)
+        self._process = None
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def run(self, script, timeout=None):
+        """
+        Запускает dot и передаёт ему скрипт.
+
+        :param bytes script: dot-код.
+        :param float|None timeout: Сколько секунд ждать завершения.
+        :rtype : bytes
+        :return: Содержимое stdout.
+        """
+        with self._lock:
+            if self._cancelled:
+                raise GraphvizError('Построение отменено.')
+            try:
+                self._process = subprocess.Popen([self.path_to_dot] + self.args, stdin=subprocess.PIPE,
+                                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except OSError as error:
+                raise GraphvizError('Не удалось запустить dot: {0}'.format(error)) from error
+
+        process = self._process
+        try:
+            out, err = process.communicate(script, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise GraphvizError('dot не завершился за {0} с.'.format(timeout))
+
+        if self._cancelled:
+            raise GraphvizError('Построение отменено.')
+        stderr = err.decode('utf-8', 'replace')
+        if process.returncode != 0:
+            raise GraphvizError('dot завершился с кодом {0}.'.format(process.returncode), stderr)
+        return out
+
+    def render(self, script, formats, timeout=None):
+        """
+        Строит изображения в нескольких форматах за один запуск dot: раскладка графа выполняется один раз,
+        а каждая пара ключей -T и -o выводит её в своём формате во временный файл.
+
+        :param bytes script: dot-код.
+        :param formats: Форматы изображений.
+        :param float|None timeout: Сколько секунд ждать завершения.
+        :rtype : dict[str, bytes]
+        """
+        formats = list(dict.fromkeys(formats))
+        with tempfile.TemporaryDirectory(prefix='egraph') as directory:
+            paths = [os.path.join(directory, 'image{0}'.format(i)) for i in range(len(formats))]
+            self.args = [arg for fmt, path in zip(formats, paths) for arg in ('-T' + fmt, '-o' + path)]
+            self.run(script, timeout)
+            images = {}
+            for fmt, path in zip(formats, paths):
+                with open(path, 'rb') as fp:
+                    images[fmt] = fp.read()
+            return images
+
+    def cancel(self):
+        """
+        Отменяет запуск: если dot уже работает, процесс завершается.
+        """
+        with self._lock:
+            self._cancelled = True
+            if self._process is not None and self._process.poll() is None:
+                self._process.kill()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+
+def render(script, fmt='png', path_to_dot='dot', timeout=None):
+    """
+    Строит изображение по dot-коду.
+
+    :param str|bytes script: dot-код.
+    :param str fmt: Формат изображения (значение ключа -T).
+    :param str path_to_dot: Путь к исполняемому файлу dot.
+    :param float|None timeout: Сколько секунд ждать завершения.
+    :rtype : bytes
+    """
+    if isinstance(script, str):
+        script = script.encode('utf-8')
+    return DotProcess(path_to_dot, ['-T' + fmt]).run(script, timeout)
+
+
+def render_formats(script, formats, path_to_dot='dot', timeout=None):
+    """
+    Строит изображения в нескольких форматах с одной раскладкой графа.
+
+    :param str|bytes script: dot-код.
+    :param formats: Форматы изображений (значения ключа -T).
+    :param str path_to_dot: Путь к исполняемому файлу dot.
+    :param float|None timeout: Сколько секунд ждать завершения.
+    :rtype : dict[str, bytes]
+    """
+    if isinstance(script, str):
+        script = script.encode('utf-8')
+    return DotProcess(path_to_dot).render(script, formats, timeout)
+
+
+class ImageCache:
+    """
+    LRU-кэш изображений в памяти. Ключ - хэш dot-кода и формат, поэтому одно и то же изображение
+    не строится повторно. Размер ограничен суммарным объёмом изображений. Потокобезопасен.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        if max_bytes <= 0:
+            raise ValueError('Размер кэша должен быть положительным.')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._images)
+
+    def size(self):
+        """
+        Суммарный размер изображений в байтах.
+
+        :rtype : int
+        """
+        return self._size
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._size = 0
+            self.hits = self.misses = 0
+
+    @staticmethod
+    def key_for(script, fmt):
+        """
+        :param bytes script: dot-код.
+        :param str fmt: Формат изображения.
+        :rtype : (bytes, str)
+        """
+        return hashlib.blake2b(script, digest_size=20).digest(), fmt
+
+    def get(self, script, fmt):
+        """
+        :param bytes script: dot-код.
+        :param str fmt: Формат изображения.
+        :rtype : bytes|None
+        """
+        key = ImageCache.key_for(script, fmt)
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._images.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, script, fmt, image):
+        """
+        :param bytes script: dot-код.
+        :param str fmt: Формат изображения.
+        :param bytes image: Изображение.
+        """
+        if len(image) > self.max_bytes:
+            return
+        key = ImageCache.key_for(script, fmt)
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._images[key] = image
+            self._size += len(image)
+            while self._size > self.max_bytes:
+                self._size -= len(self._images.popitem(last=False)[1])
+
+    def render(self, script, fmt='png', path_to_dot='dot', timeout=None):
+        """
+        Изображение из кэша или построенное dot и сохранённое в кэш.
+
+        :param bytes script: dot-код.
+        :param str fmt: Формат изображения.
+        :param str path_to_dot: Путь к исполняемому файлу dot.
+        :param float|None timeout: Сколько секунд ждать завершения.
+        :rtype : bytes
+        """
+        image = self.get(script, fmt)
+        if image is None:
+            image = render(script, fmt, path_to_dot, timeout)
+            self.put(script, fmt, image)
+        return image
+
+
+class BatchRenderer:
+    """
+    Строит изображения для многих графов, передавая их одному процессу dot порциями: dot читает из stdin
+    несколько графов подряд и выводит изображения одно за другим, а выход разбирается обратно по графам.
+    Так запуск dot и загрузка его модулей оплачиваются один раз на порцию, а не на каждый граф.
+    Если порция не построилась (например, один из графов содержит ошибку) или выход не удалось разделить,
+    графы порции строятся по одному, и ошибка относится только к своему графу.
+    """
+
+    def __init__(self, fmt='svg', path_to_dot='dot', batch_size=32, timeout=None):
+        """
+        :param str fmt: Формат изображений (значение ключа -T).
+        :param str path_to_dot: Путь к исполняемому файлу dot.
+        :param int batch_size: Сколько графов передаётся одному процессу.
+        :param float|None timeout: Сколько секунд ждать построения одного графа.
+        """
+        if batch_size <= 0:
+            raise ValueError('Размер порции должен быть положительным.')
+        self.fmt = fmt
+        self.path_to_dot = path_to_dot
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.fallbacks = 0
+
+    @property
+    def splitter(self):
+        """
+        Функция разбора выхода dot на изображения или None, если формат нельзя разделить.
+        """
+        return _splitters.get(self.fmt.split(':')[0])
+
+    def render(self, graphs):
+        """
+        :param graphs: Графы (DotDigraph) или их dot-код (str или bytes).
+        :rtype : list[bytes|GraphvizError]
+        :return: Изображения в порядке графов; для графов, которые не удалось построить, - ошибки.
+        """
+        scripts = [_script(graph) for graph in graphs]
+        results = []
+        for start in range(0, len(scripts), self.batch_size):
+            results.extend(self._render_batch(scripts[start:start + self.batch_size]))
+        return results
+
+    def _render_batch(self, scripts):
+        splitter = self.splitter
+        if splitter is not None and len(scripts) > 1:
+            timeout = self.timeout * len(scripts) if self.timeout is not None else None
+            try:
+                images = splitter(DotProcess(self.path_to_dot, ['-T' + self.fmt]).run(b'\n'.join(scripts), timeout))
+                if len(images) == len(scripts):
+                    return images
+            except (GraphvizError, ValueError):
+                pass
+            self.fallbacks += 1
+
+        results = []
+        for script in scripts:
+            try:
+                results.append(DotProcess(self.path_to_dot, ['-T' + self.fmt]).run(script, self.timeout))
+            except GraphvizError as error:
+                results.append(error)
+        return results
+
+
+def _script(graph):
+    """
+    :rtype : bytes
+    """
+    if isinstance(graph, bytes):
+        return graph
+    if not isinstance(graph, str):
+        graph = graph.to_dot()
+    return graph.encode('utf-8')
+
+
+_png_signature = b'\x89PNG\r\n\x1a\n'
+
+
+def _split_png(data):
+    """
+    Делит склеенные png по блокам: каждое изображение заканчивается блоком IEND.
+    """
+    images = []
+    start = 0
+    while start < len(data):
+        if data[start:start + 8] != _png_signature:
+            raise ValueError('Ожидалось начало png.')
+        position = start + 8
+        while True:
+            if position + 8 > len(data):
+                raise ValueError('Неполное png.')
+            length = int.from_bytes(data[position:position + 4], 'big')
+            kind = data[position + 4:position + 8]
+            position += length + 12
+            if kind == b'IEND':
+                break
+        if position > len(data):
+            raise ValueError('Неполное png.')
+        images.append(data[start:position])
+        start = position
+    return images
+
+
+def _split_jpeg(data):
+    """
+    Делит склеенные jpeg по маркерам: до начала сжатых данных (SOS) идут сегменты с длиной,
+    в сжатых данных маркером считается 0xFF, за которым не следуют 0x00 и метки перезапуска; EOI завершает изображение.
+    """
+    images = []
+    start = 0
+    while start < len(data):
+        if data[start:start + 2] != b'\xff\xd8':
+            raise ValueError('Ожидалось начало jpeg.')
+        position = start + 2
+        while True:
+            if position + 2 > len(data) or data[position] != 0xFF:
+                raise ValueError('Неверный маркер jpeg.')
+            marker = data[position + 1]
+            if marker == 0xD9:
+                position += 2
+                break
+            if marker == 0xFF:
+                position += 1
+                continue
+            length = int.from_bytes(data[position + 2:position + 4], 'big')
+            position += length + 2
+            if marker == 0xDA:
+                while True:
+                    position = data.find(b'\xff', position)
+                    if position == -1 or position + 1 >= len(data):
+                        raise ValueError('Неполное jpeg.')
+                    following = data[position + 1]
+                    if following != 0x00 and not 0xD0 <= following <= 0xD7:
+                        break
+                    position += 2
+        images.append(data[start:position])
+        start = position
+    return images
+
+
+def _split_svg(data):
+    """
+    Делит склеенные svg по заголовку xml, с которого dot начинает каждый документ.
+    """
+    parts = data.split(b'<?xml')
+    if len(parts[0].strip()) != 0:
+        raise ValueError('Ожидалось начало svg.')
+    return [b'<?xml' + part for part in parts[1:]]
+
+
+def _split_plain(data):
+    """
+    Делит склеенный вывод в формате plain: каждый граф заканчивается строкой stop.
+    """
+    return [part + b'stop\n' for part in data.split(b'stop\n')[:-1]]
+
+
+_splitters = {
+    'png': _split_png,
+    'jpg': _split_jpeg,
+    'jpeg': _split_jpeg,
+    'jpe': _split_jpeg,
+    'svg': _split_svg,
+    'plain': _split_plain,
+    'plain-ext': _split_plain,
+}
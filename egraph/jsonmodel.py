@@ -0,0 +1,199 @@
+__author__ = 'Владимир'
+
+# Представление модели объясняющего графа в JSON: каждая часть - объект с полем "type" (имя класса) и полями
+# своих свойств. Необязательные поля со значениями по умолчанию не записываются:
+#
+# {"type": "ExplainingGraph", "is_exact": true, "branches": [[
+#     {"type": "Text", "text": "ab"},
+#     {"type": "Quantifier", "min": 1, "branches": [[{"type": "Charflag", "kind": "slashd"}]]}
+# ]]}
+#
+# Ошибки в представлении - ModelFormatError с путём к неверному полю, например $.branches[0][1].min.
+
+import json
+
+from egraph.egraph import ExplainingGraph, OptionCaseSensitivity, Text, Assert, AssertType, Subexpression, Charflag, \
+    CharflagType, Backreference, SubexpressionCall, Quantifier, AssertComplex, AssertComplexType, Range, \
+    CharacterClass, ConditionalSubexpression, ICaseSensitive, PartContainer
+
+
+class ModelFormatError(ValueError):
+    """
+    Ошибка в JSON-представлении модели.
+    """
+
+    def __init__(self, message, path):
+        ValueError.__init__(self, '{0}: {1}'.format(path, message))
+        self.path = path
+
+
+def to_json(graph):
+    """
+    :param ExplainingGraph graph: Модель графа.
+    :rtype : str
+    """
+    return json.dumps(to_dict(graph), ensure_ascii=False)
+
+
+def from_json(text):
+    """
+    :param str|bytes text: JSON-представление модели.
+    :rtype : ExplainingGraph
+    """
+    return from_dict(json.loads(text))
+
+
+def to_dict(part):
+    """
+    :param ExplainingGraph|Part|Range part: Модель графа или её часть.
+    :rtype : dict
+    """
+    encode = _encoders.get(type(part))
+    if encode is None:
+        raise ValueError('Часть типа {0} не представима в JSON.'.format(type(part).__name__))
+    data = {'type': type(part).__name__}
+    for key, value in encode(part).items():
+        default = _defaults.get(key, _defaults)
+        if type(value) is not type(default) or value != default:
+            data[key] = value
+    if not isinstance(part, Range):
+        if part.id is not None and not isinstance(part, ExplainingGraph):
+            data['id'] = part.id
+        if isinstance(part, ICaseSensitive) and not isinstance(part, ExplainingGraph) and not part.is_sensitive:
+            data['is_sensitive'] = False
+    if isinstance(part, PartContainer):
+        data['branches'] = [_branch_to_list(branch) for branch in part]
+    return data
+
+
+def from_dict(data, path='$'):
+    """
+    :param dict data: Представление модели графа или её части.
+    :param str path: Путь к части в представлении модели (для сообщений об ошибках).
+    :rtype : ExplainingGraph|Part|Range
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('type'), str):
+        raise ModelFormatError('Часть должна быть объектом с полем type.', path)
+    decode = _decoders.get(data['type'])
+    if decode is None:
+        raise ModelFormatError('Неизвестный тип части: {0}.'.format(data['type']), path)
+    try:
+        part = decode(data, path)
+        if isinstance(part, ICaseSensitive) and not isinstance(part, ExplainingGraph):
+            part.is_sensitive = data.get('is_sensitive', True)
+    except ModelFormatError:
+        raise
+    except KeyError as error:
+        raise ModelFormatError('Нет обязательного поля.', '{0}.{1}'.format(path, error.args[0])) from error
+    except (TypeError, ValueError, IndexError, AttributeError) as error:
+        raise ModelFormatError('Неверное представление части {0}: {1}.'.format(data['type'], error), path) \
+            from error
+    if isinstance(part, PartContainer):
+        branches = data.get('branches', [])
+        if not isinstance(branches, list):
+            raise ModelFormatError('Ветки должны быть списком.', path + '.branches')
+        for i, branch in enumerate(branches):
+            part.add_branch(_branch_from_list(branch, '{0}.branches[{1}]'.format(path, i)))
+    return part
+
+
+def _branch_to_list(branch):
+    return [to_dict(part) for part in branch]
+
+
+def _branch_from_list(branch, path):
+    if not isinstance(branch, list):
+        raise ModelFormatError('Ветка должна быть списком частей.', path)
+    return [from_dict(part, '{0}[{1}]'.format(path, i)) for i, part in enumerate(branch)]
+
+
+def _enum(enum, data, path):
+    name = data['kind']
+    try:
+        return enum[name]
+    except (KeyError, TypeError):
+        raise ModelFormatError('Неизвестное значение {0}: {1}.'.format(enum.__name__, name), path + '.kind') \
+            from None
+
+
+def _string(data, key, path, allow_empty=True):
+    value = data[key]
+    if not isinstance(value, str) or (not allow_empty and len(value) == 0):
+        raise ModelFormatError('Ожидалась строка.' if allow_empty else 'Ожидалась непустая строка.',
+                               '{0}.{1}'.format(path, key))
+    return value
+
+
+def _character_class(data, path):
+    part = CharacterClass(data.get('is_inverted', False), data.get('id'))
+    items = data.get('parts', [])
+    if not isinstance(items, list):
+        raise ModelFormatError('Части класса должны быть списком.', path + '.parts')
+    for i, item in enumerate(items):
+        part.add_part(from_dict(item, '{0}.parts[{1}]'.format(path, i)))
+    return part
+
+
+def _conditional(data, path):
+    part = ConditionalSubexpression(from_dict(data['condition'], path + '.condition'), data.get('id'))
+    part.branch_true = _branch_from_list(data.get('branch_true', []), path + '.branch_true')
+    part.branch_false = _branch_from_list(data.get('branch_false', []), path + '.branch_false')
+    return part
+
+
+# значения по умолчанию необязательных полей
+_defaults = {
+    'is_exact': False,
+    'is_case_sensitive': True,
+    'is_positive': True,
+    'number': None,
+    'is_wrapper': False,
+    'subexpr_ref': None,
+    'is_recursive': False,
+    'max': None,
+    'is_greedy': True,
+    'is_inverted': False,
+    'parts': [],
+    'branch_true': [],
+    'branch_false': [],
+}
+
+_encoders = {
+    ExplainingGraph: lambda part: {'is_exact': part.is_exact, 'is_case_sensitive': part.is_sensitive},
+    OptionCaseSensitivity: lambda part: {'is_positive': part.is_positive},
+    Text: lambda part: {'text': part.text},
+    Assert: lambda part: {'kind': part.type.name},
+    Subexpression: lambda part: {'number': part.number, 'is_wrapper': part.is_wrapper},
+    Charflag: lambda part: {'kind': part.type.name},
+    Backreference: lambda part: {'number': part.number},
+    SubexpressionCall: lambda part: {'subexpr_ref': part.subexpr_ref, 'is_recursive': part.is_recursive},
+    Quantifier: lambda part: {'min': part.min, 'max': part.max, 'is_greedy': part.is_greedy},
+    AssertComplex: lambda part: {'kind': part.type.name},
+    Range: lambda part: {'start': part.start, 'end': part.end},
+    CharacterClass: lambda part: {'is_inverted': part.is_inverted,
+                                  'parts': [to_dict(item) for item in part if str(item) != '']},
+    ConditionalSubexpression: lambda part: {'condition': to_dict(part.condition),
+                                            'branch_true': _branch_to_list(part.branch_true),
+                                            'branch_false': _branch_to_list(part.branch_false)},
+}
+
+_decoders = {
+    'ExplainingGraph': lambda data, path: ExplainingGraph(data.get('is_exact', False),
+                                                          data.get('is_case_sensitive', True)),
+    'OptionCaseSensitivity': lambda data, path: OptionCaseSensitivity(data.get('is_positive', True), data.get('id')),
+    'Text': lambda data, path: Text(_string(data, 'text', path), data.get('id')),
+    'Assert': lambda data, path: Assert(_enum(AssertType, data, path), data.get('id')),
+    'Subexpression': lambda data, path: Subexpression(data.get('number'), data.get('id'),
+                                                      data.get('is_wrapper', False)),
+    'Charflag': lambda data, path: Charflag(_enum(CharflagType, data, path), data.get('id')),
+    'Backreference': lambda data, path: Backreference(data['number'], data.get('id')),
+    'SubexpressionCall': lambda data, path: SubexpressionCall(data.get('subexpr_ref'), data.get('is_recursive', False),
+                                                              data.get('id')),
+    'Quantifier': lambda data, path: Quantifier(data['min'], data.get('max'), data.get('is_greedy', True),
+                                                data.get('id')),
+    'AssertComplex': lambda data, path: AssertComplex(_enum(AssertComplexType, data, path), data.get('id')),
+    'Range': lambda data, path: Range(_string(data, 'start', path, False),
+                                      _string(data, 'end', path, False)),
+    'CharacterClass': _character_class,
+    'ConditionalSubexpression': _conditional,
+}
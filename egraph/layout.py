@@ -0,0 +1,545 @@
+__author__ = 'Владимир'
+
+import html
+import re
+
+from egraph.dot import DotSubgraph, DotNode, IGroupable
+from egraph.graphviz import render
+
+# размеры в пунктах, как в svg от Graphviz (шрифт Times 14pt, узел 0.75 x 0.5 дюйма, ranksep 0.5, nodesep 0.25)
+_font_size = 14
+_char_width = 7
+_node_height = 36
+_min_node_width = 54
+_point_size = 4
+_row_height = 22
+_rank_sep = 36
+_node_sep = 18
+_cluster_pad = 8
+_label_height = 20
+_arrow_length = 10
+_sweeps = 4
+
+_ellipse_shapes = ('', 'ellipse', 'oval')
+_rect_shapes = ('rect', 'box', 'rectangle')
+_supported_shapes = _ellipse_shapes + _rect_shapes + ('point', 'record')
+
+_dash_arrays = {'dashed': '5,2', 'dotted': '1,5'}
+
+
+class _Box:
+    """
+    Прямоугольник раскладки: узел или подграф. Координаты - центр относительно левого верхнего угла
+    родительского подграфа (после раскладки всего графа - абсолютные).
+    """
+
+    __slots__ = ('item', 'width', 'height', 'x', 'y', 'rank', 'boxes', 'edges', 'cells')
+
+    def __init__(self, item):
+        self.item = item
+        self.width = 0
+        self.height = 0
+        self.x = 0
+        self.y = 0
+        self.rank = 0
+        self.boxes = []
+        """:type : list[_Box]"""
+        self.edges = []
+        """:type : list[(_Box, _Box, DotLink)]"""
+        self.cells = None
+        """:type : (str, list[str])|None"""
+
+
+class LayeredLayout:
+    """
+    Послойная раскладка dot-графа слева направо (rankdir=LR) без Graphviz.
+    Каждый подграф раскладывается отдельно и становится прямоугольником в раскладке родителя, поэтому
+    рамки подграфов не пересекаются. Внутри подграфа: ранги - длиннейшие пути (обратные связи циклов
+    в них не учитываются), порядок в ранге - метод барицентров, по вертикали элемент ставится напротив
+    своих предшественников. Этого достаточно для объясняющих графов: цепочек с альтернативами и кластерами.
+    """
+
+    def __init__(self, digraph):
+        """
+        :param DotDigraph digraph: Граф.
+        """
+        self.digraph = digraph
+        self.boxes = {}
+        """:type : dict[IDotable, _Box]"""
+        self.links = []
+        """:type : list[(DotLink, dict[str, str])]"""
+        self._parents = {}
+
+        self.root = self._make_boxes(digraph)
+        self._distribute_links()
+        self._arrange_all()
+
+    @property
+    def width(self):
+        return self.root.width
+
+    @property
+    def height(self):
+        return self.root.height
+
+    def _make_boxes(self, digraph):
+        """
+        Создаёт прямоугольники для всех узлов и подграфов и запоминает связи вместе с атрибутами,
+        унаследованными от подграфов (edge [...]).
+
+        :rtype : _Box
+        """
+        root = self.boxes[digraph] = _Box(digraph)
+        stack = [(digraph, {})]
+        while len(stack) != 0:
+            group, edge_attrs = stack.pop()
+            box = self.boxes[group]
+            for item in group.items:
+                if isinstance(item, IGroupable):
+                    child = self.boxes[item] = _Box(item)
+                    box.boxes.append(child)
+                    self._parents[item] = group
+                    stack.append((item, dict(edge_attrs, **item.edge_attrs)))
+                elif isinstance(item, DotNode):
+                    child = self.boxes[item] = _Box(item)
+                    box.boxes.append(child)
+                    self._parents[item] = group
+                    _measure_node(child)
+                else:
+                    self.links.append((item, edge_attrs))
+        return root
+
+    def _ancestors(self, item):
+        chain = [item]
+        while item in self._parents:
+            item = self._parents[item]
+            chain.append(item)
+        chain.reverse()
+        return chain
+
+    def _distribute_links(self):
+        """
+        Связь попадает в раскладку ближайшего общего подграфа своих концов: там она соединяет
+        содержащие концы прямоугольники.
+        """
+        for link, _ in self.links:
+            if link.source not in self._parents or link.destination not in self._parents:
+                continue
+            source = self._ancestors(link.source)
+            destination = self._ancestors(link.destination)
+            depth = 0
+            while depth < len(source) and depth < len(destination) and source[depth] is destination[depth]:
+                depth += 1
+            if depth == len(source) or depth == len(destination):
+                continue    # петля на узле
+            self.boxes[source[depth - 1]].edges.append(
+                (self.boxes[source[depth]], self.boxes[destination[depth]], link))
+
+    def _arrange_all(self):
+        # сначала вложенные подграфы (их размеры нужны родителю), затем абсолютные координаты сверху вниз
+        order = []
+        stack = [self.root]
+        while len(stack) != 0:
+            box = stack.pop()
+            order.append(box)
+            stack.extend([child for child in box.boxes if isinstance(child.item, IGroupable)])
+        for box in reversed(order):
+            _arrange(box)
+
+        self.root.x = self.root.width / 2
+        self.root.y = self.root.height / 2
+        for box in order:
+            left = box.x - box.width / 2
+            top = box.y - box.height / 2
+            for child in box.boxes:
+                child.x += left
+                child.y += top
+
+    def to_svg(self):
+        """
+        :rtype : str
+        """
+        digraph = self.digraph
+        width, height = self.width, self.height
+        out = ['<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n',
+               '<svg width="{0:.1f}pt" height="{1:.1f}pt" viewBox="0 0 {0:.1f} {1:.1f}" '
+               'xmlns="http://www.w3.org/2000/svg">\n'.format(width, height),
+               '<g id="graph0" class="graph" font-family="Times,serif" font-size="{0}">\n'.format(_font_size)]
+        if digraph.bgcolor != '':
+            out.append('<rect width="{0:.1f}" height="{1:.1f}" fill="{2}"/>\n'.format(width, height, _escape(digraph.bgcolor)))
+
+        stack = [child for child in reversed(self.root.boxes)]
+        nodes = []
+        while len(stack) != 0:
+            box = stack.pop()
+            if isinstance(box.item, DotSubgraph):
+                _cluster_to_svg(box, out)
+                stack.extend(reversed(box.boxes))
+            else:
+                nodes.append(box)
+
+        for link, attrs in self.links:
+            if link.source in self.boxes and link.destination in self.boxes:
+                _link_to_svg(link, attrs, self.boxes[link.source], self.boxes[link.destination], out)
+        for box in nodes:
+            _node_to_svg(box, out)
+
+        out.append('</g>\n</svg>\n')
+        return ''.join(out)
+
+
+def is_simple(digraph, max_nodes=200):
+    """
+    Можно ли разложить граф встроенной раскладкой: направление слева направо, поддерживаемые формы узлов
+    и не больше max_nodes узлов.
+
+    :param DotDigraph digraph: Граф.
+    :param int max_nodes: Порог сложности.
+    :rtype : bool
+    """
+    if digraph.rankdir != 'LR' or digraph.node_count() > max_nodes:
+        return False
+    stack = [digraph]
+    while len(stack) != 0:
+        group = stack.pop()
+        if any(node.shape not in _supported_shapes for node in group.items.nodes()):
+            return False
+        stack.extend(group.items.groups())
+    return True
+
+
+def to_svg(digraph):
+    """
+    svg графа по встроенной раскладке.
+
+    :param DotDigraph digraph: Граф.
+    :rtype : str
+    """
+    return LayeredLayout(digraph).to_svg()
+
+
+def render_svg(digraph, path_to_dot='dot', max_nodes=200, timeout=None):
+    """
+    svg графа: простые графы раскладываются встроенной раскладкой, остальные - Graphviz.
+
+    :param DotDigraph digraph: Граф.
+    :param str path_to_dot: Путь к исполняемому файлу dot.
+    :param int max_nodes: Порог сложности, выше которого используется Graphviz.
+    :param float|None timeout: Сколько секунд ждать Graphviz.
+    :rtype : bytes
+    """
+    if is_simple(digraph, max_nodes):
+        return to_svg(digraph).encode('utf-8')
+    return render(digraph.to_dot(), 'svg', path_to_dot, timeout)
+
+
+def _text_width(text):
+    return len(text) * _char_width
+
+
+def _measure_node(box):
+    node = box.item
+    label = str(node._label)
+    if node.shape == 'point':
+        box.width = box.height = _point_size
+    elif node.shape == 'record':
+        box.cells = _record_cells(label)
+        header, cells = box.cells
+        widths = [_text_width(cell) + 2 * _cluster_pad for cell in cells]
+        box.width = max([_text_width(header) + 2 * _cluster_pad, sum(widths), _min_node_width])
+        box.height = _row_height * (2 if header != '' and len(cells) != 0 else 1)
+    elif node.shape in _rect_shapes:
+        box.width = max(_min_node_width, _text_width(label) + 2 * _cluster_pad)
+        box.height = _node_height
+    else:
+        # текст вписывается в эллипс: его ширина больше ширины текста примерно в sqrt(2) раз
+        box.width = max(_min_node_width, _text_width(label) * 1.42 + _cluster_pad)
+        box.height = _node_height
+
+
+def _record_cells(label):
+    """
+    Ячейки узла record: заголовок и ячейки второй строки html-таблицы или поля, разделённые |.
+
+    :rtype : (str, list[str])
+    """
+    if label.startswith('<'):
+        cells = [html.unescape(re.sub(r'<[^>]*>', '', cell)) for cell in re.findall(r'<TD[^>]*>(.*?)</TD>', label)]
+        return (cells[0], cells[1:]) if len(cells) != 0 else ('', [])
+    return '', [field.strip() for field in label.split('|')]
+
+
+def _arrange(group):
+    """
+    Раскладывает прямоугольники подграфа и вычисляет его размер.
+
+    :param _Box group: Подграф.
+    """
+    boxes = group.boxes
+    pad = _cluster_pad if isinstance(group.item, DotSubgraph) else _cluster_pad / 2
+    top = pad + (_label_height if isinstance(group.item, DotSubgraph) and group.item._label != '' else 0)
+    if len(boxes) == 0:
+        group.width = 2 * pad
+        group.height = top + pad
+        return
+
+    successors = {box: [] for box in boxes}
+    for source, destination, link in group.edges:
+        successors[source].append((destination, link))
+
+    forward, preorder = _forward_edges(boxes, successors)
+    ranks = _assign_ranks(boxes, forward)
+    _order_ranks(ranks, forward, preorder)
+
+    # промежутки между рангами расширяются под подписи связей
+    gaps = [_rank_sep] * len(ranks)
+    for source, destination, link in forward:
+        if link._label != '':
+            gaps[source.rank] = max(gaps[source.rank], _text_width(str(link._label)) + 2 * _cluster_pad)
+
+    x = pad
+    for rank, gap in zip(ranks, gaps):
+        width = max([box.width for box in rank])
+        for box in rank:
+            box.x = x + width / 2
+        x += width + gap
+    group.width = x - gaps[-1] + pad
+
+    _place_vertically(ranks, forward)
+    lowest = min([box.y - box.height / 2 for box in boxes])
+    for box in boxes:
+        box.y += top - lowest
+    group.height = max([box.y + box.height / 2 for box in boxes]) + pad
+
+    if isinstance(group.item, DotSubgraph) and group.item._label != '':
+        group.width = max(group.width, _text_width(str(group.item._label)) + 2 * pad)
+
+
+def _forward_edges(boxes, successors):
+    """
+    Обходит прямоугольники в глубину и отбрасывает обратные связи, чтобы ранги можно было вычислить.
+
+    :rtype : (list[(_Box, _Box, DotLink)], dict[_Box, int])
+    :return: Связи без циклов и порядок обхода.
+    """
+    forward = []
+    preorder = {}
+    on_stack = set()
+    for root in boxes:
+        if root in preorder:
+            continue
+        preorder[root] = len(preorder)
+        on_stack.add(root)
+        stack = [(root, iter(successors[root]))]
+        while len(stack) != 0:
+            box, edges = stack[-1]
+            for destination, link in edges:
+                if destination in on_stack:
+                    continue
+                forward.append((box, destination, link))
+                if destination not in preorder:
+                    preorder[destination] = len(preorder)
+                    on_stack.add(destination)
+                    stack.append((destination, iter(successors[destination])))
+                    break
+            else:
+                stack.pop()
+                on_stack.discard(box)
+    return forward, preorder
+
+
+def _assign_ranks(boxes, forward):
+    """
+    Ранг - длина самого длинного пути до прямоугольника (по связям без циклов).
+
+    :rtype : list[list[_Box]]
+    """
+    incoming = {box: 0 for box in boxes}
+    outgoing = {box: [] for box in boxes}
+    for source, destination, _ in forward:
+        incoming[destination] += 1
+        outgoing[source].append(destination)
+
+    for box in boxes:
+        box.rank = 0
+    ready = [box for box in boxes if incoming[box] == 0]
+    while len(ready) != 0:
+        box = ready.pop()
+        for destination in outgoing[box]:
+            destination.rank = max(destination.rank, box.rank + 1)
+            incoming[destination] -= 1
+            if incoming[destination] == 0:
+                ready.append(destination)
+
+    ranks = [[] for _ in range(max([box.rank for box in boxes]) + 1)]
+    for box in boxes:
+        ranks[box.rank].append(box)
+    return ranks
+
+
+def _order_ranks(ranks, forward, preorder):
+    """
+    Порядок внутри рангов: начальный - порядок обхода, затем проходы метода барицентров
+    слева направо по предшественникам и справа налево по последователям.
+    """
+    predecessors = {box: [] for rank in ranks for box in rank}
+    successors = {box: [] for rank in ranks for box in rank}
+    for source, destination, _ in forward:
+        predecessors[destination].append(source)
+        successors[source].append(destination)
+
+    position = {}
+    for rank in ranks:
+        rank.sort(key=lambda box: preorder[box])
+        position.update((box, index / len(rank)) for index, box in enumerate(rank))
+
+    for sweep in range(_sweeps):
+        neighbours = predecessors if sweep % 2 == 0 else successors
+        for rank in (ranks[1:] if sweep % 2 == 0 else reversed(ranks[:-1])):
+            def barycenter(box):
+                near = neighbours[box]
+                return sum([position[other] for other in near]) / len(near) if len(near) != 0 else position[box]
+            rank.sort(key=barycenter)
+            position.update((box, index / len(rank)) for index, box in enumerate(rank))
+
+
+def _place_vertically(ranks, forward):
+    """
+    Каждый прямоугольник ставится напротив своих предшественников, не нарушая порядка в ранге
+    и не сближая соседей меньше чем на nodesep.
+    """
+    predecessors = {box: [] for rank in ranks for box in rank}
+    for source, destination, _ in forward:
+        predecessors[destination].append(source)
+
+    for rank in ranks:
+        desired = []
+        for box in rank:
+            near = predecessors[box]
+            desired.append(sum([other.y for other in near]) / len(near) if len(near) != 0 else 0)
+
+        # сверху вниз: не выше желаемого места и не ближе nodesep к соседу, затем сдвиг всего ранга,
+        # чтобы в среднем прямоугольники стояли на желаемых местах
+        previous = None
+        for box, y in zip(rank, desired):
+            if previous is not None:
+                y = max(y, previous.y + (previous.height + box.height) / 2 + _node_sep)
+            box.y = y
+            previous = box
+        shift = sum([y - box.y for box, y in zip(rank, desired)]) / len(rank)
+        for box in rank:
+            box.y += shift
+
+
+_rect = '<rect x="{0:.1f}" y="{1:.1f}" width="{2:.1f}" height="{3:.1f}" fill="{4}"{5}/>\n'
+_text = '<text text-anchor="middle" x="{0:.1f}" y="{1:.1f}">{2}</text>\n'
+_escape_table = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#x27;'})
+
+
+def _escape(value):
+    return str(value).translate(_escape_table)
+
+
+def _dom_id(item):
+    return _escape(item.id.strip('"'))
+
+
+def _stroke(color, style):
+    result = ' stroke="{0}"'.format(_escape(color or 'black'))
+    if style in _dash_arrays:
+        result += ' stroke-dasharray="{0}"'.format(_dash_arrays[style])
+    return result
+
+
+def _title(text):
+    return '<title>{0}</title>'.format(_escape(text)) if text != '' else ''
+
+
+def _cluster_to_svg(box, out):
+    subgraph = box.item
+    left, top = box.x - box.width / 2, box.y - box.height / 2
+    out.append('<g id="{0}" class="cluster">{1}\n'.format(_dom_id(subgraph), _title(subgraph._tooltip)))
+    out.append('<rect x="{0:.1f}" y="{1:.1f}" width="{2:.1f}" height="{3:.1f}" fill="{4}"{5}/>\n'.format(
+        left, top, box.width, box.height,
+        _escape(subgraph.bgcolor or 'none'), _stroke(subgraph.color, subgraph.style)))
+    if subgraph._label != '':
+        out.append(_text.format(box.x, top + _label_height - 4, _escape(subgraph._label)))
+    out.append('</g>\n')
+
+
+def _node_to_svg(box, out):
+    node = box.item
+    x, y = box.x, box.y
+    filled = node.style == 'filled'
+    fill = (node.fillcolor or node.color or 'lightgrey') if filled else 'none'
+    stroke = _stroke(node.color, node.style)
+    out.append('<g id="{0}" class="node">{1}\n'.format(_dom_id(node), _title(node._tooltip)))
+
+    if node.shape == 'point':
+        out.append('<circle cx="{0:.1f}" cy="{1:.1f}" r="{2:.1f}" fill="{3}"{4}/>\n'.format(
+            x, y, _point_size / 2, _escape(node.fillcolor or node.color or 'black'), stroke))
+    elif node.shape == 'record':
+        _record_to_svg(box, fill, stroke, out)
+    else:
+        if node.shape in _rect_shapes:
+            out.append(_rect.format(x - box.width / 2, y - box.height / 2, box.width, box.height, _escape(fill), stroke))
+        else:
+            out.append('<ellipse cx="{0:.1f}" cy="{1:.1f}" rx="{2:.1f}" ry="{3:.1f}" fill="{4}"{5}/>\n'.format(
+                x, y, box.width / 2, box.height / 2, _escape(fill), stroke))
+        out.append(_text.format(x, y + _font_size / 3, _escape(node._label)))
+    out.append('</g>\n')
+
+
+def _record_to_svg(box, fill, stroke, out):
+    header, cells = box.cells
+    left, top = box.x - box.width / 2, box.y - box.height / 2
+    rows = []
+    if header != '':
+        rows.append([(header, box.width)])
+    if len(cells) != 0:
+        extra = (box.width - sum([_text_width(cell) + 2 * _cluster_pad for cell in cells])) / len(cells)
+        rows.append([(cell, _text_width(cell) + 2 * _cluster_pad + extra) for cell in cells])
+
+    for row in rows:
+        x = left
+        for text, width in row:
+            out.append(_rect.format(x, top, width, _row_height, _escape(fill), stroke))
+            out.append(_text.format(x + width / 2, top + _row_height / 2 + _font_size / 3, _escape(text)))
+            x += width
+        top += _row_height
+
+
+def _link_to_svg(link, attrs, source, destination, out):
+    style = link.style or attrs.get('style', '')
+    color = link.color or attrs.get('color', '')
+    arrow = link.arrowhead != 'none'
+    out.append('<g id="{0}" class="edge">{1}\n'.format(_dom_id(link), _title(link._tooltip)))
+
+    if destination.x > source.x:
+        # прямая связь: из правого края источника в левый край приёмника
+        x1, y1 = source.x + source.width / 2, source.y
+        x2, y2 = destination.x - destination.width / 2, destination.y
+        end = x2 - _arrow_length if arrow else x2
+        bend = (end - x1) / 2
+        path = 'M{0:.1f},{1:.1f} C{2:.1f},{1:.1f} {3:.1f},{4:.1f} {5:.1f},{4:.1f}'.format(
+            x1, y1, x1 + bend, end - bend, y2, end)
+        head = [(x2, y2), (end, y2 - 3.5), (end, y2 + 3.5)]
+        middle = ((x1 + x2) / 2, (y1 + y2) / 2)
+    else:
+        # обратная связь (цикл): дугой под прямоугольниками, снизу в приёмник
+        x1, y1 = source.x, source.y + source.height / 2
+        x2, y2 = destination.x, destination.y + destination.height / 2
+        end = y2 + _arrow_length if arrow else y2
+        low = max(y1, y2) + _rank_sep
+        path = 'M{0:.1f},{1:.1f} C{0:.1f},{2:.1f} {3:.1f},{2:.1f} {3:.1f},{4:.1f}'.format(x1, y1, low, x2, end)
+        head = [(x2, y2), (x2 - 3.5, end), (x2 + 3.5, end)]
+        middle = ((x1 + x2) / 2, low)
+
+    out.append('<path d="{0}" fill="none"{1}/>\n'.format(path, _stroke(color, style)))
+    if arrow:
+        out.append('<polygon points="{0}" fill="{1}"{2}/>\n'.format(
+            ' '.join(['{0:.1f},{1:.1f}'.format(x, y) for x, y in head]), _escape(color or 'black'),
+            _stroke(color, '')))
+    if link._label != '':
+        out.append(_text.format(middle[0], middle[1] - 4, _escape(link._label)))
+    out.append('</g>\n')
@@ -0,0 +1,687 @@
+__author__ = 'Владимир'
+
+from collections import OrderedDict
+import threading
+
+from egraph.egraph import *
+
+
+class RegexSyntaxError(ValueError):
+    """
+    Ошибка разбора регулярного выражения.
+    """
+
+    def __init__(self, message, position):
+        ValueError.__init__(self, '{0} (позиция {1})'.format(message, position))
+        self.position = position
+
+
+class _Frame:
+    """
+    Открытая группа при разборе: её ветки и то, во что она превратится после закрывающей скобки.
+    """
+
+    __slots__ = ('kind', 'part', 'branches', 'number', 'condition', 'awaits_condition', 'quantifiable', 'case_option',
+                 'start')
+
+    root = 0
+    group = 1       # подвыражение или группировка
+    assertion = 2   # AssertComplex
+    conditional = 3
+
+    def __init__(self, kind, part=None, number=None, start=0):
+        self.kind = kind
+        self.part = part
+        """:type : Part|None"""
+        self.branches = [[]]
+        """:type : list[list[Part]]"""
+        self.number = number
+        """:type : int|str|None"""
+        self.condition = None
+        self.awaits_condition = False
+        self.quantifiable = False   # можно ли применить квантификатор к последней части текущей ветки
+        self.case_option = None     # последняя опция i в группе (None - опции не было)
+        """:type : bool|None"""
+        self.start = start
+
+    def new_branch(self):
+        """
+        Начинает следующую альтернативу. Опция i действует до конца группы, в том числе во всех
+        следующих альтернативах, поэтому новая ветка начинается с действующей опции.
+        """
+        self.branches.append([])
+        self.quantifiable = False
+        if self.case_option is not None:
+            self.branch.append(OptionCaseSensitivity(self.case_option))
+
+    @property
+    def branch(self):
+        """
+        :rtype : list[Part]
+        """
+        return self.branches[-1]
+
+
+class RegexParser:
+    """
+    Разбор регулярного выражения (подмножество PCRE) в модель объясняющего графа.
+    Поддерживаются: литералы и экранирование (\\Q...\\E, \\xhh, \\x{h..}, восьмеричные коды), символьные классы
+    с диапазонами и POSIX-классами, флаги \\d \\h \\s \\v \\w и их отрицания, юникод-свойства \\p и \\P,
+    простые утверждения, альтернатива, квантификаторы (жадные, ленивые, захватывающие), группировки,
+    нумерованные и именованные подвыражения, опережающие и ретроспективные проверки, обратные ссылки,
+    вызовы подмасок, условные подвыражения и опция (?i).
+    Вложенные группы разбираются через явный стек, поэтому глубина вложенности не ограничена стеком вызовов.
+    """
+
+    _flag_escapes = {
+        'd': CharflagType.slashd, 'D': CharflagType.slashd_neg,
+        'h': CharflagType.slashh, 'H': CharflagType.slashh_neg,
+        's': CharflagType.slashs, 'S': CharflagType.slashs_neg,
+        'v': CharflagType.slashv, 'V': CharflagType.slashv_neg,
+        'w': CharflagType.slashw, 'W': CharflagType.slashw_neg,
+    }
+    _assert_escapes = {
+        'b': AssertType.slash_b, 'B': AssertType.slash_B,
+        'A': AssertType.circumflex, 'G': AssertType.circumflex,
+        'z': AssertType.dollar, 'Z': AssertType.dollar,
+    }
+    _char_escapes = {'n': '\n', 't': '\t', 'r': '\r', 'f': '\f', 'e': '\x1b', 'a': '\x07'}
+    _assert_groups = {
+        '=': AssertComplexType.pla, '!': AssertComplexType.nla,
+        '<=': AssertComplexType.plb, '<!': AssertComplexType.nlb,
+    }
+    _unicode_properties = frozenset(
+        [name for name, member in CharflagType.__members__.items() if CharflagType.Cc.value <= member.value <= 145]
+    )
+    _posix_classes = frozenset(['alnum', 'alpha', 'ascii', 'blank', 'cntrl', 'digit', 'graph', 'lower', 'print',
+                                'punct', 'space', 'upper', 'word', 'xdigit'])
+    _option_letters = frozenset('imsxJU')
+
+    def __init__(self, pattern):
+        """
+        :param str pattern: Регулярное выражение без ограничителей и модификаторов.
+        """
+        self.pattern = pattern
+        self._pos = 0
+        self._groups = 0        # число открытых к текущему моменту подвыражений (для нумерации)
+        self._stack = []
+        """:type : list[_Frame]"""
+
+    @staticmethod
+    def parse(pattern, is_exact=False, is_case_sensitive=True):
+        """
+        Строит модель объясняющего графа по регулярному выражению.
+
+        :param str pattern: Регулярное выражение.
+        :param bool is_exact: Флаг точного совпадения.
+        :param bool is_case_sensitive: Чувствительность к регистру.
+        :rtype : ExplainingGraph
+        """
+        graph = ExplainingGraph(is_exact, is_case_sensitive)
+        for branch in RegexParser(pattern).parse_branches():
+            graph.add_branch(branch)
+        return graph
+
+    def parse_branches(self):
+        """
+        Разбирает выражение целиком.
+
+        :rtype : list[list[Part]]
+        """
+        pattern = self.pattern
+        self._stack = [_Frame(_Frame.root)]
+        while self._pos < len(pattern):
+            frame = self._stack[-1]
+            start = self._pos
+            char = pattern[start]
+            self._pos += 1
+
+            if char == '(':
+                self._open_group(start)
+            elif char == ')':
+                self._close_group(start)
+            elif char == '|':
+                if frame.kind == _Frame.conditional and frame.awaits_condition:
+                    raise RegexSyntaxError('Ожидалось условие', start)
+                frame.new_branch()
+            elif char in '*+?{':
+                if not self._quantify(frame, char, start):
+                    self._append(Text(char))
+            elif char == '\\':
+                self._escape(start)
+            elif char == '[':
+                self._append(self._character_class(start))
+            elif char == '.':
+                self._append(Charflag(CharflagType.dot))
+            elif char == '^':
+                self._append(Assert(AssertType.circumflex))
+            elif char == '$':
+                self._append(Assert(AssertType.dollar))
+            else:
+                self._append(Text(char))
+
+        if len(self._stack) != 1:
+            raise RegexSyntaxError('Не закрыта скобка', self._stack[-1].start)
+        return [self._finish_branch(branch) for branch in self._stack[0].branches]
+
+    # --- группы ---
+
+    def _open_group(self, start):
+        pattern = self.pattern
+        if not pattern.startswith('?', self._pos):
+            self._groups += 1
+            self._push(_Frame.group, Subexpression(self._groups), self._groups, start)
+            return
+
+        self._pos += 1
+        rest = pattern[self._pos:self._pos + 3]
+        if rest.startswith(':') or rest.startswith('>') or rest.startswith('|'):
+            # атомарная группировка и сброс номеров ветвей изображаются как обычная группировка
+            self._pos += 1
+            self._push(_Frame.group, Subexpression(), None, start)
+        elif rest.startswith('#'):
+            end = pattern.find(')', self._pos)
+            if end == -1:
+                raise RegexSyntaxError('Не закрыт комментарий', start)
+            self._pos = end + 1
+        elif rest[:2] in RegexParser._assert_groups or rest[:1] in RegexParser._assert_groups:
+            key = rest[:2] if rest[:2] in RegexParser._assert_groups else rest[:1]
+            self._pos += len(key)
+            self._push(_Frame.assertion, AssertComplex(RegexParser._assert_groups[key]), None, start)
+        elif rest.startswith('<') or rest.startswith("'") or rest.startswith('P<'):
+            self._pos += 2 if rest.startswith('P<') else 1
+            name = self._read_name('>' if rest[0] in '<P' else "'", start)
+            self._groups += 1
+            self._push(_Frame.group, Subexpression(name), name, start)
+        elif rest.startswith('P='):
+            self._pos += 2
+            self._append(Backreference(self._read_name(')', start)))
+        elif rest.startswith('P>') or rest.startswith('&'):
+            self._pos += 2 if rest.startswith('P>') else 1
+            self._append(self._call(self._read_name(')', start)))
+        elif rest.startswith('R)'):
+            self._pos += 2
+            self._append(self._call(None))
+        elif len(rest) != 0 and (rest[0].isdigit() or rest[0] in '+-' and rest[1:2].isdigit()):
+            self._append(self._call(self._read_group_reference(')', start)))
+        elif rest.startswith('('):
+            self._pos += 1
+            self._open_conditional(start)
+        else:
+            self._options(start)
+
+    def _push(self, kind, part, number, start):
+        frame = _Frame(kind, part, number, start)
+        self._stack.append(frame)
+        return frame
+
+    def _close_group(self, start):
+        frame = self._stack[-1]
+        if frame.kind == _Frame.root:
+            raise RegexSyntaxError('Лишняя закрывающая скобка', start)
+        self._stack.pop()
+        parent = self._stack[-1]
+        branches = [self._finish_branch(branch) for branch in frame.branches]
+
+        if frame.kind == _Frame.conditional:
+            if frame.awaits_condition:
+                raise RegexSyntaxError('Ожидалось условие', start)
+            if len(branches) > 2:
+                raise RegexSyntaxError('Условное подвыражение может содержать не более двух ветвей', frame.start)
+            part = ConditionalSubexpression(frame.condition)
+            part.branch_true = branches[0]
+            part.branch_false = branches[1] if len(branches) == 2 else []
+        else:
+            part = frame.part
+            for branch in branches:
+                part.add_branch(branch)
+
+        # проверка сразу после (?( - это условие, а не часть ветки
+        if parent.kind == _Frame.conditional and parent.awaits_condition:
+            parent.condition = part
+            parent.awaits_condition = False
+        else:
+            self._append(part)
+
+    def _open_conditional(self, start):
+        pattern = self.pattern
+        frame = self._push(_Frame.conditional, None, None, start)
+        rest = pattern[self._pos:self._pos + 3]
+        if rest.startswith('?') and (rest[1:2] in '=!' or rest[1:3] in ('<=', '<!')):
+            # условие - проверка: она разбирается как обычная группа и станет условием при закрытии
+            frame.awaits_condition = True
+            key = rest[1:3] if rest[1:3] in RegexParser._assert_groups else rest[1:2]
+            self._pos += 1 + len(key)
+            self._push(_Frame.assertion, AssertComplex(RegexParser._assert_groups[key]), None, self._pos - 1)
+            return
+
+        if rest.startswith('<') or rest.startswith("'"):
+            self._pos += 1
+            name = self._read_name('>' if rest[0] == '<' else "'", start)
+            if not pattern.startswith(')', self._pos):
+                raise RegexSyntaxError('Ожидалась )', self._pos)
+            self._pos += 1
+            frame.condition = SubexpressionCall(name)
+        elif rest.startswith('R'):
+            self._pos += 1
+            reference = None
+            if pattern.startswith('&', self._pos):
+                self._pos += 1
+                reference = self._read_name(')', start)
+            elif self._pos < len(pattern) and pattern[self._pos].isdigit():
+                reference = self._read_group_reference(')', start)
+            else:
+                self._expect(')')
+            frame.condition = SubexpressionCall(reference, True)
+        elif len(rest) != 0 and (rest[0].isdigit() or rest[0] in '+-'):
+            frame.condition = SubexpressionCall(self._read_group_reference(')', start))
+        else:
+            frame.condition = SubexpressionCall(self._read_name(')', start))
+
+    def _options(self, start):
+        pattern = self.pattern
+        is_on = True
+        case_option = None
+        while self._pos < len(pattern) and pattern[self._pos] not in ':)':
+            letter = pattern[self._pos]
+            if letter == '-':
+                is_on = False
+            elif letter not in RegexParser._option_letters:
+                raise RegexSyntaxError('Неизвестная конструкция (?{0}'.format(letter), start)
+            elif letter == 'i':
+                case_option = is_on
+            self._pos += 1
+        if self._pos >= len(pattern):
+            raise RegexSyntaxError('Не закрыта скобка', start)
+
+        # опции, кроме i, на вид графа не влияют
+        if pattern[self._pos] == ')':
+            self._pos += 1
+            if case_option is not None:
+                frame = self._stack[-1]
+                frame.branch.append(OptionCaseSensitivity(case_option))
+                frame.quantifiable = False
+                frame.case_option = case_option
+        else:
+            self._pos += 1
+            frame = self._push(_Frame.group, Subexpression(), None, start)
+            if case_option is not None:
+                frame.branch.append(OptionCaseSensitivity(case_option))
+                frame.case_option = case_option
+
+    def _call(self, reference):
+        """
+        Вызов подмаски; он рекурсивный, если вызывается вся маска или ещё не закрытое подвыражение.
+        """
+        is_recursive = reference is None or any(frame.number == reference for frame in self._stack)
+        return SubexpressionCall(reference, is_recursive)
+
+    def _read_group_reference(self, terminator, start):
+        """
+        Номер подвыражения: абсолютный или относительный (+n, -n).
+        """
+        text = self._read_name(terminator, start)
+        try:
+            number = int(text)
+        except ValueError:
+            raise RegexSyntaxError('Неверный номер подвыражения', start)
+        if text[0] == '-':
+            number = self._groups + number + 1
+        elif text[0] == '+':
+            number = self._groups + number
+        if number < 0 or number == 0 and text[0] in '+-':
+            raise RegexSyntaxError('Ссылка на несуществующее подвыражение', start)
+        return number if number != 0 else None
+
+    def _read_name(self, terminator, start):
+        end = self.pattern.find(terminator, self._pos)
+        if end == -1 or end == self._pos:
+            raise RegexSyntaxError('Ожидалось имя, завершающееся {0}'.format(terminator), start)
+        name = self.pattern[self._pos:end]
+        self._pos = end + 1
+        return name
+
+    def _expect(self, text):
+        if not self.pattern.startswith(text, self._pos):
+            raise RegexSyntaxError('Ожидалось {0}'.format(text), self._pos)
+        self._pos += len(text)
+
+    # --- ветки и квантификаторы ---
+
+    def _append(self, part):
+        frame = self._stack[-1]
+        if frame.kind == _Frame.conditional and frame.awaits_condition:
+            raise RegexSyntaxError('Ожидалось условие', self._pos)
+        frame.branch.append(part)
+        frame.quantifiable = not isinstance(part, OptionCaseSensitivity)
+
+    def _quantify(self, frame, char, start):
+        """
+        Применяет квантификатор к последней части ветки.
+
+        :rtype : bool
+        :return: False, если { не начинает квантификатор (тогда это обычный символ).
+        """
+        pattern = self.pattern
+        if char == '{':
+            end = pattern.find('}', self._pos)
+            bounds = pattern[self._pos:end].split(',') if end != -1 else []
+            if len(bounds) not in (1, 2) or not bounds[0].isdigit() or \
+                    len(bounds) == 2 and bounds[1] != '' and not bounds[1].isdigit():
+                return False
+            minimum = int(bounds[0])
+            maximum = minimum if len(bounds) == 1 else (int(bounds[1]) if bounds[1] != '' else None)
+            self._pos = end + 1
+        else:
+            minimum, maximum = {'*': (0, None), '+': (1, None), '?': (0, 1)}[char]
+
+        if not frame.quantifiable:
+            raise RegexSyntaxError('Квантификатору нечего повторять', start)
+
+        is_greedy = True
+        if pattern.startswith('?', self._pos):
+            is_greedy = False
+            self._pos += 1
+        elif pattern.startswith('+', self._pos):
+            self._pos += 1      # захватывающий квантификатор изображается как жадный
+
+        try:
+            quantifier = Quantifier(minimum, maximum, is_greedy)
+        except ValueError as error:
+            raise RegexSyntaxError(str(error), start)
+        quantifier.add_branch([frame.branch.pop()])
+        frame.branch.append(quantifier)
+        frame.quantifiable = False
+        return True
+
+    @staticmethod
+    def _finish_branch(branch):
+        """
+        Сливает соседние текстовые части ветки в одну и убирает опции в конце ветки: после них в ветке
+        ничего нет, а в следующие альтернативы опция переносится при их создании (_Frame.new_branch).
+        """
+        result = []
+        for part in branch:
+            if type(part) is Text and len(result) != 0 and type(result[-1]) is Text:
+                result[-1] = Text(result[-1].text + part.text)
+            else:
+                result.append(part)
+        while len(result) != 0 and isinstance(result[-1], OptionCaseSensitivity):
+            result.pop()
+        return result
+
+    # --- экранирование ---
+
+    def _escape(self, start):
+        pattern = self.pattern
+        if self._pos >= len(pattern):
+            raise RegexSyntaxError('Выражение оканчивается на \\', start)
+        char = pattern[self._pos]
+        self._pos += 1
+
+        if char in RegexParser._flag_escapes:
+            self._append(Charflag(RegexParser._flag_escapes[char]))
+        elif char in RegexParser._assert_escapes:
+            self._append(Assert(RegexParser._assert_escapes[char]))
+        elif char in 'pP':
+            self._append(self._unicode_property(char == 'P', start))
+        elif char == 'Q':
+            end = pattern.find('\\E', self._pos)
+            end = len(pattern) if end == -1 else end
+            for literal in pattern[self._pos:end]:
+                self._append(Text(literal))
+            self._pos = end + 2
+        elif char == 'E':
+            pass
+        elif char in '123456789':
+            self._pos -= 1
+            self._append(Backreference(self._read_digits()))
+        elif char == 'g':
+            self._g_reference(start)
+        elif char == 'k':
+            if self._pos >= len(pattern) or pattern[self._pos] not in '<{\'':
+                raise RegexSyntaxError('Ожидалось имя после \\k', start)
+            terminator = {'<': '>', '{': '}', "'": "'"}[pattern[self._pos]]
+            self._pos += 1
+            self._append(Backreference(self._read_name(terminator, start)))
+        elif char.isalnum() and char not in RegexParser._char_escapes and char not in 'x0co':
+            raise RegexSyntaxError('Неподдерживаемая конструкция \\{0}'.format(char), start)
+        else:
+            self._pos -= 1
+            self._append(Text(self._escaped_char(start)))
+
+    def _g_reference(self, start):
+        pattern = self.pattern
+        if pattern.startswith('{', self._pos):
+            self._pos += 1
+            text = pattern[self._pos:pattern.find('}', self._pos)]
+            if text.lstrip('-').isdigit():
+                self._append(Backreference(self._read_group_reference('}', start)))
+            else:
+                self._append(Backreference(self._read_name('}', start)))
+        elif self._pos < len(pattern) and pattern[self._pos] in '<\'':
+            terminator = '>' if pattern[self._pos] == '<' else "'"
+            self._pos += 1
+            text = pattern[self._pos:pattern.find(terminator, self._pos)]
+            if text.lstrip('+-').isdigit():
+                self._append(self._call(self._read_group_reference(terminator, start)))
+            else:
+                self._append(self._call(self._read_name(terminator, start)))
+        elif pattern[self._pos:self._pos + 1].isdigit() or pattern[self._pos:self._pos + 2][:1] == '-':
+            negative = pattern.startswith('-', self._pos)
+            self._pos += negative
+            number = self._read_digits()
+            self._append(Backreference(self._groups - number + 1 if negative else number))
+        else:
+            raise RegexSyntaxError('Неверная ссылка \\g', start)
+
+    def _read_digits(self):
+        pattern = self.pattern
+        end = self._pos
+        while end < len(pattern) and pattern[end].isdigit():
+            end += 1
+        if end == self._pos:
+            raise RegexSyntaxError('Ожидалось число', self._pos)
+        number = int(pattern[self._pos:end])
+        self._pos = end
+        return number
+
+    def _escaped_char(self, start):
+        """
+        Символ, записанный экранированием (позиция - после \\).
+
+        :rtype : str
+        """
+        pattern = self.pattern
+        char = pattern[self._pos]
+        self._pos += 1
+        if char in RegexParser._char_escapes:
+            return RegexParser._char_escapes[char]
+        if char == 'x':
+            if pattern.startswith('{', self._pos):
+                end = pattern.find('}', self._pos)
+                if end == -1:
+                    raise RegexSyntaxError('Не закрыта фигурная скобка', start)
+                digits = pattern[self._pos + 1:end]
+                self._pos = end + 1
+            else:
+                end = self._pos
+                while end < len(pattern) and end < self._pos + 2 and pattern[end] in '0123456789abcdefABCDEF':
+                    end += 1
+                digits = pattern[self._pos:end] or '0'
+                self._pos = end
+            return self._code_point(digits, 16, start)
+        if char == 'o':
+            self._expect('{')
+            return self._code_point(self._read_name('}', start), 8, start)
+        if char == 'c':
+            if self._pos >= len(pattern):
+                raise RegexSyntaxError('Ожидался символ после \\c', start)
+            self._pos += 1
+            return chr(ord(pattern[self._pos - 1].upper()) ^ 0x40)
+        if char == '0':
+            end = self._pos
+            while end < len(pattern) and end < self._pos + 2 and pattern[end] in '01234567':
+                end += 1
+            digits = '0' + pattern[self._pos:end]
+            self._pos = end
+            return self._code_point(digits, 8, start)
+        return char
+
+    @staticmethod
+    def _code_point(digits, base, start):
+        try:
+            return chr(int(digits, base))
+        except ValueError:
+            raise RegexSyntaxError('Неверный код символа', start)
+
+    def _unicode_property(self, is_negative, start):
+        pattern = self.pattern
+        if pattern.startswith('{', self._pos):
+            self._pos += 1
+            name = self._read_name('}', start)
+            if name.startswith('^'):
+                is_negative = not is_negative
+                name = name[1:]
+        elif self._pos < len(pattern):
+            name = pattern[self._pos]
+            self._pos += 1
+        else:
+            raise RegexSyntaxError('Ожидалось юникод-свойство', start)
+
+        if name not in RegexParser._unicode_properties:
+            raise RegexSyntaxError('Неизвестное юникод-свойство {0}'.format(name), start)
+        return Charflag(CharflagType[name + '_neg' if is_negative else name])
+
+    # --- символьные классы ---
+
+    def _character_class(self, start):
+        pattern = self.pattern
+        result = CharacterClass(pattern.startswith('^', self._pos))
+        self._pos += result.is_inverted
+
+        first = True
+        while True:
+            if self._pos >= len(pattern):
+                raise RegexSyntaxError('Не закрыт символьный класс', start)
+            char = pattern[self._pos]
+            if char == ']' and not first:
+                self._pos += 1
+                return result
+            first = False
+
+            item = self._class_item(start)
+            # диапазон: символ, дефис и символ (дефис в конце класса - обычный символ)
+            if isinstance(item, str) and pattern.startswith('-', self._pos) \
+                    and self._pos + 1 < len(pattern) and pattern[self._pos + 1] != ']':
+                self._pos += 1
+                end = self._class_item(start)
+                if not isinstance(end, str):
+                    raise RegexSyntaxError('Неверный диапазон в символьном классе', start)
+                try:
+                    result.add_part(Range(item, end))
+                except ValueError as error:
+                    raise RegexSyntaxError(str(error), start)
+            elif isinstance(item, str):
+                result.add_part(Text(item))
+            else:
+                result.add_part(item)
+
+    def _class_item(self, start):
+        """
+        Элемент символьного класса: символ (str) или флаг (Charflag).
+        """
+        pattern = self.pattern
+        char = pattern[self._pos]
+        if char == '[' and pattern.startswith('[:', self._pos):
+            end = pattern.find(':]', self._pos + 2)
+            name = pattern[self._pos + 2:end] if end != -1 else ''
+            is_negative = name.startswith('^')
+            name = name.lstrip('^')
+            if name in RegexParser._posix_classes:
+                self._pos = end + 2
+                return Charflag(CharflagType[name + '_neg' if is_negative else name])
+
+        self._pos += 1
+        if char != '\\':
+            return char
+        if self._pos >= len(pattern):
+            raise RegexSyntaxError('Не закрыт символьный класс', start)
+
+        char = pattern[self._pos]
+        if char in RegexParser._flag_escapes:
+            self._pos += 1
+            return Charflag(RegexParser._flag_escapes[char])
+        if char in 'pP':
+            self._pos += 1
+            return self._unicode_property(char == 'P', start)
+        if char == 'b':
+            self._pos += 1
+            return '\b'
+        if char.isalnum() and char not in RegexParser._char_escapes and char not in 'x0co':
+            raise RegexSyntaxError('Неподдерживаемая конструкция \\{0} в символьном классе'.format(char), start)
+        return self._escaped_char(start)
+
+
+class PatternCache:
+    """
+    LRU-кэш dot-кода для регулярных выражений. Ключ - (выражение, точное совпадение, чувствительность к регистру),
+    поэтому повторные выражения не разбираются и не строятся заново. Потокобезопасен.
+    """
+
+    def __init__(self, max_size=256):
+        if max_size <= 0:
+            raise ValueError('Размер кэша должен быть положительным.')
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._dots = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._dots)
+
+    def clear(self):
+        with self._lock:
+            self._dots.clear()
+            self.hits = self.misses = 0
+
+    def render(self, pattern, is_exact=False, is_case_sensitive=True):
+        """
+        Возвращает dot-код объясняющего графа для регулярного выражения.
+
+        :param str pattern: Регулярное выражение.
+        :param bool is_exact: Флаг точного совпадения.
+        :param bool is_case_sensitive: Чувствительность к регистру.
+        :rtype : str
+        """
+        key = (pattern, bool(is_exact), bool(is_case_sensitive))
+        with self._lock:
+            dot = self._dots.get(key)
+            if dot is not None:
+                self._dots.move_to_end(key)
+                self.hits += 1
+                return dot
+            self.misses += 1
+
+        # разбор и построение идут вне блокировки: одинаковое выражение в двух потоках построится дважды,
+        # но разные выражения не ждут друг друга
+        dot = RegexParser.parse(pattern, is_exact, is_case_sensitive).to_graph().to_dot()
+        with self._lock:
+            self._dots[key] = dot
+            self._dots.move_to_end(key)
+            while len(self._dots) > self.max_size:
+                self._dots.popitem(last=False)
+        return dot
+
+
+default_cache = PatternCache()
+
+
+def pattern_to_dot(pattern, is_exact=False, is_case_sensitive=True):
+    """
+    dot-код объясняющего графа для регулярного выражения через общий кэш default_cache.
+
+    :rtype : str
+    """
+    return default_cache.render(pattern, is_exact, is_case_sensitive)
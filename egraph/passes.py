@@ -0,0 +1,115 @@
+__author__ = 'Владимир'
+
+from enum import Enum
+import time
+
+from egraph import tracing
+
+
+class PassStage(Enum):
+    model = 1   # над моделью, до построения dot-графа
+    dot = 2     # над уже построенным dot-графом
+
+
+class PassStats:
+    """
+    Результаты последнего запуска прохода: время работы и изменение числа узлов и связей.
+    """
+
+    def __init__(self, name, seconds=0.0, nodes_delta=0, links_delta=0):
+        self.name = name
+        self.seconds = seconds
+        self.nodes_delta = nodes_delta
+        self.links_delta = links_delta
+
+    def __repr__(self):
+        return 'PassStats({0!r}, seconds={1:.6f}, nodes_delta={2}, links_delta={3})'.format(
+            self.name, self.seconds, self.nodes_delta, self.links_delta
+        )
+
+
+class Pass:
+    """
+    Именованный проход построения графа.
+    Функция прохода принимает модель графа и контекст построения: func(model, context).
+    Версию прохода нужно увеличивать при каждом изменении его результата: она входит в ключ постоянного кэша
+    (egraph.diskcache), и без неё кэш отдавал бы результаты прежней версии прохода.
+    """
+
+    def __init__(self, name, func, stage: PassStage, enabled=True, version=1):
+        self.name = name
+        self.func = func
+        self.stage = stage
+        self.enabled = enabled
+        self.version = version
+
+
+class PassManager:
+    """
+    Список проходов построения графа. Проходы выполняются в порядке регистрации внутри своей стадии,
+    их можно включать и выключать, а для каждого запуска замеряется время и изменение графа.
+    """
+
+    def __init__(self):
+        self._passes = []
+        """:type : list[Pass]"""
+        self.stats = []
+        """:type : list[PassStats]"""
+
+    def register(self, name, func, stage: PassStage, enabled=True, version=1):
+        """
+        Регистрирует новый проход.
+
+        :param str name: Уникальное имя прохода.
+        :param func: Функция прохода func(model, context).
+        :param PassStage stage: Стадия, на которой выполняется проход.
+        :param bool enabled: Включён ли проход.
+        :param int version: Версия прохода (см. Pass).
+        """
+        if self.find(name) is not None:
+            raise ValueError('Проход "{0}" уже зарегистрирован.'.format(name))
+        self._passes.append(Pass(name, func, stage, enabled, version))
+
+    def find(self, name):
+        """
+        :param str name: Имя прохода.
+        :rtype : Pass|None
+        """
+        for item in self._passes:
+            if item.name == name:
+                return item
+        else:
+            return None
+
+    def enable(self, name, enabled=True):
+        item = self.find(name)
+        if item is None:
+            raise KeyError(name)
+        item.enabled = enabled
+
+    def disable(self, name):
+        self.enable(name, False)
+
+    def __iter__(self):
+        for item in self._passes:
+            yield item
+
+    def run(self, stage: PassStage, model, context):
+        """
+        Выполняет все включённые проходы стадии и дописывает их результаты в stats.
+
+        :param PassStage stage: Выполняемая стадия.
+        :param model: Модель графа.
+        :param context: Контекст построения (context.graph - строящийся dot-граф).
+        """
+        for item in self._passes:
+            if item.stage is not stage or not item.enabled:
+                continue
+
+            graph = context.graph
+            nodes, links = graph.node_count(), graph.link_count()
+            start = time.perf_counter()
+            with tracing.span(item.name, graph):
+                item.func(model, context)
+            seconds = time.perf_counter() - start
+            self.stats.append(PassStats(item.name, seconds, graph.node_count() - nodes, graph.link_count() - links))
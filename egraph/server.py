@@ -0,0 +1,294 @@
+__author__ = 'Владимир'
+
+# Локальная служба построения объясняющих графов на Unix-сокете. Процесс службы и пул процессов-исполнителей
+# запускаются один раз, поэтому запрос не платит за запуск Python и импорт egraph.
+#
+# Запуск: python -m egraph.server [--socket PATH] [--workers N] [--cache PATH] [--dot PATH]
+#
+# Протокол: по соединению передаются JSON-объекты, по одному в строке. Запрос:
+#     {"id": 1, "regex": "a(b|c)*", "is_exact": false, "is_case_sensitive": true, "format": "svg"}
+# или вместо "regex" - "model" с моделью графа в формате egraph.jsonmodel. Формат "dot" (по умолчанию)
+# возвращает dot-код, остальные форматы строятся Graphviz. Ответы приходят в порядке запросов:
+#     {"id": 1, "ok": true, "format": "svg", "data": "<base64>"}  (для формата dot - поле "dot" с текстом)
+#     {"id": 1, "ok": false, "error": "..."}
+
+import argparse
+import asyncio
+import base64
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import signal
+import socket
+import tempfile
+
+from egraph.diskcache import DiskRenderCache
+from egraph.graphviz import BatchRenderer, GraphvizError
+from egraph.jsonmodel import from_dict
+from egraph.parser import RegexParser
+
+default_socket = os.path.join(tempfile.gettempdir(), 'egraph.sock')
+default_cache = os.path.join(tempfile.gettempdir(), 'egraph-cache.sqlite')
+
+# строка запроса может содержать большую модель
+_line_limit = 64 * 1024 * 1024
+
+
+class RenderServer:
+    """
+    Служба построения. Запросы из всех соединений собираются в порции (до batch_size запросов или
+    за batch_delay секунд) и передаются в пул процессов; исполнитель строит изображения одного формата
+    одним процессом dot (BatchRenderer). Результаты хранятся в общем для исполнителей кэше DiskRenderCache.
+    """
+
+    def __init__(self, path=default_socket, workers=None, cache_path=default_cache, path_to_dot='dot',
+                 batch_size=16, batch_delay=0.005, timeout=60.0):
+        """
+        :param str path: Путь к Unix-сокету.
+        :param int|None workers: Число процессов-исполнителей (None - по числу ядер).
+        :param str|None cache_path: Путь к файлу кэша (None - без кэша).
+        :param str path_to_dot: Путь к исполняемому файлу dot.
+        :param int batch_size: Наибольшее число запросов в порции.
+        :param float batch_delay: Сколько секунд ждать запросы для порции.
+        :param float|None timeout: Сколько секунд ждать построения одного графа.
+        """
+        if batch_size <= 0:
+            raise ValueError('Размер порции должен быть положительным.')
+        self.path = path
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_path = cache_path
+        self.path_to_dot = path_to_dot
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.timeout = timeout
+        self._executor = None
+        self._pending = []
+        self._flush_handle = None
+        self._batches = set()
+
+    async def serve(self):
+        """
+        Запускает службу и обслуживает соединения до SIGINT или SIGTERM.
+        """
+        if not hasattr(socket, 'AF_UNIX'):
+            raise OSError('Unix-сокеты не поддерживаются этой системой.')
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        self._executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                             initargs=(self.cache_path, self.path_to_dot, self.timeout))
+        loop = asyncio.get_running_loop()
+        # исполнители запускаются сразу, чтобы первый запрос не ждал их запуска
+        await asyncio.gather(*[loop.run_in_executor(self._executor, _ping) for _ in range(self.workers)])
+
+        stop = loop.create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, lambda: stop.done() or stop.set_result(None))
+
+        server = await asyncio.start_unix_server(self._handle_connection, self.path, limit=_line_limit)
+        try:
+            await stop
+        finally:
+            server.close()
+            await server.wait_closed()
+            # порции, которые ещё выполняются, дописываются до остановки пула; при отмене serve - отменяются
+            self._flush()
+            batches = list(self._batches)
+            try:
+                await asyncio.gather(*batches, return_exceptions=True)
+            finally:
+                for task in batches:
+                    task.cancel()
+                self._executor.shutdown()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def _handle_connection(self, reader, writer):
+        # ответы пишутся отдельной задачей в порядке запросов, а новые запросы читаются, не дожидаясь ответов
+        responses = asyncio.Queue()
+        sender = asyncio.ensure_future(self._send_responses(responses, writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if len(line) == 0:
+                    break
+                if len(line.strip()) != 0:
+                    responses.put_nowait(self._submit(line))
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            responses.put_nowait(None)
+            await sender
+
+    @staticmethod
+    async def _send_responses(responses, writer):
+        try:
+            while True:
+                future = await responses.get()
+                if future is None:
+                    break
+                writer.write(json.dumps(await future).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _submit(self, line):
+        """
+        Добавляет запрос в текущую порцию.
+
+        :param bytes line: Строка запроса.
+        :rtype : asyncio.Future
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('Запрос должен быть объектом.')
+        except ValueError as error:
+            future.set_result({'id': None, 'ok': False, 'error': str(error)})
+            return future
+
+        self._pending.append((request, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_delay, self._flush)
+        return future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if len(batch) != 0:
+            # цикл событий хранит только слабые ссылки на задачи: без ссылки порция может быть собрана сборщиком
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self._executor, _handle_batch, [request for request, _ in batch])
+        except Exception as error:
+            results = [{'id': request.get('id'), 'ok': False, 'error': str(error)} for request, _ in batch]
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+# состояние процесса-исполнителя
+_cache = None
+""":type : DiskRenderCache|None"""
+_path_to_dot = 'dot'
+_timeout = None
+
+
+def _init_worker(cache_path, path_to_dot, timeout):
+    global _cache, _path_to_dot, _timeout
+    _cache = DiskRenderCache(cache_path) if cache_path is not None else None
+    _path_to_dot = path_to_dot
+    _timeout = timeout
+
+
+def _ping():
+    return os.getpid()
+
+
+def _handle_batch(requests):
+    """
+    Выполняет порцию запросов (в процессе-исполнителе). Изображения одного формата строятся одним процессом dot.
+
+    :param list[dict] requests: Запросы.
+    :rtype : list[dict]
+    """
+    results = [None] * len(requests)
+    images = {}
+    """:type : dict[str, list[(int, bytes|None, bytes)]]"""
+    for index, request in enumerate(requests):
+        response = {'id': request.get('id')}
+        try:
+            graph = _make_graph(request)
+            key = DiskRenderCache.key_for(graph) if _cache is not None else None
+            fmt = request.get('format', 'dot')
+            dot = _cache.render(graph) if _cache is not None else graph.to_graph().to_dot()
+            if fmt == 'dot':
+                response.update(ok=True, format=fmt, dot=dot)
+            else:
+                image = _cache.get(key, fmt) if key is not None else None
+                if image is None:
+                    images.setdefault(fmt, []).append((index, key, dot.encode('utf-8')))
+                    response = None
+                else:
+                    response.update(ok=True, format=fmt, data=base64.b64encode(image).decode('ascii'))
+        except Exception as error:
+            # ошибка одной модели (в том числе при построении) не должна ронять остальные запросы порции
+            response = {'id': request.get('id'), 'ok': False, 'error': str(error) or type(error).__name__}
+        results[index] = response
+
+    for fmt, jobs in images.items():
+        rendered = BatchRenderer(fmt, _path_to_dot, timeout=_timeout).render([script for _, _, script in jobs])
+        for (index, key, _), image in zip(jobs, rendered):
+            response = {'id': requests[index].get('id')}
+            if isinstance(image, GraphvizError):
+                response.update(ok=False, error='{0} {1}'.format(image, image.stderr).strip())
+            else:
+                if key is not None:
+                    _cache.put(key, fmt, image)
+                response.update(ok=True, format=fmt, data=base64.b64encode(image).decode('ascii'))
+            results[index] = response
+    return results
+
+
+def _make_graph(request):
+    """
+    :param dict request: Запрос.
+    :rtype : ExplainingGraph
+    """
+    if 'regex' in request:
+        return RegexParser.parse(request['regex'], request.get('is_exact', False),
+                                 request.get('is_case_sensitive', True))
+    if 'model' in request:
+        return from_dict(request['model'])
+    raise ValueError('В запросе нет ни regex, ни model.')
+
+
+def request(requests, path=default_socket, timeout=None):
+    """
+    Отправляет запросы службе по одному соединению и возвращает ответы.
+
+    :param list[dict] requests: Запросы.
+    :param str path: Путь к Unix-сокету службы.
+    :param float|None timeout: Сколько секунд ждать ответа.
+    :rtype : list[dict]
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(path)
+        connection.sendall(b''.join(json.dumps(item).encode('utf-8') + b'\n' for item in requests))
+        connection.shutdown(socket.SHUT_WR)
+        with connection.makefile('rb') as stream:
+            return [json.loads(line) for line in stream]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m egraph.server', description='Служба построения объясняющих графов.')
+    parser.add_argument('--socket', default=default_socket, help='путь к Unix-сокету')
+    parser.add_argument('--workers', type=int, default=None, help='число процессов-исполнителей')
+    parser.add_argument('--cache', default=default_cache, help='путь к файлу кэша')
+    parser.add_argument('--no-cache', action='store_true', help='не использовать кэш')
+    parser.add_argument('--dot', default='dot', help='путь к исполняемому файлу dot')
+    parser.add_argument('--batch-size', type=int, default=16, help='наибольшее число запросов в порции')
+    parser.add_argument('--timeout', type=float, default=60.0, help='сколько секунд ждать построения графа')
+    args = parser.parse_args(argv)
+
+    server = RenderServer(args.socket, args.workers, None if args.no_cache else args.cache, args.dot,
+                          args.batch_size, timeout=args.timeout)
+    asyncio.run(server.serve())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+__author__ = 'Владимир'
+
+# Необязательная трассировка построения графа. Пока трассировщик не включён, стадии построения вызывают
+# только span(), который возвращает общий пустой контекстный менеджер, поэтому цена выключенной
+# трассировки - один вызов функции на стадию.
+#
+#     with tracing.tracing() as tracer:
+#         graph.to_graph().to_dot()
+#     tracer.write_chrome_trace('trace.json')    # открыть в chrome://tracing или https://ui.perfetto.dev
+
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import threading
+import time
+
+_current = None
+""":type : Tracer|None"""
+
+_disabled = nullcontext()
+
+
+class TraceEvent:
+    """
+    Начало или конец стадии построения.
+    """
+
+    __slots__ = ('name', 'phase', 'time', 'thread', 'args')
+
+    def __init__(self, name, phase, time, thread, args):
+        self.name = name
+        """:type : str"""
+        self.phase = phase
+        """:type : str"""
+        self.time = time
+        """:type : float"""
+        self.thread = thread
+        """:type : int"""
+        self.args = args
+        """:type : dict"""
+
+    def __repr__(self):
+        return 'TraceEvent({0!r}, {1!r}, {2!r})'.format(self.name, self.phase, self.args)
+
+
+class Tracer:
+    """
+    Получатель событий трассировки. События сохраняются (если record) и передаются подписчикам:
+    callback(event) вызывается в начале и в конце каждой стадии.
+    В аргументах событий - число узлов и связей графа, а в конце стадии ещё и число поисков
+    и удалений за время стадии.
+    """
+
+    def __init__(self, record=True):
+        """
+        :param bool record: Сохранять ли события для экспорта.
+        """
+        self.record = record
+        self.events = []
+        """:type : list[TraceEvent]"""
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback):
+        """
+        :param callback: Функция callback(event: TraceEvent).
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def emit(self, name, phase, args):
+        """
+        :param str name: Имя стадии.
+        :param str phase: 'begin' или 'end'.
+        :param dict args: Аргументы события.
+        """
+        event = TraceEvent(name, phase, time.perf_counter(), threading.get_ident(), args)
+        if self.record:
+            with self._lock:
+                self.events.append(event)
+        for callback in self._listeners:
+            callback(event)
+
+    @contextmanager
+    def span(self, name, graph=None):
+        """
+        Стадия построения.
+
+        :param str name: Имя стадии.
+        :param egraph.dot.DotDigraph|None graph: Граф, по которому считаются узлы, связи, поиски и удаления.
+        """
+        before = _counters(graph)
+        self.emit(name, 'begin', {key: before[key] for key in ('nodes', 'links') if key in before})
+        try:
+            yield
+        finally:
+            after = _counters(graph)
+            for key in ('lookups', 'removals'):
+                if key in after:
+                    after[key] -= before[key]
+            self.emit(name, 'end', after)
+
+    def to_chrome_trace(self):
+        """
+        События в формате Chrome trace event (пары событий B/E, время в микросекундах).
+
+        :rtype : dict
+        """
+        start = self.events[0].time if len(self.events) != 0 else 0.0
+        pid = os.getpid()
+        return {
+            'traceEvents': [{
+                'name': event.name,
+                'cat': 'egraph',
+                'ph': 'B' if event.phase == 'begin' else 'E',
+                'ts': (event.time - start) * 1e6,
+                'pid': pid,
+                'tid': event.thread,
+                'args': event.args,
+            } for event in self.events],
+            'displayTimeUnit': 'ms',
+        }
+
+    def write_chrome_trace(self, path):
+        """
+        :param str path: Путь к файлу трассировки.
+        """
+        with open(path, 'w', encoding='utf-8') as fp:
+            json.dump(self.to_chrome_trace(), fp)
+
+
+def _counters(graph):
+    if graph is None:
+        return {}
+    counters = {'nodes': graph.node_count(), 'links': graph.link_count()}
+    index = graph._index
+    if hasattr(index, 'lookups'):   # egraph.dot.CountingIndex
+        counters['lookups'] = index.lookups
+        counters['removals'] = index.removals
+    return counters
+
+
+def current():
+    """
+    Включённый трассировщик или None.
+
+    :rtype : Tracer|None
+    """
+    return _current
+
+
+def span(name, graph=None):
+    """
+    Стадия построения у включённого трассировщика; при выключенной трассировке - пустой контекстный менеджер.
+
+    :param str name: Имя стадии.
+    :param egraph.dot.DotDigraph|None graph: Граф стадии.
+    """
+    if _current is None:
+        return _disabled
+    return _current.span(name, graph)
+
+
+@contextmanager
+def tracing(tracer=None):
+    """
+    Включает трассировку на время блока. Трассировщик общий для всех потоков процесса.
+
+    :param Tracer|None tracer: Трассировщик (по умолчанию новый, сохраняющий события).
+    :rtype : Tracer
+    """
+    global _current
+    if tracer is None:
+        tracer = Tracer()
+    previous = _current
+    _current = tracer
+    try:
+        yield tracer
+    finally:
+        _current = previous
@@ -0,0 +1,45 @@
+__author__ = 'Владимир'
+
+import unittest
+
+from egraph.jsonmodel import ModelFormatError, from_dict, from_json, to_json
+from egraph.parser import RegexParser
+
+
+def model(*parts):
+    return {'type': 'ExplainingGraph', 'branches': [list(parts)]}
+
+
+class FromDictTest(unittest.TestCase):
+    def assertPath(self, data, path):
+        with self.assertRaises(ModelFormatError) as context:
+            from_dict(data)
+        self.assertEqual(context.exception.path, path)
+        self.assertIn(path, str(context.exception))
+
+    def test_round_trip(self):
+        graph = RegexParser.parse(r'[^a-z\d]+(a)(?(1)x|y)(?=q)\1', True, False)
+        self.assertEqual(from_json(to_json(graph)).to_graph().to_dot(), graph.to_graph().to_dot())
+
+    def test_empty_range(self):
+        data = model({'type': 'CharacterClass', 'parts': [{'type': 'Range', 'start': '', 'end': 'b'}]})
+        self.assertPath(data, '$.branches[0][0].parts[0].start')
+
+    def test_missing_field(self):
+        self.assertPath(model({'type': 'Text', 'text': 'a'}, {'type': 'Quantifier'}), '$.branches[0][1].min')
+
+    def test_wrong_field_type(self):
+        self.assertPath(model({'type': 'Text', 'text': None}), '$.branches[0][0].text')
+        self.assertPath(model({'type': 'Charflag', 'kind': 7}), '$.branches[0][0].kind')
+
+    def test_wrong_value(self):
+        self.assertPath(model({'type': 'Quantifier', 'min': 5, 'max': 2}), '$.branches[0][0]')
+
+    def test_wrong_structure(self):
+        self.assertPath({'type': 'ExplainingGraph', 'branches': 5}, '$.branches')
+        self.assertPath(model({'type': 'ConditionalSubexpression', 'condition': {'type': 'SubexpressionCall'},
+                               'branch_true': [{'type': 'Nope'}]}), '$.branches[0][0].branch_true[0]')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+__author__ = 'Владимир'
+
+import unittest
+
+from egraph.egraph import ExplainingGraph, AssertComplex, AssertComplexType, OptionCaseSensitivity, Text
+from egraph.parser import RegexParser
+
+
+def text_nodes(graph):
+    """
+    Текстовые узлы построенного графа в порядке добавления.
+
+    :param ExplainingGraph graph: Модель графа.
+    :rtype : list[(str, bool)]
+    :return: Пары (текст, чувствителен ли к регистру).
+    """
+    result = []
+    stack = [graph.to_graph()]
+    while len(stack) != 0:
+        group = stack.pop()
+        result += [(node._label, node.fillcolor != 'lightgrey') for node in group.items.nodes()
+                   if node._comment == Text.__name__]
+        stack.extend(reversed(list(group.items.groups())))
+    return result
+
+
+class CaseOptionTest(unittest.TestCase):
+    """
+    Опция (?i) действует до конца группы, в том числе в следующих альтернативах.
+    """
+
+    def test_option_carries_into_later_alternatives(self):
+        graph = RegexParser.parse('(?i)a|b', False, True)
+        self.assertEqual(text_nodes(graph), [('a', False), ('b', False)])
+
+    def test_option_ends_with_its_group(self):
+        graph = RegexParser.parse('(x(?i)a|b)c', False, True)
+        self.assertEqual(sorted(text_nodes(graph)), [('a', False), ('b', False), ('c', True), ('x', True)])
+
+    def test_option_does_not_reach_earlier_alternatives(self):
+        graph = RegexParser.parse('a|(?i)b|c', False, True)
+        self.assertEqual(text_nodes(graph), [('a', True), ('b', False), ('c', False)])
+
+    def test_option_carries_into_scoped_group_alternatives(self):
+        graph = RegexParser.parse('(?i:a|b)c', False, True)
+        self.assertEqual(sorted(text_nodes(graph)), [('a', False), ('b', False), ('c', True)])
+
+
+class TrailingOptionTest(unittest.TestCase):
+    """
+    Опция в конце тела утверждения не должна ломать построение графа.
+    """
+
+    def test_trailing_option_in_assertion(self):
+        for pattern in ('(?=a(?i))b', '(?<=a(?i))b', '(?=(?i))b', '(?!a(?i)|c)b'):
+            with self.subTest(pattern=pattern):
+                graph = RegexParser.parse(pattern, False, True)
+                self.assertIn('"b"', graph.to_graph().to_dot())
+
+    def test_trailing_option_in_assertion_model(self):
+        for body in ([Text('a'), OptionCaseSensitivity(True)], [OptionCaseSensitivity(True)]):
+            with self.subTest(body=len(body)):
+                assertion = AssertComplex(AssertComplexType.pla)
+                assertion.add_branch(body)
+                graph = ExplainingGraph()
+                graph.add_branch([assertion, Text('b')])
+                self.assertIn('"b"', graph.to_graph().to_dot())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+__author__ = 'Владимир'
+
+import copy
+import pickle
+import unittest
+
+from egraph.cache import IncrementalCache
+from egraph.egraph import ExplainingGraph, Subexpression, Text
+
+
+def nested(depth):
+    """
+    Граф из depth вложенных подвыражений с символом a внутри.
+
+    :rtype : (ExplainingGraph, Text)
+    """
+    leaf = Text('a')
+    inner = [leaf]
+    for _ in range(depth):
+        group = Subexpression()
+        group.add_branch(inner)
+        inner = [group]
+    graph = ExplainingGraph()
+    graph.add_branch(inner)
+    return graph, leaf
+
+
+def pickle_copy(value):
+    return pickle.loads(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+class CopyTest(unittest.TestCase):
+    """
+    Копии частей не захватывают предков и построенные фрагменты.
+    """
+
+    def test_subtree_copy_leaves_ancestors_behind(self):
+        graph, leaf = nested(3)
+        graph.lowering_cache = IncrementalCache()
+        graph.to_graph()
+        for make in (copy.deepcopy, pickle_copy):
+            with self.subTest(make=make.__name__):
+                twin = make(leaf)
+                self.assertEqual(twin._parents, ())
+                self.assertIsNone(twin._lowered)
+                self.assertEqual(twin, leaf)
+
+    def test_copy_is_linked_to_itself(self):
+        graph, _ = nested(3)
+        expected = graph.to_graph().to_dot()
+        for make in (copy.deepcopy, pickle_copy):
+            with self.subTest(make=make.__name__):
+                twin = make(graph)
+                twin.fingerprint
+                graph.fingerprint
+                twin[0][0][0][0][0][0][0][0].text = 'b'
+                self.assertTrue(twin.is_dirty)
+                self.assertFalse(graph.is_dirty)
+                self.assertEqual(graph.to_graph().to_dot(), expected)
+                self.assertNotEqual(twin.to_graph().to_dot(), expected)
+
+    def test_deep_model_copies(self):
+        graph, _ = nested(100)
+        self.assertEqual(copy.deepcopy(graph).to_graph().to_dot(), graph.to_graph().to_dot())
+
+
+class HashTest(unittest.TestCase):
+    """
+    Части остаются в словарях и множествах после правки.
+    """
+
+    def test_edited_part_stays_in_set(self):
+        graph, leaf = nested(2)
+        parts = {leaf, graph}
+        leaf.text = 'b'
+        self.assertIn(leaf, parts)
+        self.assertIn(graph, parts)
+
+
+if __name__ == '__main__':
+    unittest.main()